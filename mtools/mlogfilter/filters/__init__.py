@@ -5,3 +5,4 @@ from .logline_filter import LogLineFilter
 from .tablescan_filter import TableScanFilter
 from .word_filter import WordFilter
 from .mask_filter import MaskFilter
+from .where_filter import WhereFilter
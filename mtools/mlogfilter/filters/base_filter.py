@@ -1,9 +1,66 @@
+import re
+import time
+
+from mtools.util import OrderedDict
+
+
+def to_bytes(s):
+    """Encode s as UTF-8 unless it already is bytes."""
+    return s if isinstance(s, bytes) else s.encode('utf-8')
+
+
+def substring_predicate(substrings):
+    """Raw predicate: the line contains any of the given substrings."""
+    substrings = [to_bytes(s) for s in substrings]
+    if len(substrings) == 1:
+        substring = substrings[0]
+        return lambda line: substring in line
+    return lambda line: any(s in line for s in substrings)
+
+
+def regex_predicate(pattern, flags=0):
+    """Raw predicate: the bytes regular expression matches the line."""
+    search = re.compile(pattern, flags).search
+    return lambda line: search(line) is not None
+
+
+def token_predicate(position, values):
+    """Raw predicate: the whitespace separated token at position in values."""
+    values = set(to_bytes(v) for v in values)
+
+    def predicate(line):
+        tokens = line.split(None, position + 1)
+        return len(tokens) > position and tokens[position] in values
+    return predicate
+
+
+def duration_predicate(line):
+    """Raw predicate: the line can have a duration (see LogEvent)."""
+    return line.rstrip()[-2:] == b'ms' or b'flushing' in line
+
+
+def all_predicate(predicates):
+    """Combine raw predicates, ignoring None, return None if there are none."""
+    predicates = [p for p in predicates if p is not None]
+    if not predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def predicate(line):
+        for p in predicates:
+            if not p(line):
+                return False
+        return True
+    return predicate
+
+
 class BaseFilter(object):
     """
     Base Filter class.
 
     All filters need to derive from it and implement their version of
-    filterArgs, accept, and optionally skipRemaining.
+    filterArgs, accept, and optionally skipRemaining and rawPredicate.
 
     filterArgs needs to be a list of tuples with 2 elements each. The
     first tuple element is the filter argument, e.g. --xyz. The second
@@ -13,6 +70,14 @@ class BaseFilter(object):
 
     filterArgs = []
 
+    # relative cost of accept(), from 1 for a datetime comparison to 10 for
+    # regular expressions and query patterns, cheap filters are asked first
+    cost = 5
+
+    # True if accept() keeps state between lines, these filters are asked
+    # first so they see the same lines as without other filters
+    stateful = False
+
     def __init__(self, mlogfilter):
         """
         Constructor.
@@ -42,6 +107,18 @@ class BaseFilter(object):
         """
         return True
 
+    def rawPredicate(self):
+        """
+        Return a necessary condition on the raw line, or None.
+
+        Overwrite this method in subclass to return a function that is called
+        with the raw bytes of each line before a LogEvent is created. It
+        must return False only for lines that accept() would reject, so that
+        they can be skipped without parsing. The functions above build such
+        predicates from substrings, regular expressions or token positions.
+        """
+        return None
+
     def skipRemaining(self):
         """
         Skip remaining lines.
@@ -50,3 +127,143 @@ class BaseFilter(object):
         from here to the end of the file should be rejected (no output).
         """
         return False
+
+    def cache_key(self):
+        """
+        Return what decides which lines accept() takes, or None.
+
+        mlogfilter --cache stores the matching lines of a query under the
+        cache keys of its filters (see ResultCache), so the key has to be
+        JSON serializable and the same only for filters that accept the same
+        lines. By default these are the values of the filter's arguments,
+        filters that depend on more than that (the current time, other
+        files) overwrite cache_key() or return None if they can't be cached.
+        """
+        args = self.mlogfilter.args
+        return dict((dest, args.get(dest)) for dest in
+                    (kwargs.get('dest', option.lstrip('-').replace('-', '_'))
+                     for option, kwargs in self.filterArgs))
+
+    def state(self):
+        """
+        Return the state that accept() of the next line depends on.
+
+        mlogfilter --jobs filters chunks of the log file in parallel and
+        compares the states of consecutive chunks, so stateful filters
+        overwrite state(), set_state() and resume(). The state has to be
+        picklable and comparable.
+        """
+        return None
+
+    def set_state(self, state):
+        """Continue from a state returned by state()."""
+        pass
+
+    def resume(self, logevent):
+        """
+        Guess the state after logevent, the last line with a datetime.
+
+        Called before a chunk of the log file is filtered in parallel,
+        logevent is the last line with a datetime before the chunk, or None.
+        A wrong guess is only slower, the chunk is then filtered again with
+        the state of the chunk before.
+        """
+        pass
+
+
+class FilterChain(object):
+    """
+    Ask several filters whether to accept a log event, in order of cost.
+
+    accept() stops at the first filter that rejects the log event. Filters
+    are ordered by their cost attribute, stateful filters always come
+    first. With adaptive, the stateless filters are reordered every
+    reorder_interval lines by cost divided by the observed rejection rate,
+    so that cheap filters which reject many lines are asked first. With
+    timed, the time spent in each filter is measured for stats().
+    """
+
+    reorder_interval = 1000
+
+    def __init__(self, filters, adaptive=True, timed=False):
+        filters = sorted(filters, key=lambda f: (not f.stateful, f.cost))
+        self.filters = filters
+        self.adaptive = adaptive and len(filters) > 1
+        self._num_stateful = len([f for f in filters if f.stateful])
+
+        # per filter, in the original order
+        self._accepts = [f.accept for f in filters]
+        self.calls = [0] * len(filters)
+        self.rejected = [0] * len(filters)
+        self.seconds = [0.] * len(filters)
+
+        # indexes of the filters in the order they are asked
+        self._order = list(range(len(filters)))
+        self._lines = 0
+        if timed:
+            self.accept = self._accept_timed
+
+    def accept(self, logevent):
+        """Return True if all filters accept logevent."""
+        self._lines += 1
+        if self.adaptive and self._lines % self.reorder_interval == 0:
+            self._reorder()
+
+        for i in self._order:
+            self.calls[i] += 1
+            if not self._accepts[i](logevent):
+                self.rejected[i] += 1
+                return False
+        return True
+
+    def _accept_timed(self, logevent):
+        self._lines += 1
+        if self.adaptive and self._lines % self.reorder_interval == 0:
+            self._reorder()
+
+        for i in self._order:
+            self.calls[i] += 1
+            start = time.time()
+            accepted = self._accepts[i](logevent)
+            self.seconds[i] += time.time() - start
+            if not accepted:
+                self.rejected[i] += 1
+                return False
+        return True
+
+    def _reorder(self):
+        def rank(i):
+            # expected cost of a filter per rejected line, with a prior of
+            # one rejection in two calls for filters that were rarely asked
+            rate = (self.rejected[i] + 1.) / (self.calls[i] + 2.)
+            return self.filters[i].cost / rate
+
+        stateless = sorted(self._order[self._num_stateful:], key=rank)
+        self._order = self._order[:self._num_stateful] + stateless
+
+    def skipRemaining(self):
+        """Return True if any filter rejects all remaining lines."""
+        for f in self.filters:
+            if f.skipRemaining():
+                return True
+        return False
+
+    def stats(self):
+        """Return a list of dicts with the statistics of each filter."""
+        rows = []
+        for i in self._order:
+            row = OrderedDict()
+            row['filter'] = self.filters[i].__class__.__name__
+            row['cost'] = self.filters[i].cost
+            row['lines'] = self.calls[i]
+            row['rejected'] = self.rejected[i]
+            row['time'] = '%.3f' % self.seconds[i]
+            rows.append(row)
+        return rows
+
+    def add_stats(self, calls, rejected, seconds):
+        """Add the statistics of another chain over the same filters."""
+        for i in range(len(self.filters)):
+            self.calls[i] += calls[i]
+            self.rejected[i] += rejected[i]
+            self.seconds[i] += seconds[i]
@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from datetime import MAXYEAR, datetime, timedelta
 
 from dateutil.tz import tzutc
@@ -65,6 +66,17 @@ class DateTimeFilter(BaseFilter):
 
         --from 20:15 --to +3m
             goes from today's date at 20:15:00 to today's date at 20:18:00
+
+    Several windows can be given as lists of --from and --to values
+    separated by WINDOW_SEPARATOR, or with --windows FILE, one "FROM; TO"
+    window per line. The separator is not a comma, which can be part of a
+    date. A single --to value is used for all windows (missing TO values in
+    the file as well). Log files are fast-forwarded from the end of one
+    window to the start of the next, and reading stops after the last
+    window.
+
+        --from "Aug 5 20:10; Aug 5 20:40" --to +5min
+            goes from 20:10:00 to 20:15:00 and from 20:40:00 to 20:45:00
     """
 
     filterArgs = [
@@ -72,9 +84,19 @@ class DateTimeFilter(BaseFilter):
                     'default': 'start',
                     'help': 'output starting at FROM', 'dest': 'from'}),
         ('--to', {'action': 'store', 'type': custom_parse_dt, 'nargs': '*',
-                  'default': 'end', 'help': 'output up to TO', 'dest': 'to'})
+                  'default': 'end', 'help': 'output up to TO', 'dest': 'to'}),
+        ('--windows', {'action': 'store', 'metavar': 'FILE',
+                       'help': ('output the time windows listed in FILE, '
+                                'one "FROM; TO" window per line')})
         ]
 
+    # separates the windows of --from and --to, and FROM and TO in --windows
+    WINDOW_SEPARATOR = ';'
+
+    cost = 1
+    # accept() tracks whether --from and --to have been reached
+    stateful = True
+
     timeunits = ['s', 'sec', 'm', 'min', 'h', 'hours', 'd', 'days', 'w',
                  'weeks', 'mo', 'months', 'y', 'years']
     weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
@@ -103,7 +125,8 @@ class DateTimeFilter(BaseFilter):
         self.active = (('from' in self.mlogfilter.args and
                         self.mlogfilter.args['from'] != 'start') or
                        ('to' in self.mlogfilter.args and
-                        self.mlogfilter.args['to'] != 'end'))
+                        self.mlogfilter.args['to'] != 'end') or
+                       bool(self.mlogfilter.args.get('windows')))
 
     def setup(self):
         """Get start end end date of logfile before starting to parse."""
@@ -127,28 +150,130 @@ class DateTimeFilter(BaseFilter):
 
         # now parse for further changes to from and to datetimes
         dtbound = DateTimeBoundaries(self.startDateTime, self.endDateTime)
-        self.fromDateTime, self.toDateTime = dtbound(self.mlogfilter
-                                                     .args['from'] or None,
-                                                     self.mlogfilter
-                                                     .args['to'] or None)
+        windows = sorted(dtbound(start or None, end or None)
+                         for start, end in self._window_args())
+
+        # merge overlapping windows
+        self.windows = windows[:1]
+        for start, end in windows[1:]:
+            if start <= self.windows[-1][1]:
+                self.windows[-1] = (self.windows[-1][0],
+                                    max(end, self.windows[-1][1]))
+            else:
+                self.windows.append((start, end))
+        self.window_ends = [end for _, end in self.windows]
+        # index of the window of the last line, and the last window that
+        # the log files were fast-forwarded to
+        self.window = 0
+        self.forwarded = 0
+        self.last_dt = None
+
+        self.fromDateTime = self.windows[0][0]
+        self.toDateTime = self.windows[-1][1]
 
         # define start_limit for mlogfilter's fast_forward method
         self.start_limit = self.fromDateTime
 
-        # for single logfile, get file seek position of `to` datetime
-        if (len(self.mlogfilter.args['logfile']) == 1 and not
-                self.mlogfilter.is_stdin):
-
-            if self.mlogfilter.args['to'] != "end":
-                # fast forward, get seek value, then reset file
-                logfile = self.mlogfilter.args['logfile'][0]
-                logfile.fast_forward(self.toDateTime)
-                self.seek_to = logfile.filehandle.tell()
-                logfile.filehandle.seek(0)
-            else:
-                self.seek_to = -1
-        else:
-            self.seek_to = False
+        # seeking would skip the lines that --exclude prints
+        self.seek = (not self.mlogfilter.is_stdin and
+                     not self.mlogfilter.args['exclude'])
+
+        # each log file stops at its first line after the last window
+        bounded = self.seek and self.toDateTime < self.endDateTime
+        if bounded:
+            for logfile, tz in zip(self.mlogfilter.args['logfile'],
+                                   self.mlogfilter.args['timezone']):
+                offset = logfile.offset_after(self.toDateTime -
+                                              timedelta(hours=tz))
+                if offset is not None:
+                    logfile.end_offset = offset
+
+        # a single log file that ends at --to needs no datetime checks once
+        # --from is reached
+        self.accept_all = (len(self.mlogfilter.args['logfile']) == 1 and
+                           len(self.windows) == 1 and
+                           not self.mlogfilter.is_stdin and
+                           (bounded or self.toDateTime >= self.endDateTime))
+
+    def _window_args(self):
+        """Return a list of (from, to) strings of all windows."""
+        args = self.mlogfilter.args
+        sep = self.WINDOW_SEPARATOR
+        froms = [v.strip() for v in (args['from'] or 'start').split(sep)]
+        tos = [v.strip() for v in (args['to'] or 'end').split(sep)]
+
+        if args.get('windows'):
+            if args['from'] != 'start' or len(tos) > 1:
+                raise SystemExit('Error: use either --windows or several '
+                                 '--from values.')
+            froms = []
+            with open(args['windows']) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    values = [v.strip() for v in line.split(sep)]
+                    if len(values) > 2:
+                        raise SystemExit("Error: can't parse window '%s', "
+                                         "use FROM%s TO." % (line, sep))
+                    froms.append(values[0])
+                    tos.append(values[1] if len(values) == 2 else tos[0])
+            if not froms:
+                raise SystemExit('Error: no windows found in %s.'
+                                 % args['windows'])
+            tos = tos[1:]
+
+        if len(tos) == 1:
+            tos = tos * len(froms)
+        elif len(froms) == 1:
+            froms = froms * len(tos)
+        elif len(froms) != len(tos):
+            raise SystemExit('Error: number of --from and --to values '
+                             'differs.')
+        return list(zip(froms, tos))
+
+    def _fast_forward(self, dt):
+        """Seek all log files forward to the lines before dt."""
+        for logfile, tz in zip(self.mlogfilter.args['logfile'],
+                               self.mlogfilter.args['timezone']):
+            offset = logfile.filehandle.tell()
+            # the log file's own time, without --timezone adjustment
+            logfile.fast_forward(dt - timedelta(hours=tz))
+            if logfile.filehandle.tell() < offset:
+                # never go back to lines that were already read
+                logfile.filehandle.seek(offset)
+
+    def _accept_windows(self, logevent):
+        """Process line for several windows."""
+        dt = logevent.datetime
+
+        # if logevent has no datetime, accept if inside of a window
+        if dt is None:
+            return self.fromReached
+
+        if self.last_dt is not None and dt < self.last_dt:
+            # lines out of order, find the window again
+            self.window = bisect_left(self.window_ends, dt)
+            self.toReached = False
+        self.last_dt = dt
+
+        # move past the windows that end before this line
+        windows = self.windows
+        while self.window < len(windows) and dt > windows[self.window][1]:
+            self.window += 1
+
+        if self.window == len(windows):
+            self.fromReached = False
+            self.toReached = True
+            return False
+
+        self.fromReached = windows[self.window][0] <= dt
+        if (not self.fromReached and self.seek and
+                self.forwarded < self.window):
+            # between two windows, skip to the next one
+            self.forwarded = self.window
+            self._fast_forward(windows[self.window][0])
+        return self.fromReached
 
     def accept(self, logevent):
         """
@@ -157,10 +282,10 @@ class DateTimeFilter(BaseFilter):
         Overwrite BaseFilter.accept() and return True if the provided
         logevent should be accepted (causing output), or False if not.
         """
-        if self.fromReached and self.seek_to:
-            if self.seek_to != -1:
-                self.toReached = (self.mlogfilter.args['logfile'][0]
-                                  .filehandle.tell() >= self.seek_to)
+        if len(self.windows) > 1:
+            return self._accept_windows(logevent)
+
+        if self.fromReached and self.accept_all:
             return True
         else:
             # slow version has to check each datetime
@@ -190,3 +315,30 @@ class DateTimeFilter(BaseFilter):
         from here to the end of the file should be rejected (no output).
         """
         return self.toReached
+
+    def cache_key(self):
+        """Return the windows, relative datetimes are resolved by setup()."""
+        return [[start.isoformat(), end.isoformat()]
+                for start, end in self.windows]
+
+    def state(self):
+        """Return whether lines without datetime are accepted."""
+        return self.fromReached
+
+    def set_state(self, state):
+        """Continue with the state of a previous chunk."""
+        self.fromReached = state
+
+    def resume(self, logevent):
+        """Guess whether --from was reached from the last dated line."""
+        if logevent is None:
+            return
+        dt = logevent.datetime
+        self.last_dt = dt
+        if len(self.windows) > 1:
+            self.window = bisect_left(self.window_ends, dt)
+            self.fromReached = (self.window < len(self.windows) and
+                                self.windows[self.window][0] <= dt)
+        else:
+            # --from stays reached after --to
+            self.fromReached = self.fromDateTime <= dt
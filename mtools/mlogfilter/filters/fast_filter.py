@@ -1,4 +1,4 @@
-from .base_filter import BaseFilter
+from .base_filter import BaseFilter, duration_predicate
 
 
 class FastFilter(BaseFilter):
@@ -16,6 +16,8 @@ class FastFilter(BaseFilter):
                              'than FAST ms (default 1000)')})
         ]
 
+    cost = 2
+
     def __init__(self, mlogfilter):
         BaseFilter.__init__(self, mlogfilter)
         if ('fast' in self.mlogfilter.args and
@@ -36,3 +38,7 @@ class FastFilter(BaseFilter):
         if self.active and logevent.duration is not None:
             return logevent.duration <= self.fastms
         return False
+
+    def rawPredicate(self):
+        """Only lines with a duration can be accepted."""
+        return duration_predicate
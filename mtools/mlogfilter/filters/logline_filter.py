@@ -1,4 +1,7 @@
-from .base_filter import BaseFilter
+import re
+
+from .base_filter import (BaseFilter, all_predicate, regex_predicate,
+                          substring_predicate, to_bytes, token_predicate)
 from mtools.util.logevent import LogEvent
 from mtools.util.pattern import json2pattern
 
@@ -71,6 +74,8 @@ class LogLineFilter(BaseFilter):
             })
         ]
 
+    cost = 3
+
     def __init__(self, mlogfilter):
         BaseFilter.__init__(self, mlogfilter)
 
@@ -112,6 +117,8 @@ class LogLineFilter(BaseFilter):
                 self.mlogfilter.args['pattern']):
             self.pattern = json2pattern(self.mlogfilter.args['pattern'])
             self.active = True
+            # the query of each line has to be parsed into a pattern
+            self.cost = 10
             if self.pattern is None:
                 raise SystemExit("ERROR: cannot parse pattern \"%s\" as a JSON"
                                  " string" % self.mlogfilter.args['pattern'])
@@ -150,3 +157,45 @@ class LogLineFilter(BaseFilter):
             return False
 
         return True
+
+    def rawPredicate(self):
+        """
+        Return a necessary condition on the raw line.
+
+        Level and component are the second and third token, the other
+        fields need to appear as (whitespace separated) tokens in the line.
+        There is no raw condition for --pattern.
+        """
+        def alternatives(values):
+            return b'|'.join(re.escape(to_bytes(v)) for v in values)
+
+        predicates = []
+        if self.levels:
+            predicates.append(token_predicate(1, self.levels))
+        if self.components:
+            predicates.append(token_predicate(2, self.components))
+        if self.namespaces:
+            predicates.append(regex_predicate(
+                br'(?:^|\s)(?:' + alternatives(self.namespaces) +
+                br')(?:\s|$)'))
+        if self.operations:
+            # operations are compared in lower case
+            predicates.append(regex_predicate(
+                br'(?:^|\s)(?:' + alternatives(self.operations) +
+                br')(?:\s|$)', re.IGNORECASE))
+        if self.commands:
+            predicates.append(regex_predicate(
+                br'(?:^|\s)command:\s+(?:{\s+)?(?:' +
+                alternatives(self.commands) + br')', re.IGNORECASE))
+        if self.threads:
+            # either the thread name or the connection number for
+            # "connection accepted" lines
+            substrings = []
+            for thread in self.threads:
+                substrings.append('[%s]' % thread)
+                if thread.startswith('conn'):
+                    substrings.append('#' + thread[4:])
+            predicates.append(substring_predicate(substrings))
+        if self.planSummaries:
+            predicates.append(substring_predicate(self.planSummaries))
+        return all_predicate(predicates)
@@ -1,3 +1,6 @@
+import hashlib
+import json
+from bisect import bisect_right
 from datetime import timedelta
 
 from .datetime_filter import DateTimeFilter
@@ -23,6 +26,10 @@ class MaskFilter(DateTimeFilter):
 
         grep "assert" mongod.log > assertions.log
         mlogfilter mongod.log --mask assertions.log --mask-size 60
+
+    The masked intervals are kept sorted and a cursor follows the log lines
+    through them. Lines in gaps longer than seek_gap between two intervals
+    are skipped by fast-forwarding the log files to the next interval.
     """
 
     filterArgs = [
@@ -42,6 +49,12 @@ class MaskFilter(DateTimeFilter):
                                     'are returned.')})
         ]
 
+    cost = 4
+    stateful = False
+
+    # gaps between masked intervals that are fast-forwarded
+    seek_gap = timedelta(seconds=60)
+
     def __init__(self, mlogfilter):
         """
         Constructor.
@@ -56,6 +69,12 @@ class MaskFilter(DateTimeFilter):
             self.mask_end_reached = False
             self.mask_source = self.mlogfilter.args['mask']
             self.mask_list = []
+            # ends of the intervals in mask_list, for bisection
+            self.mask_ends = []
+            # index of the first interval that ends after the last line
+            self.cursor = 0
+            self.last_dt = None
+            self.seek = False
 
     def setup(self):
         """
@@ -123,8 +142,10 @@ class MaskFilter(DateTimeFilter):
 
             next_start = (e[0] if type(e) == tuple else e) - self.mask_half_td
             if next_start <= end_point:
-                end_point = ((e[1] if type(e) == tuple else e) +
-                             self.mask_half_td)
+                # with --mask-center both, an event can end before the
+                # previous one
+                end_point = max(end_point, (e[1] if type(e) == tuple else e) +
+                                self.mask_half_td)
             else:
                 mask_list.append((start_point, end_point))
                 start_point, end_point = self._pad_event(e)
@@ -133,6 +154,11 @@ class MaskFilter(DateTimeFilter):
             mask_list.append((start_point, end_point))
 
         self.mask_list = mask_list
+        self.mask_ends = [end for _, end in mask_list]
+
+        # seeking would skip the lines that --exclude prints
+        self.seek = (not self.mlogfilter.is_stdin and
+                     not self.mlogfilter.args['exclude'])
 
     def _pad_event(self, event):
         if type(event) == tuple:
@@ -144,6 +170,12 @@ class MaskFilter(DateTimeFilter):
 
         return start_point, end_point
 
+    def cache_key(self):
+        """Return a digest of the masked intervals, the mask is a file."""
+        intervals = json.dumps([[start.isoformat(), end.isoformat()]
+                                for start, end in self.mask_list])
+        return hashlib.sha1(intervals.encode('utf-8')).hexdigest()
+
     def accept(self, logevent):
         """
         Process line.
@@ -155,10 +187,29 @@ class MaskFilter(DateTimeFilter):
         if not dt:
             return False
 
-        mask = next((mask for mask in self.mask_list
-                     if mask[0] < dt and mask[1] > dt), None)
+        if self.last_dt is not None and dt < self.last_dt:
+            # lines out of order, find the interval again
+            self.cursor = bisect_right(self.mask_ends, dt)
+        self.last_dt = dt
+
+        # move the cursor past the intervals that end before this line
+        mask_ends = self.mask_ends
+        cursor = self.cursor
+        while cursor < len(mask_ends) and mask_ends[cursor] <= dt:
+            cursor += 1
+        self.cursor = cursor
+
+        if cursor == len(mask_ends):
+            self.mask_end_reached = True
+            return False
+
+        mask_start = self.mask_list[cursor][0]
+        if mask_start < dt:
+            return True
 
-        return True if mask else False
+        if self.seek and mask_start - dt > self.seek_gap:
+            self._fast_forward(mask_start)
+        return False
 
     def skipRemaining(self):
         """
@@ -1,4 +1,4 @@
-from .base_filter import BaseFilter
+from .base_filter import BaseFilter, duration_predicate
 
 
 class SlowFilter(BaseFilter):
@@ -16,6 +16,8 @@ class SlowFilter(BaseFilter):
                                           '(default 1000)')})
         ]
 
+    cost = 2
+
     def __init__(self, mlogfilter):
         BaseFilter.__init__(self, mlogfilter)
 
@@ -37,3 +39,7 @@ class SlowFilter(BaseFilter):
         if logevent.duration is not None:
             return logevent.duration >= self.slowms
         return False
+
+    def rawPredicate(self):
+        """Only lines with a duration can be accepted."""
+        return duration_predicate
@@ -1,4 +1,4 @@
-from .base_filter import BaseFilter
+from .base_filter import BaseFilter, all_predicate, substring_predicate
 
 
 class TableScanFilter(BaseFilter):
@@ -19,6 +19,8 @@ class TableScanFilter(BaseFilter):
             })
         ]
 
+    cost = 3
+
     def __init__(self, mlogfilter):
         BaseFilter.__init__(self, mlogfilter)
 
@@ -42,3 +44,9 @@ class TableScanFilter(BaseFilter):
             return (ns > 10000 and ns / nr > 100)
 
         return False
+
+    def rawPredicate(self):
+        """Only lines with both nscanned and nreturned can be accepted."""
+        return all_predicate([
+            substring_predicate([b'nscanned:', b'keysExamined:']),
+            substring_predicate([b'nreturned:', b'nMatched:'])])
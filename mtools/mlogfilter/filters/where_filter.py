@@ -0,0 +1,407 @@
+import operator
+import re
+
+import six
+
+from .base_filter import (BaseFilter, all_predicate, duration_predicate,
+                          regex_predicate, to_bytes, token_predicate)
+from mtools.util.pattern import json2pattern
+
+# field names in expressions -> LogEvent attributes
+FIELDS = {
+    'duration': 'duration', 'namespace': 'namespace', 'ns': 'namespace',
+    'operation': 'operation', 'op': 'operation', 'command': 'command',
+    'thread': 'thread', 'conn': 'conn', 'pattern': 'pattern',
+    'planSummary': 'planSummary', 'actualPlanSummary': 'actualPlanSummary',
+    'level': 'level', 'component': 'component', 'line': 'line_str',
+    'nscanned': 'nscanned', 'keysExamined': 'keysExamined',
+    'nscannedObjects': 'nscannedObjects', 'docsExamined': 'docsExamined',
+    'ntoreturn': 'ntoreturn', 'nreturned': 'nreturned',
+    'ninserted': 'ninserted', 'nupdated': 'nupdated', 'ndeleted': 'ndeleted',
+    'numYields': 'numYields', 'writeConflicts': 'writeConflicts',
+    'r': 'r', 'w': 'w', 'bytesRead': 'bytesRead',
+    'timeAcquiringMicros': 'timeAcquiringMicros'}
+
+NUMERIC = set(['duration', 'nscanned', 'keysExamined', 'nscannedObjects',
+               'docsExamined', 'ntoreturn', 'nreturned', 'ninserted',
+               'nupdated', 'ndeleted', 'numYields', 'writeConflicts', 'r',
+               'w', 'bytesRead', 'timeAcquiringMicros'])
+
+# string fields whose value appears as it is in the raw line
+RAW_STRINGS = set(['namespace', 'operation', 'command', 'thread',
+                   'planSummary'])
+
+KEYWORDS = {'true': True, 'false': False, 'null': None}
+
+ORDERING = {'<': operator.lt, '<=': operator.le, '>': operator.gt,
+            '>=': operator.ge}
+
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+      (?P<number>-?\d+(?:\.\d+)?)
+    | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    | (?P<op>==|!=|<=|>=|=~|!~|<|>|\(|\)|\[|\]|,)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )''', re.VERBOSE)
+
+
+def tokenize(expression):
+    """Return a list of (kind, value) tokens of expression."""
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = TOKEN_RE.match(expression, pos)
+        if not match or match.end() == pos:
+            raise ValueError("unexpected '%s'" % expression[pos:].strip())
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'string':
+            # only the quote itself is escaped, other backslashes are kept
+            # for regular expressions
+            quote = value[0]
+            value = value[1:-1].replace('\\' + quote, quote)
+        elif kind == 'name' and value in ('and', 'or', 'not', 'in'):
+            kind = 'op'
+        tokens.append((kind, value))
+    return tokens
+
+
+class Parser(object):
+    """
+    Recursive descent parser for --where expressions.
+
+    Grammar (and binds stronger than or):
+        expr       := conjunction ('or' conjunction)*
+        conjunction := negation ('and' negation)*
+        negation   := 'not' negation | '(' expr ')' | comparison
+        comparison := operand [('==' | '!=' | '<' | '<=' | '>' | '>=' |
+                               '=~' | '!~' | 'in') operand]
+        operand    := FIELD | NUMBER | STRING | true | false | null |
+                      '[' [operand (',' operand)*] ']'
+
+    The result is a tree of tuples: ('or', [nodes]), ('and', [nodes]),
+    ('not', node), ('cmp', op, left, right), ('truth', operand),
+    ('field', name) and ('const', value).
+    """
+
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if ((kind and token[0] != kind) or
+                (value is not None and token[1] != value)):
+            raise ValueError('expected %s, found %s'
+                             % (value or kind, token[1] or 'end'))
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.expr()
+        if self.peek()[0] is not None:
+            raise ValueError("unexpected '%s'" % self.peek()[1])
+        return node
+
+    def expr(self):
+        nodes = [self.conjunction()]
+        while self.peek() == ('op', 'or'):
+            self.take()
+            nodes.append(self.conjunction())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def conjunction(self):
+        nodes = [self.negation()]
+        while self.peek() == ('op', 'and'):
+            self.take()
+            nodes.append(self.negation())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def negation(self):
+        if self.peek() == ('op', 'not'):
+            self.take()
+            return ('not', self.negation())
+        if self.peek() == ('op', '('):
+            self.take()
+            node = self.expr()
+            self.take('op', ')')
+            return node
+        return self.comparison()
+
+    def comparison(self):
+        left = self.operand()
+        kind, value = self.peek()
+        if kind == 'op' and value in ('==', '!=', '<', '<=', '>', '>=',
+                                      '=~', '!~', 'in'):
+            self.take()
+            return ('cmp', value, left, self.operand())
+        return ('truth', left)
+
+    def operand(self):
+        kind, value = self.take()
+        if kind in ('number', 'string'):
+            return ('const', value)
+        if kind == 'name':
+            if value in KEYWORDS:
+                return ('const', KEYWORDS[value])
+            if value not in FIELDS:
+                raise ValueError("unknown field '%s', choose from %s"
+                                 % (value, ', '.join(sorted(FIELDS))))
+            return ('field', value)
+        if (kind, value) == ('op', '['):
+            values = []
+            while self.peek() != ('op', ']'):
+                if values:
+                    self.take('op', ',')
+                operand = self.operand()
+                if operand[0] != 'const':
+                    raise ValueError('lists can only contain constants')
+                values.append(operand[1])
+            self.take('op', ']')
+            return ('const', values)
+        raise ValueError("unexpected '%s'" % (value or 'end'))
+
+
+def _check_types(op, left, right):
+    """Raise ValueError for comparisons that can't work."""
+    if op in ('=~', '!~'):
+        if (right[0] != 'const' or
+                not isinstance(right[1], six.string_types)):
+            raise ValueError('%s needs a regular expression string on the '
+                             'right' % op)
+        if left[0] == 'field' and left[1] in NUMERIC:
+            raise ValueError("%s can't match numeric field '%s'"
+                             % (op, left[1]))
+    elif op == 'in':
+        if right[0] != 'const' or not isinstance(right[1], list):
+            raise ValueError('in needs a list on the right')
+    elif op in ORDERING:
+        kinds = []
+        for kind, value in (left, right):
+            if kind == 'field':
+                kinds.append('number' if value in NUMERIC else 'string')
+            elif (isinstance(value, (int, float)) and
+                    not isinstance(value, bool)):
+                kinds.append('number')
+            elif isinstance(value, six.string_types):
+                kinds.append('string')
+            else:
+                raise ValueError("can't compare %r with %s" % (value, op))
+        if kinds[0] != kinds[1]:
+            raise ValueError("can't compare a %s with a %s" % tuple(kinds))
+
+
+def _compile_operand(node):
+    kind, value = node
+    if kind == 'field':
+        return operator.attrgetter(FIELDS[value])
+    return lambda logevent: value
+
+
+def compile_node(node):
+    """Return a function of a LogEvent that evaluates node."""
+    kind = node[0]
+    if kind in ('or', 'and'):
+        funcs = [compile_node(n) for n in node[1]]
+        if kind == 'or':
+            if len(funcs) == 2:
+                a, b = funcs
+                return lambda le: a(le) or b(le)
+            return lambda le: any(f(le) for f in funcs)
+        if len(funcs) == 2:
+            a, b = funcs
+            return lambda le: a(le) and b(le)
+        return lambda le: all(f(le) for f in funcs)
+
+    if kind == 'not':
+        func = compile_node(node[1])
+        return lambda le: not func(le)
+
+    if kind == 'truth':
+        get = _compile_operand(node[1])
+        return lambda le: bool(get(le))
+
+    op, left, right = node[1:]
+    _check_types(op, left, right)
+
+    if left[0] == 'field' and left[1] == 'pattern' and right[0] == 'const':
+        # query patterns are compared in their normalized form
+        if isinstance(right[1], list):
+            right = ('const', [json2pattern(v) or v for v in right[1]])
+        elif isinstance(right[1], six.string_types):
+            right = ('const', json2pattern(right[1]) or right[1])
+    if (left[0] == 'field' and left[1] == 'command' and
+            right[0] == 'const'):
+        # commands are lower case
+        if isinstance(right[1], list):
+            right = ('const', [v.lower()
+                               if isinstance(v, six.string_types) else v
+                               for v in right[1]])
+        elif isinstance(right[1], six.string_types):
+            right = ('const', right[1].lower())
+
+    get = _compile_operand(left)
+
+    if op in ('=~', '!~'):
+        search = re.compile(right[1]).search
+        if op == '=~':
+            return lambda le: (lambda v: v is not None and
+                               search(str(v)) is not None)(get(le))
+        return lambda le: (lambda v: v is None or
+                           search(str(v)) is None)(get(le))
+
+    if op == 'in':
+        values = set(right[1])
+        return lambda le: get(le) in values
+
+    if right[0] == 'const':
+        value = right[1]
+        if op == '==':
+            return lambda le: get(le) == value
+        if op == '!=':
+            return lambda le: get(le) != value
+        compare = ORDERING[op]
+        return lambda le: (lambda v: v is not None and
+                           compare(v, value))(get(le))
+
+    get_right = _compile_operand(right)
+    if op == '==':
+        return lambda le: get(le) == get_right(le)
+    if op == '!=':
+        return lambda le: get(le) != get_right(le)
+    compare = ORDERING[op]
+
+    def ordered(le):
+        a = get(le)
+        if a is None:
+            return False
+        b = get_right(le)
+        return b is not None and compare(a, b)
+    return ordered
+
+
+def raw_predicate(node):
+    """
+    Return a necessary condition on the raw line for node, or None.
+
+    Only conjunctions, disjunctions and comparisons of a field with
+    constants have one, see BaseFilter.rawPredicate().
+    """
+    kind = node[0]
+    if kind == 'and':
+        return all_predicate([raw_predicate(n) for n in node[1]])
+
+    if kind == 'or':
+        predicates = [raw_predicate(n) for n in node[1]]
+        if None in predicates:
+            return None
+        return lambda line: any(p(line) for p in predicates)
+
+    if kind == 'truth':
+        if node[1] == ('field', 'duration'):
+            return duration_predicate
+        return None
+
+    if kind != 'cmp' or node[2][0] != 'field' or node[3][0] != 'const':
+        return None
+
+    op, (_, field), (_, value) = node[1:]
+    field = FIELDS[field]
+    if field == 'duration':
+        if op in ORDERING or (op == '==' and value is not None):
+            return duration_predicate
+        return None
+
+    if op == '==':
+        values = [value]
+    elif op == 'in':
+        values = value
+    else:
+        return None
+    if not values or not all(isinstance(v, six.string_types)
+                             for v in values):
+        return None
+
+    if field == 'level':
+        return token_predicate(1, values)
+    if field == 'component':
+        return token_predicate(2, values)
+    if field in RAW_STRINGS and not any(re.search(r'\s', v) for v in values):
+        return regex_predicate(b'|'.join(re.escape(to_bytes(v))
+                                         for v in values), re.IGNORECASE)
+    return None
+
+
+def fields(node):
+    """Return the set of fields that node references."""
+    kind = node[0]
+    if kind in ('or', 'and'):
+        return set().union(*[fields(n) for n in node[1]])
+    if kind in ('not', 'truth'):
+        return fields(node[1])
+    if kind == 'cmp':
+        return fields(node[2]) | fields(node[3])
+    if kind == 'field':
+        return set([FIELDS[node[1]]])
+    return set()
+
+
+class WhereFilter(BaseFilter):
+    """
+    WhereFilter class.
+
+    Accept only lines for which the --where expression is true, for example
+
+        --where 'duration > 500 and ns =~ "^shop\\." and
+                 planSummary == "COLLSCAN"'
+
+    Expressions compare LogEvent fields (see FIELDS) with numbers, strings,
+    true, false, null or lists, using ==, !=, <, <=, >, >=, =~ and !~
+    (regular expression search) and in, combined with and, or, not and
+    parentheses. A field on its own is true if it has a value. Fields that
+    a line doesn't have are null: ordering comparisons and =~ are false for
+    them, != and !~ are true.
+
+    The expression is parsed once and compiled into a function that only
+    evaluates the fields it references. Where possible, a raw predicate
+    skips lines that can't match before they are parsed.
+    """
+
+    filterArgs = [
+        ('--where', {'action': 'store', 'nargs': '*', 'metavar': 'EXPR',
+                     'help': ('only output lines for which the expression '
+                              'EXPR is true, e.g. \'duration > 500 and ns '
+                              '=~ "^shop\\." and planSummary == '
+                              '"COLLSCAN"\'')})
+        ]
+
+    def __init__(self, mlogfilter):
+        BaseFilter.__init__(self, mlogfilter)
+
+        if 'where' in self.mlogfilter.args and self.mlogfilter.args['where']:
+            expression = self.mlogfilter.args['where']
+            try:
+                self.tree = Parser(expression).parse()
+                # the compiled expression replaces accept()
+                self.accept = compile_node(self.tree)
+            except ValueError as e:
+                raise SystemExit("Error: can't parse --where expression "
+                                 "'%s': %s" % (expression, e))
+            self.active = True
+
+            # query patterns are expensive, the other fields are parsed
+            # from the line's tokens
+            self.cost = 10 if 'pattern' in fields(self.tree) else 4
+
+    def rawPredicate(self):
+        """Return the raw predicate of the expression."""
+        return raw_predicate(self.tree)
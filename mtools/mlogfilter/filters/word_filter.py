@@ -11,6 +11,8 @@ class WordFilter(BaseFilter):
                     'help': 'only output lines matching any of WORD'}),
         ]
 
+    cost = 8
+
     def __init__(self, mlogfilter):
         BaseFilter.__init__(self, mlogfilter)
 
@@ -3,22 +3,58 @@
 import inspect
 import re
 import sys
-from datetime import MAXYEAR, MINYEAR, datetime, timedelta
+from datetime import MINYEAR, datetime, timedelta
+from heapq import heapify, heappop, heappush, heappushpop, heapreplace
+from itertools import count
 
 from dateutil.tz import tzutc
 
 import mtools.mlogfilter.filters as filters
+from mtools.mlogfilter.filters.base_filter import (FilterChain, all_predicate,
+                                                   duration_predicate,
+                                                   substring_predicate)
+from mtools.util import OrderedDict, parallel
 from mtools.util.cmdlinetool import LogFileTool
+from mtools.util.logfile import LogFile
+from mtools.util.print_table import print_table
+from mtools.util.resultcache import ResultCache
+from mtools.util.sampling import (BernoulliSampler, ReservoirSampler,
+                                  add_sample_arguments, sampler_from_args)
+
+# sort key of lines without datetime when merging log files
+MIN_DATETIME = datetime(MINYEAR, 1, 1, 0, 0, 0, 0, tzutc())
+
+
+# fields that --top can rank by, with a raw predicate for lines that can
+# have the field (see LogEvent._extract_counters)
+TOP_FIELDS = OrderedDict([
+    ('duration', duration_predicate),
+    ('nscanned', substring_predicate(['nscanned:', 'keysExamined:'])),
+    ('docsExamined', substring_predicate(['nscannedObjects:',
+                                          'docsExamined:'])),
+    ('numYields', substring_predicate(['numYields:']))])
 
 
 class MLogFilterTool(LogFileTool):
 
+    # numbers for --human
+    _number_regex = re.compile(r'(\d+)')
+
     def __init__(self):
         LogFileTool.__init__(self, multiple_logfiles=True, stdin_allowed=True)
 
         # add all filter classes from the filters module
         self.filters = [c[1] for c in inspect.getmembers(filters,
                                                          inspect.isclass)]
+        # raw predicate of --sample, see _sampler()
+        self.sample_predicate = None
+        # output stage of _outputLine()
+        self.writer = OutputWriter(sys.stdout, 0)
+        # --cache, see _cached_lines() and _recording()
+        self.result_cache = None
+        self.cache_keys = None
+        self.cache_offsets = None
+        self.cache_states = None
 
         self.argparser.description = ('mongod/mongos log file parser. Use '
                                       'parameters to enable filters. A line '
@@ -67,6 +103,30 @@ class MLogFilterTool(LogFileTool):
                                                              'iso8601-local'],
                                     help=("choose datetime format for "
                                           "log output"))
+        self.argparser.add_argument('--top', action='store', type=int,
+                                    metavar='N',
+                                    help=("only print the N matching lines "
+                                          "with the largest value of --by, "
+                                          "largest first, after all lines "
+                                          "have been read."))
+        self.argparser.add_argument('--by', action='store',
+                                    default='duration',
+                                    choices=list(TOP_FIELDS),
+                                    help=("field to rank lines by with "
+                                          "--top (default duration)."))
+        add_sample_arguments(self.argparser)
+        self.argparser.add_argument('--jobs', action='store', type=int,
+                                    metavar='N',
+                                    help=("filter a single log file in N "
+                                          "processes, the output is the "
+                                          "same as with one."))
+        self.argparser.add_argument('--cache', action='store_true',
+                                    help=("remember the lines of a single "
+                                          "log file that match the filters "
+                                          "(in <logfile>.mtcache/) and only "
+                                          "read those lines when the same "
+                                          "filters, or more, are used again "
+                                          "on the unchanged file."))
 
     def addFilter(self, filterclass):
         """Add a filter class to the parser."""
@@ -81,8 +141,12 @@ class MLogFilterTool(LogFileTool):
             return arr
 
     def _outputLine(self, logevent, length=None, human=False):
+        """Write the final line (see _formatLine) to the output."""
+        self.writer.write(self._formatLine(logevent, length, human))
+
+    def _formatLine(self, logevent, length=None, human=False):
         """
-        Print the final line.
+        Return the final line.
 
         Provides various options (length, human, datetime changes, ...).
         """
@@ -97,8 +161,7 @@ class MLogFilterTool(LogFileTool):
                                          force=True)
 
         if self.args['json']:
-            print(logevent.to_json())
-            return
+            return logevent.to_json()
         line = logevent.line_str
 
         if length:
@@ -109,7 +172,7 @@ class MLogFilterTool(LogFileTool):
             line = self._changeMs(line)
             line = self._formatNumbers(line)
 
-        print(line)
+        return line
 
     def _msToString(self, ms):
         """Change milliseconds to hours min sec ms format."""
@@ -158,7 +221,7 @@ class MLogFilterTool(LogFileTool):
             return line
         else:
             # split the string on numbers to isolate them
-            splitted = re.split("(\d+)", end)
+            splitted = self._number_regex.split(end)
             for index, val in enumerate(splitted):
                 converted = 0
                 try:
@@ -171,56 +234,97 @@ class MLogFilterTool(LogFileTool):
                         splitted[index] = format(converted, ",d")
             return line[:last_index] + ("").join(splitted)
 
-    def _datetime_key_for_merge(self, logevent):
-        """Helper method for ordering log lines correctly during merge."""
-        if not logevent:
-            # if logfile end is reached, return max datetime to never
-            # pick this line
-            return datetime(MAXYEAR, 12, 31, 23, 59, 59, 999999, tzutc())
-
-        # if no datetime present (line doesn't have one) return mindate
-        # to pick this line immediately
-        return logevent.datetime or datetime(MINYEAR, 1, 1, 0, 0, 0, 0,
-                                             tzutc())
-
     def _merge_logfiles(self):
-        """Helper method to merge several files together by datetime."""
-        # open files, read first lines, extract first dates
-        lines = [next(iter(logfile), None) for logfile in self.args['logfile']]
-
-        # adjust lines by timezone
-        for i in range(len(lines)):
-            if lines[i] and lines[i].datetime:
-                lines[i]._datetime = (lines[i].datetime +
-                                      timedelta(hours=self.args['timezone']
-                                                [i]))
-
-        while any(lines):
-            min_line = min(lines, key=self._datetime_key_for_merge)
-            min_idx = lines.index(min_line)
-
-            if self.args['markers'][min_idx]:
-                min_line.merge_marker_str = self.args['markers'][min_idx]
-
-            yield min_line
+        """
+        Merge several log files by datetime.
 
-            # update lines array with a new line from the min_idx'th logfile
-            lines[min_idx] = next(iter(self.args['logfile'][min_idx]), None)
-            if lines[min_idx] and lines[min_idx].datetime:
-                lines[min_idx]._datetime = (
-                    lines[min_idx].datetime +
-                    timedelta(hours=self.args['timezone'][min_idx]))
+        Keeps the next log event of each file on a heap ordered by datetime
+        and file index, so each line costs O(log k) for k files. Lines
+        without a datetime sort first and are output right away.
+        """
+        logfiles = self.args['logfile']
+        markers = self.args['markers']
+        iterators = [iter(logfile) for logfile in logfiles]
+        offsets = [timedelta(hours=tz) for tz in self.args['timezone']]
+
+        def heap_entry(i):
+            # next log event of the i'th log file with its sort key
+            logevent = next(iterators[i], None)
+            if logevent is None:
+                return None
+            dt = logevent.datetime
+            if dt:
+                # adjust by timezone
+                dt = logevent._datetime = dt + offsets[i]
+            return (dt or MIN_DATETIME, i, logevent)
+
+        heap = [heap_entry(i) for i in range(len(logfiles))]
+        heap = [entry for entry in heap if entry is not None]
+        heapify(heap)
+
+        while heap:
+            _, i, logevent = heap[0]
+
+            if markers[i]:
+                logevent.merge_marker_str = markers[i]
+
+            yield logevent
+
+            # replace the line with the next one of the same log file
+            entry = heap_entry(i)
+            if entry is None:
+                heappop(heap)
+            else:
+                heapreplace(heap, entry)
 
-    def logfile_generator(self):
-        """Yield each line of the file, or the next line if several files."""
+    def _prepare_logfiles(self):
+        """Fast-forward the log files and set their raw predicates."""
         if not self.args['exclude']:
             # ask all filters for a start_limit and fast-forward to the maximum
             start_limits = [f.start_limit for f in self.filters
                             if hasattr(f, 'start_limit')]
 
             if start_limits:
-                for logfile in self.args['logfile']:
-                    logfile.fast_forward(max(start_limits))
+                # start_limit is in adjusted time, each file is forwarded
+                # to its own local time
+                for logfile, tz in zip(self.args['logfile'],
+                                       self.args['timezone']):
+                    logfile.fast_forward(max(start_limits) -
+                                         timedelta(hours=tz))
+
+            raw_predicate = self._raw_predicate(self.filters)
+            for logfile in self.args['logfile']:
+                logfile.raw_predicate = raw_predicate
+
+    def _raw_predicate(self, filters):
+        """Return the raw predicate of filters, --top and --sample."""
+        # lines failing any of the filters' raw predicates are skipped
+        # before they are parsed
+        predicates = [f.rawPredicate() for f in filters]
+        if self.args['top']:
+            # lines without the --top field can't be among the top lines
+            predicates.append(TOP_FIELDS[self.args['by']])
+        # sample last, only lines that pass the other predicates count
+        predicates.append(self.sample_predicate)
+        return all_predicate(predicates)
+
+    def _events(self, logfile, offsets=None):
+        """
+        Yield the log events of a single file, adjusted by --timezone.
+
+        With offsets, only the lines at these offsets are read.
+        """
+        tz = timedelta(hours=self.args['timezone'][0])
+        if offsets is not None:
+            logfile = logfile.events_at(offsets)
+        for logevent in logfile:
+            if tz and logevent.datetime:
+                logevent._datetime = logevent.datetime + tz
+            yield logevent
+
+    def logfile_generator(self):
+        """Yield each line of the file, or the next line if several files."""
+        self._prepare_logfiles()
 
         if len(self.args['logfile']) > 1:
             # merge log files by time
@@ -228,12 +332,240 @@ class MLogFilterTool(LogFileTool):
                 yield logevent
         else:
             # only one file
-            for logevent in self.args['logfile'][0]:
-                if self.args['timezone'][0] != 0 and logevent.datetime:
-                    logevent._datetime = (logevent.datetime +
-                                          timedelta(hours=self
-                                                    .args['timezone'][0]))
+            for logevent in self._events(self.args['logfile'][0]):
+                yield logevent
+
+    def _filter_events(self, events, chain, output):
+        """
+        Pass the log events that pass the filter chain to output.
+
+        Return True if a filter rejects all remaining lines and filtering
+        stopped early.
+        """
+        exclude = self.args['exclude']
+        for logevent in events:
+            if exclude:
+                # print line if any filter disagrees
+                if not chain.accept(logevent):
+                    output(logevent)
+
+            else:
+                # only print line if all filters agree
+                if chain.accept(logevent):
+                    output(logevent)
+
+                # if at least one filter refuses to accept any
+                # remaining lines, stop if input is not stdin
+                if chain.skipRemaining() and self.stop_on_skip:
+                    return True
+        return False
+
+    def _parallel(self):
+        """Return True if --jobs can filter in several processes."""
+        return (bool(self.args['jobs']) and self.args['jobs'] > 1 and
+                len(self.args['logfile']) == 1 and not self.is_stdin and
+                not self.args['top'] and self.args['sample'] is None and
+                self.args['sample_n'] is None)
+
+    def _filter_chunk(self, chunk, states=None):
+        """
+        Filter a chunk of the log file for --jobs, return the results.
+
+        The stateful filters start with states, or guess their states from
+        the last line with a datetime before the chunk (see
+        BaseFilter.resume). The result has the states they started and
+        ended with, the output lines, whether filtering stopped early and
+        the statistics of the chain.
+        """
+        stateful = [f for f in self.filters if f.stateful]
+        if states is None:
+            previous = chunk.event_before(chunk.start_offset)
+            if previous is not None and previous.datetime:
+                previous._datetime = (previous.datetime +
+                                      timedelta(hours=self
+                                                .args['timezone'][0]))
+            for f in stateful:
+                f.resume(previous)
+        else:
+            for f, state in zip(stateful, states):
+                f.set_state(state)
+        started = [f.state() for f in stateful]
+
+        lines = []
+
+        def output(logevent):
+            lines.append(self._formatLine(logevent, self.args['shorten'],
+                                          self.args['human']))
+
+        events = self._events(chunk)
+        offsets = cache_states = None
+        if self.cache_offsets is not None:
+            offsets, cache_states = [], []
+            events, output = self._recording(chunk, events, output, offsets,
+                                             cache_states)
+
+        chain = FilterChain(self.filters, timed=self.args['verbose'])
+        # filters that seek, seek in the chunk
+        logfiles, self.args['logfile'] = self.args['logfile'], [chunk]
+        try:
+            stopped = self._filter_events(events, chain, output)
+        finally:
+            self.args['logfile'] = logfiles
+
+        return {'started': started,
+                'states': [f.state() for f in stateful],
+                'lines': lines,
+                'offsets': offsets,
+                'cache_states': cache_states,
+                'stopped': stopped,
+                'stats': (chain.calls, chain.rejected, chain.seconds),
+                'skipped': chunk.skipped_lines}
+
+    def _run_parallel(self, chain):
+        """
+        Filter a single log file in chunks in several processes.
+
+        Chunks are printed in file order as they are done. The states of the
+        stateful filters that a chunk started with are compared with the
+        states of the chunk before, on a mismatch the chunk is filtered
+        again here, so the output is the same as filtering in one process.
+        """
+        self._prepare_logfiles()
+        logfile = self.args['logfile'][0]
+        start = logfile.filehandle.tell()
+        end = logfile.end_offset or logfile.filesize
+        states = [f.state() for f in self.filters if f.stateful]
+
+        def filter_chunk(chunk):
+            if chunk.start_offset == start:
+                return self._filter_chunk(chunk, states)
+            return self._filter_chunk(chunk)
+
+        for chunk_start, chunk_end, result in parallel.scan_ordered(
+                logfile, filter_chunk, processes=self.args['jobs'],
+                start=start, end=end):
+            if result['started'] != states:
+                chunk = logfile.range(chunk_start, chunk_end)
+                try:
+                    result = self._filter_chunk(chunk, states)
+                finally:
+                    chunk.filehandle.close()
+
+            for line in result['lines']:
+                self.writer.write(line)
+            if result['offsets'] is not None:
+                self.cache_offsets.extend(result['offsets'])
+                self.cache_states.extend(result['cache_states'])
+            chain.add_stats(*result['stats'])
+            logfile.skipped_lines += result['skipped']
+            states = result['states']
+            if result['stopped']:
+                break
+
+    def _cached_lines(self):
+        """
+        Look up the query in the --cache, see ResultCache.find().
+
+        Sets result_cache and cache_keys if the query can be cached: a
+        single log file, at least one filter, cache keys for all filters and
+        no random sample.
+        """
+        self.result_cache = self.cache_keys = None
+        logfiles = self.args['logfile']
+        if (not self.args['cache'] or len(logfiles) != 1 or self.is_stdin or
+                not isinstance(logfiles[0], LogFile) or not self.filters or
+                self.args['sample'] is not None or
+                self.args['sample_n'] is not None):
+            return None
+
+        keys = dict((f.__class__.__name__, f.cache_key())
+                    for f in self.filters)
+        if any(key is None for key in keys.values()):
+            return None
+        keys['timezone'] = self.args['timezone']
+        try:
+            self.result_cache = ResultCache(logfiles[0].name)
+        except EnvironmentError:
+            return None
+        self.cache_keys = keys
+
+        stateless = [f.__class__.__name__ for f in self.filters
+                     if not f.stateful]
+        return self.result_cache.find(keys, self.args['exclude'], stateless)
+
+    def _recording(self, logfile, events, output, offsets, states):
+        """
+        Wrap events and output to record the lines that output gets.
+
+        The offset of each line and the states of the stateful filters
+        before they were asked about it are appended to offsets and states.
+        """
+        stateful = [f for f in self.filters if f.stateful]
+        current = []
+
+        def recorded_events():
+            for logevent in events:
+                current[:] = [logfile.line_offset,
+                              [f.state() for f in stateful]]
+                yield logevent
+
+        def recorded_output(logevent):
+            offsets.append(current[0])
+            states.append(current[1])
+            output(logevent)
+
+        return recorded_events(), recorded_output
+
+    def _cached_events(self, offsets, states):
+        """
+        Yield the log events at offsets of the --cache.
+
+        The stateful filters continue with the states they had before each
+        line, as if the lines in between had been filtered.
+        """
+        logfile = self.args['logfile'][0]
+        if not self.args['exclude']:
+            # the lines passed the filters, but narrower queries can skip
+            logfile.raw_predicate = self._raw_predicate(self.filters)
+
+        events = self._events(logfile, offsets)
+        if states is None:
+            for logevent in events:
                 yield logevent
+            return
+
+        stateful = [f for f in self.filters if f.stateful]
+        states = dict(zip(offsets, states))
+        for logevent in events:
+            for f, state in zip(stateful, states[logfile.line_offset]):
+                f.set_state(state)
+            yield logevent
+
+    def _sampler(self):
+        """
+        Return the sampler for --sample or --sample-n, None without them.
+
+        Sets sample_predicate to the raw predicate that samples lines before
+        they are parsed if that is possible: --sample lines are independent
+        of each other, a --sample-n reservoir has to count the lines that
+        pass the filters, so it can only skip lines without filters.
+        """
+        self.sample_predicate = None
+        if self.args['sample_n'] is not None and self.args['top']:
+            raise SystemExit("Error: --sample-n can't be used with --top.")
+
+        sampler = sampler_from_args(self.args)
+        if self.args['exclude']:
+            # --exclude samples the rejected lines
+            return sampler
+
+        if isinstance(sampler, BernoulliSampler):
+            self.sample_predicate = sampler.keep
+        elif (isinstance(sampler, ReservoirSampler) and not self.filters and
+                len(self.args['logfile']) == 1):
+            # merged files aren't read in output order
+            self.sample_predicate = sampler.wants
+        return sampler
 
     def run(self, arguments=None):
         """
@@ -329,25 +661,169 @@ class MLogFilterTool(LogFileTool):
         if 'logfile' not in self.args or not self.args['logfile']:
             raise SystemExit('no logfile found.')
 
-        for logevent in self.logfile_generator():
-            if self.args['exclude']:
-                # print line if any filter disagrees
-                if any([not f.accept(logevent) for f in self.filters]):
-                    self._outputLine(logevent, self.args['shorten'],
-                                     self.args['human'])
+        if self.args['top'] is not None and self.args['top'] < 1:
+            raise SystemExit('Error: --top needs a positive number of '
+                             'lines.')
 
+        sampler = self._sampler()
+
+        # the chain stops asking filters at the first one that rejects
+        chain = FilterChain(self.filters, timed=self.args['verbose'])
+
+        cached = self._cached_lines()
+        # --top skips lines that match, it uses the cache but doesn't fill it
+        if (self.result_cache is not None and not self.args['top'] and
+                not (cached and cached[2])):
+            self.cache_offsets, self.cache_states = [], []
+
+        if self.args['top']:
+            top = TopEvents(self.args['top'], self.args['by'])
+            output = top.add
+        elif self.args['sample_n']:
+            # the raw predicate already counted the line
+            output = sampler.put if self.sample_predicate else sampler.add
+        else:
+            def output(logevent):
+                self._outputLine(logevent, self.args['shorten'],
+                                 self.args['human'])
+
+        if self.args['sample'] is not None and not self.sample_predicate:
+            sampled_output = output
+
+            def output(logevent):
+                if sampler.keep():
+                    sampled_output(logevent)
+
+        # evaluated here, worker processes have no stdin
+        self.stop_on_skip = sys.stdin.isatty()
+
+        # write in large blocks unless someone is waiting for each line
+        interactive = self.is_stdin or sys.stdout.isatty()
+        self.writer = OutputWriter(sys.stdout,
+                                   0 if interactive else
+                                   OutputWriter.buffer_size)
+        try:
+            if cached is not None or not self._parallel():
+                if cached is not None:
+                    events = self._cached_events(cached[0], cached[1])
+                else:
+                    events = self.logfile_generator()
+                if self.cache_offsets is not None:
+                    events, output = self._recording(
+                        self.args['logfile'][0], events, output,
+                        self.cache_offsets, self.cache_states)
+                self._filter_events(events, chain, output)
             else:
-                # only print line if all filters agree
-                if all([f.accept(logevent) for f in self.filters]):
+                self._run_parallel(chain)
+
+            if self.args['top']:
+                for logevent in top.events():
                     self._outputLine(logevent, self.args['shorten'],
                                      self.args['human'])
+            elif self.args['sample_n']:
+                for logevent in sampler.items():
+                    self._outputLine(logevent, self.args['shorten'],
+                                     self.args['human'])
+        finally:
+            self.writer.flush()
 
-                # if at least one filter refuses to accept any
-                # remaining lines, stop
-                if any([f.skipRemaining() for f in self.filters]):
-                    # if input is not stdin
-                    if sys.stdin.isatty():
-                        break
+        if self.cache_offsets is not None:
+            self.result_cache.save(self.cache_keys, self.args['exclude'],
+                                   self.cache_offsets,
+                                   self.cache_states
+                                   if any(self.cache_states) else None)
+
+        if self.args['verbose']:
+            skipped = sum(logfile.skipped_lines
+                          for logfile in self.args['logfile'])
+            print('\n====================')
+            print("%i lines skipped without parsing" % skipped)
+            if cached is not None:
+                print("%i lines read from the result cache" % len(cached[0]))
+            if chain.filters:
+                print('')
+                print_table(chain.stats(), ['filter', 'cost', 'lines',
+                                            'rejected', 'time (s)'],
+                            uppercase_headers=False)
+
+
+class TopEvents(object):
+    """
+    The n log events with the largest value of a field, for --top.
+
+    Keeps a min-heap of at most n events, so memory doesn't grow with the
+    number of lines. Events without a value for the field are ignored. Of
+    events with the same value, the earlier ones are kept.
+    """
+
+    def __init__(self, n, field):
+        self.n = n
+        self.field = field
+        self.heap = []
+        self.counter = count()
+
+    def add(self, logevent):
+        """Add a log event, drop the smallest one if there are too many."""
+        value = getattr(logevent, self.field)
+        if value is None:
+            return
+        # the negated counter makes later events smaller on ties
+        entry = (value, -next(self.counter), logevent)
+        if len(self.heap) < self.n:
+            heappush(self.heap, entry)
+        else:
+            heappushpop(self.heap, entry)
+
+    def events(self):
+        """Return the log events, largest value first."""
+        return [entry[2] for entry in sorted(self.heap, reverse=True)]
+
+
+class OutputWriter(object):
+    """
+    Write the output lines of mlogfilter to a stream in large blocks.
+
+    Lines are collected until they add up to buffer_size characters and
+    then joined and written at once, encoded straight into the binary
+    buffer of the stream where there is one (sys.stdout of Python 3), which
+    saves the overhead of a print() per line. With a buffer_size of 0, each
+    line is written right away.
+    """
+
+    buffer_size = 1 << 16
+
+    def __init__(self, stream, buffer_size=None):
+        self.stream = stream
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        self.binary = getattr(stream, 'buffer', None)
+        self.encoding = getattr(stream, 'encoding', None) or 'utf-8'
+        self.errors = getattr(stream, 'errors', None) or 'strict'
+        self.lines = []
+        self.size = 0
+
+    def write(self, line):
+        """Add a line, without line break."""
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the collected lines to the stream."""
+        if not self.lines:
+            return
+        text = '\n'.join(self.lines) + '\n'
+        self.lines = []
+        self.size = 0
+
+        if self.binary is None:
+            self.stream.write(text)
+            return
+        # what was printed before goes first
+        self.stream.flush()
+        self.binary.write(text.encode(self.encoding, self.errors))
+        self.binary.flush()
 
 
 def main():
@@ -4,7 +4,9 @@ import inspect
 import sys
 
 import mtools.mloginfo.sections as sections
+from mtools.util import parallel
 from mtools.util.cmdlinetool import LogFileTool
+from mtools.util.logfile import LogFile
 
 
 class MLogInfoTool(LogFileTool):
@@ -18,6 +20,11 @@ class MLogInfoTool(LogFileTool):
         self.argparser.add_argument('--verbose', action='store_true',
                                     help=('show more verbose output '
                                           '(depends on info section)'))
+        self.argparser.add_argument('--jobs', action='store', type=int,
+                                    default=None, metavar='N',
+                                    help=('number of processes that scan the '
+                                          'log file (default: number of '
+                                          'CPUs)'))
         inf = 'info sections'
         cmds = ('Below commands activate additional info sections for the '
                 'log file.')
@@ -37,7 +44,15 @@ class MLogInfoTool(LogFileTool):
             if i > 0:
                 print("\n ------------------------------------------\n")
 
-            if self.logfile.datetime_format == 'ctime-pre2.4':
+            # iterating may reset the datetime format hint, keep it for the
+            # header
+            datetime_format = self.logfile.datetime_format
+
+            # one pass over the log file for the header and all sections
+            active = [section for section in self.sections if section.active]
+            states = self._scan_sections(active)
+
+            if datetime_format == 'ctime-pre2.4':
                 # no milliseconds when datetime format doesn't support it
                 start_time = (self.logfile.start.strftime("%Y %b %d %H:%M:%S")
                               if self.logfile.start else "unknown")
@@ -60,7 +75,7 @@ class MLogInfoTool(LogFileTool):
             print("        end: %s" % (end_time))
 
             # TODO: add timezone if iso8601 format
-            print("date format: %s" % self.logfile.datetime_format)
+            print("date format: %s" % datetime_format)
             print("     length: %s" % len(self.logfile))
             print("     binary: %s" % (self.logfile.binary or "unknown"))
 
@@ -68,12 +83,12 @@ class MLogInfoTool(LogFileTool):
 
             # if version is unknown, go by date
             if version == 'unknown':
-                if self.logfile.datetime_format == 'ctime-pre2.4':
+                if datetime_format == 'ctime-pre2.4':
                     version = '< 2.4 (no milliseconds)'
-                elif self.logfile.datetime_format == 'ctime':
+                elif datetime_format == 'ctime':
                     version = '>= 2.4.x ctime (milliseconds present)'
-                elif (self.logfile.datetime_format == "iso8601-utc" or
-                      self.logfile.datetime_format == "iso8601-local"):
+                elif (datetime_format == "iso8601-utc" or
+                      datetime_format == "iso8601-local"):
                     if self.logfile.has_level:
                         version = '>= 3.0 (iso8601 format, level, component)'
                     else:
@@ -83,11 +98,93 @@ class MLogInfoTool(LogFileTool):
             print("    storage: %s"
                   % (self.logfile.storage_engine or 'unknown'))
 
-            # now run all sections
-            for section in self.sections:
-                if section.active:
-                    print("\n%s" % section.name.upper())
-                    section.run()
+            # now print all sections
+            for section, state in zip(active, states):
+                print("\n%s" % section.name.upper())
+                section.render(state)
+
+    def _scan_sections(self, active):
+        """
+        Go through the log file once for the header and all active sections.
+
+        Each LogEvent is created once and passed to all sections that need
+        the log events, and the raw lines to the LogFile's information
+        collector (line count, restarts, etc., see LogFileInfo). Chunks of
+        the file are scanned in parallel (see mtools.util.parallel). Return
+        the merged state of each section.
+        """
+        logfile = self.logfile
+        states = [section.init_state() for section in active]
+        if all(state is None for state in states):
+            # no section needs the log events, the header is collected by
+            # the LogFile when needed
+            return states
+
+        collect_info = (isinstance(logfile, LogFile) and
+                        logfile.info_collector() is not None)
+
+        progress = (self.progress_bar_enabled and
+                    bool(logfile.start and logfile.end))
+        if progress:
+            progress_start = self._datetime_to_epoch(logfile.start)
+            progress_total = (self._datetime_to_epoch(logfile.end) -
+                              progress_start)
+
+        def scan_chunk(chunk):
+            info = chunk.info_collector() if collect_info else None
+            states = [section.init_state() for section in active]
+            scanning = [(section.add, state)
+                        for section, state in zip(active, states)
+                        if state is not None]
+            # only the process that scans the whole file shows progress
+            show_progress = progress and progress_total and chunk is logfile
+
+            if isinstance(chunk, LogFile):
+                events = chunk.lines_and_events()
+            else:
+                events = ((None, le) for le in chunk)
+
+            for i, (line, le) in enumerate(events):
+                if info:
+                    info.add_line(line)
+                for add, state in scanning:
+                    add(state, le)
+
+                # update progress bar every 1000 lines, after the sections
+                # so that evaluating the datetime doesn't change line_str
+                if show_progress and (i % 1000 == 0) and le.datetime:
+                    progress_curr = self._datetime_to_epoch(le.datetime)
+                    self.update_progress(float(progress_curr -
+                                               progress_start) /
+                                         progress_total)
+            return info, states
+
+        def merge(partial, other):
+            info, states = partial
+            if info:
+                info.merge(other[0])
+            return info, [state if state is None
+                          else section.merge(state, other_state)
+                          for section, state, other_state
+                          in zip(active, states, other[1])]
+
+        if isinstance(logfile, LogFile):
+            info, states = parallel.scan(logfile, scan_chunk, merge,
+                                         processes=self.args['jobs'],
+                                         progress=(self.update_progress
+                                                   if progress else None))
+        else:
+            info, states = scan_chunk(logfile)
+
+        if info:
+            # the same information and index as LogFile._iterate_lines()
+            logfile.add_info(info)
+
+        # clear progress bar again
+        if progress:
+            self.update_progress(1.0)
+
+        return states
 
 
 def main():
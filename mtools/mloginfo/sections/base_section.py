@@ -4,6 +4,14 @@ class BaseSection(object):
 
     All sections need to derive from it and add their arguments to the
     mloginfo.argparser object and determine if they are active.
+
+    Sections that look at every log event split their work into
+    init_state(), add() and merge() so that mloginfo can scan chunks of the
+    log file in parallel: each chunk starts with a fresh state from
+    init_state(), every log event of the chunk is passed to add(), and the
+    states of consecutive chunks are combined in file order with merge().
+    States have to be picklable. render() prints the section from the
+    final state.
     """
 
     filterArgs = []
@@ -16,6 +24,30 @@ class BaseSection(object):
         # class variables
         self.mloginfo = mloginfo
 
-    def run(self):
-        """Override this method in subclasses."""
+    def init_state(self):
+        """
+        Return the state for a chunk of the log file.
+
+        Sections that don't need to see the log events return None.
+        """
+        return None
+
+    def add(self, state, logevent):
+        """Add a log event to the state, override in subclasses."""
         pass
+
+    def merge(self, state, other):
+        """Combine state with the state of the following chunk."""
+        return state
+
+    def render(self, state):
+        """Print out the section, override in subclasses."""
+        pass
+
+    def run(self):
+        """Scan the log file for this section alone and print it out."""
+        state = self.init_state()
+        if state is not None:
+            for logevent in self.mloginfo.logfile:
+                self.add(state, logevent)
+        self.render(state)
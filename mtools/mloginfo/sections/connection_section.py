@@ -1,7 +1,7 @@
 import re
-from collections import defaultdict
 
 from .base_section import BaseSection
+from mtools.util import OrderedDict
 
 try:
     from mtools.util.profile_collection import ProfileCollection
@@ -19,6 +19,11 @@ class ConnectionSection(BaseSection):
 
     name = "connections"
 
+    # connection ids that are finished, only one start and end is expected
+    END_TIME_ALREADY_FOUND = -111
+
+    end_connid_pattern = re.compile(r'\[conn(\d+)\]')
+
     def __init__(self, mloginfo):
         BaseSection.__init__(self, mloginfo)
 
@@ -38,128 +43,141 @@ class ConnectionSection(BaseSection):
         return(self.mloginfo.args['connections'] or
                self.mloginfo.args['connstats'])
 
-    def run(self):
-        """Run this section and print out information."""
+    def init_state(self):
+        """Return counters of opened and closed connections per IP."""
         if ProfileCollection and isinstance(self.mloginfo.logfile,
                                             ProfileCollection):
-            print("\n    not available for system.profile collections\n")
-            return
+            return None
+
+        state = {'opened': OrderedDict(), 'closed': OrderedDict(),
+                 'socket_exceptions': 0}
+        if self.mloginfo.args['connstats']:
+            # connection id -> start datetime, or END_TIME_ALREADY_FOUND
+            state['starts'] = OrderedDict()
+            # (connection id, ip, datetime) of ends before any start in the
+            # chunk, the start may be in an earlier chunk
+            state['unmatched_ends'] = []
+            # ip -> [sum, count, min, max] of connection durations
+            state['durations'] = OrderedDict()
+        return state
+
+    def add(self, state, logevent):
+        """Count opened and closed connections and their durations."""
+        line = logevent.line_str
+        genstats = 'starts' in state
+
+        pos = line.find('connection accepted')
+        if pos != -1:
+            # connection was opened, increase counter
+            tokens = line[pos:pos + 100].split(' ')
+            if tokens[3] == 'anonymous':
+                ip = 'anonymous'
+            else:
+                ip, _ = tokens[3].split(':')
+            state['opened'][ip] = state['opened'].get(ip, 0) + 1
 
-        ip_opened = defaultdict(lambda: 0)
-        ip_closed = defaultdict(lambda: 0)
+            if genstats:
+                connid = tokens[4].strip('#')
+                dt = logevent.datetime
 
-        socket_exceptions = 0
+                # Sanity checks
+                if connid.isdigit() is False or dt is None:
+                    return
 
-        START_TIME_EMPTY = -11
-        END_TIME_ALREADY_FOUND = -111
-        MIN_DURATION_EMPTY = 9999999999
-        MAX_DURATION_EMPTY = -1
+                self._add_start(state['starts'], connid, dt)
 
-        end_connid_pattern = re.compile(r'\[conn(\d+)\]')
+        pos = line.find('end connection')
+        if pos != -1:
+            # connection was closed, increase counter
+            tokens = line[pos:pos + 100].split(' ')
+            if tokens[2] == 'anonymous':
+                ip = 'anonymous'
+            else:
+                ip, _ = tokens[2].split(':')
+            state['closed'][ip] = state['closed'].get(ip, 0) + 1
 
-        genstats = self.mloginfo.args['connstats']
-        if genstats:
-            connections_start = defaultdict(lambda: START_TIME_EMPTY)
-            ipwise_sum_durations = defaultdict(lambda: 0)
-            ipwise_count = defaultdict(lambda: 0)
-            ipwise_min_connection_duration = defaultdict(lambda:
-                                                         MIN_DURATION_EMPTY)
-            ipwise_max_connection_duration = defaultdict(lambda:
-                                                         MAX_DURATION_EMPTY)
-
-            min_connection_duration = MIN_DURATION_EMPTY
-            max_connection_duration = MAX_DURATION_EMPTY
-
-            sum_durations = 0
-            fullconn_counts = 0
-
-        for logevent in self.mloginfo.logfile:
-            line = logevent.line_str
-
-            pos = line.find('connection accepted')
-            if pos != -1:
-                # connection was opened, increase counter
-                tokens = line[pos:pos + 100].split(' ')
-                if tokens[3] == 'anonymous':
-                    ip = 'anonymous'
+            if genstats:
+                # The connection id value is stored just before end
+                # connection -> [conn385] end connection
+                match = self.end_connid_pattern.search(line, re.M | re.I)
+                dt = logevent.datetime
+
+                # Sanity checks
+                if match is None or not match.group(1).isdigit() or dt is None:
+                    return
+
+                end_connid = match.group(1)
+                if end_connid in state['starts']:
+                    self._add_end(state, end_connid, ip, dt)
                 else:
-                    ip, _ = tokens[3].split(':')
-                ip_opened[ip] += 1
-
-                if genstats:
-                    connid = tokens[4].strip('#')
-                    dt = logevent.datetime
-
-                    # Sanity checks
-                    if connid.isdigit() is False or dt is None:
-                        continue
-
-                    if connections_start[connid] != START_TIME_EMPTY:
-                        errmsg = ("Multiple start datetimes found for the "
-                                  "same connection ID. Consider analysing one "
-                                  "log sequence.")
-                        raise NotImplementedError(errmsg)
-
-                    connections_start[connid] = dt
-
-            pos = line.find('end connection')
-            if pos != -1:
-                # connection was closed, increase counter
-                tokens = line[pos:pos + 100].split(' ')
-                if tokens[2] == 'anonymous':
-                    ip = 'anonymous'
+                    state['unmatched_ends'].append((end_connid, ip, dt))
+
+        if "SocketException" in line:
+            state['socket_exceptions'] += 1
+
+    def _add_start(self, starts, connid, dt):
+        if connid in starts:
+            errmsg = ("Multiple start datetimes found for the same "
+                      "connection ID. Consider analysing one log sequence.")
+            raise NotImplementedError(errmsg)
+        starts[connid] = dt
+
+    def _add_end(self, state, connid, ip, dt):
+        start = state['starts'][connid]
+        if start == self.END_TIME_ALREADY_FOUND:
+            errmsg = ("Multiple end datetimes found for the same connection "
+                      "ID %s. Consider analysing one log sequence.")
+            raise NotImplementedError(errmsg % (connid))
+
+        dur_in_sec = (dt - start).seconds
+        durations = state['durations'].get(ip)
+        if durations is None:
+            state['durations'][ip] = [dur_in_sec, 1, dur_in_sec, dur_in_sec]
+        else:
+            durations[0] += dur_in_sec
+            durations[1] += 1
+            durations[2] = min(durations[2], dur_in_sec)
+            durations[3] = max(durations[3], dur_in_sec)
+
+        state['starts'][connid] = self.END_TIME_ALREADY_FOUND
+
+    def merge(self, state, other):
+        """Add the counters of other and match its ends with our starts."""
+        for name in ('opened', 'closed'):
+            counter = state[name]
+            for ip, count in other[name].items():
+                counter[ip] = counter.get(ip, 0) + count
+        state['socket_exceptions'] += other['socket_exceptions']
+
+        if 'starts' in state:
+            # the ends come before any start in other
+            for connid, ip, dt in other['unmatched_ends']:
+                if connid in state['starts']:
+                    self._add_end(state, connid, ip, dt)
                 else:
-                    ip, _ = tokens[2].split(':')
-                ip_closed[ip] += 1
-
-                if genstats:
-
-                    # Sanity check
-                    if end_connid_pattern.search(line, re.M | re.I) is None:
-                        continue
-
-                    # The connection id value is stored just before end
-                    # connection -> [conn385] end connection
-                    end_connid = (end_connid_pattern.
-                                  search(line, re.M | re.I).group(1))
-                    dt = logevent.datetime
-
-                    # Sanity checks
-                    if (end_connid.isdigit() is False or dt is None or
-                            connections_start[end_connid] == START_TIME_EMPTY):
-                        continue
-
-                    if connections_start[end_connid] == END_TIME_ALREADY_FOUND:
-                        errmsg = ("Multiple end datetimes found for the same "
-                                  "connection ID %s. Consider analysing one "
-                                  "log sequence.")
-                        raise NotImplementedError(errmsg % (end_connid))
-
-                    dur = dt - connections_start[end_connid]
-                    dur_in_sec = dur.seconds
-
-                    if dur_in_sec < min_connection_duration:
-                        min_connection_duration = dur_in_sec
-
-                    if dur_in_sec > max_connection_duration:
-                        max_connection_duration = dur_in_sec
-
-                    if dur_in_sec < ipwise_min_connection_duration[ip]:
-                        ipwise_min_connection_duration[ip] = dur_in_sec
-
-                    if dur_in_sec > ipwise_max_connection_duration[ip]:
-                        ipwise_max_connection_duration[ip] = dur_in_sec
-
-                    sum_durations += dur.seconds
-                    fullconn_counts += 1
-
-                    ipwise_sum_durations[ip] += dur_in_sec
-                    ipwise_count[ip] += 1
-
-                    connections_start[end_connid] = END_TIME_ALREADY_FOUND
+                    state['unmatched_ends'].append((connid, ip, dt))
+            for connid, start in other['starts'].items():
+                self._add_start(state['starts'], connid, start)
+            for ip, (total, count, low, high) in other['durations'].items():
+                durations = state['durations'].get(ip)
+                if durations is None:
+                    state['durations'][ip] = [total, count, low, high]
+                else:
+                    durations[0] += total
+                    durations[1] += count
+                    durations[2] = min(durations[2], low)
+                    durations[3] = max(durations[3], high)
+        return state
+
+    def render(self, state):
+        """Print out information."""
+        if state is None:
+            print("\n    not available for system.profile collections\n")
+            return
 
-            if "SocketException" in line:
-                socket_exceptions += 1
+        ip_opened = state['opened']
+        ip_closed = state['closed']
+        genstats = 'starts' in state
 
         # calculate totals
         total_opened = sum(ip_opened.values())
@@ -172,49 +190,34 @@ class ConnectionSection(BaseSection):
         print("     total opened: %s" % total_opened)
         print("     total closed: %s" % total_closed)
         print("    no unique IPs: %s" % len(unique_ips))
-        print("socket exceptions: %s" % socket_exceptions)
+        print("socket exceptions: %s" % state['socket_exceptions'])
         if genstats:
+            durations = list(state['durations'].values())
+            fullconn_counts = sum(d[1] for d in durations)
             if fullconn_counts > 0:
                 print("overall average connection duration(s): %s"
-                      % (sum_durations / fullconn_counts))
+                      % (sum(d[0] for d in durations) / fullconn_counts))
                 print("overall minimum connection duration(s): %s"
-                      % min_connection_duration)
+                      % min(d[2] for d in durations))
                 print("overall maximum connection duration(s): %s"
-                      % max_connection_duration)
+                      % max(d[3] for d in durations))
             else:
                 print("overall average connection duration(s): -")
                 print("overall minimum connection duration(s): -")
                 print("overall maximum connection duration(s): -")
         print('')
 
-        for ip in sorted(unique_ips, key=lambda x: ip_opened[x], reverse=True):
-            opened = ip_opened[ip] if ip in ip_opened else 0
-            closed = ip_closed[ip] if ip in ip_closed else 0
+        for ip in sorted(unique_ips, key=lambda x: ip_opened.get(x, 0),
+                         reverse=True):
+            opened = ip_opened.get(ip, 0)
+            closed = ip_closed.get(ip, 0)
 
             if genstats:
-                covered_count = (
-                    ipwise_count[ip]
-                    if ip in ipwise_count
-                    else 1)
-                connection_duration_ip = (
-                    ipwise_sum_durations[ip]
-                    if ip in ipwise_sum_durations
-                    else 0)
-                ipwise_min_connection_duration_final = (
-                    ipwise_min_connection_duration[ip]
-                    if ipwise_min_connection_duration[ip] != MIN_DURATION_EMPTY
-                    else 0)
-                ipwise_max_connection_duration_final = (
-                    ipwise_max_connection_duration[ip]
-                    if ipwise_max_connection_duration[ip] != MAX_DURATION_EMPTY
-                    else 0)
-
+                total, count, low, high = state['durations'].get(ip,
+                                                                 [0, 1, 0, 0])
                 print("%-15s  opened: %-8i  closed: %-8i dur-avg(s): %-8i "
                       "dur-min(s): %-8i dur-max(s): %-8i"
-                      % (ip, opened, closed,
-                         connection_duration_ip / covered_count,
-                         ipwise_min_connection_duration_final,
-                         ipwise_max_connection_duration_final))
+                      % (ip, opened, closed, total / count, low, high))
             else:
                 print("%-15s  opened: %-8i  closed: %-8i"
                       % (ip, opened, closed))
@@ -1,6 +1,5 @@
-from collections import defaultdict
-
 from .base_section import BaseSection
+from mtools.util import OrderedDict
 from mtools.util.log2code import Log2CodeConverter
 
 try:
@@ -36,66 +35,66 @@ class DistinctSection(BaseSection):
         """Rreturn boolean if this section is active."""
         return self.mloginfo.args['distinct']
 
-    def run(self):
-        """Run each line through log2code and group by matched pattern."""
+    def init_state(self):
+        """Return counters of matched patterns and non-matched lines."""
         if ProfileCollection and isinstance(self.mloginfo.logfile,
                                             ProfileCollection):
-            print("\n    not available for system.profile collections\n")
-            return
+            return None
+
+        # non_matched collects the lines to show with --verbose
+        return {'codelines': OrderedDict(), 'non_matches': 0,
+                'non_matched': []}
 
-        codelines = defaultdict(lambda: 0)
-        non_matches = 0
+    def add(self, state, logevent):
+        """Run the line through log2code and count the matched pattern."""
+        cl, _ = self.log2code(logevent.line_str)
 
-        # get log file information
-        logfile = self.mloginfo.logfile
-        if logfile.start and logfile.end and not self.mloginfo.args['verbose']:
-            progress_start = self.mloginfo._datetime_to_epoch(logfile.start)
-            progress_total = (self.mloginfo._datetime_to_epoch(logfile.end) -
-                              progress_start)
+        if cl:
+            codelines = state['codelines']
+            codelines[cl.pattern] = codelines.get(cl.pattern, 0) + 1
         else:
-            self.mloginfo.progress_bar_enabled = False
-
-        for i, logevent in enumerate(self.mloginfo.logfile):
-            cl, _ = self.log2code(logevent.line_str)
-
-            # update progress bar every 1000 lines
-            if self.mloginfo.progress_bar_enabled and (i % 1000 == 0):
-                if logevent.datetime:
-                    progress_curr = self.mloginfo._datetime_to_epoch(logevent
-                                                                     .datetime)
-                    (self.mloginfo
-                     .update_progress(float(progress_curr - progress_start) /
-                                      progress_total))
-
-            if cl:
-                codelines[cl.pattern] += 1
-            else:
-                if logevent.operation:
-                    # skip operations (command, insert, update, delete,
-                    # query, getmore)
-                    continue
-                if not logevent.thread:
-                    # skip the lines that don't have a thread name
-                    # (usually map/reduce or assertions)
-                    continue
-                if len(logevent.split_tokens) - logevent.datetime_nextpos <= 1:
-                    # skip empty log messages (after thread name)
-                    continue
-                if ("warning: log line attempted" in logevent.line_str and
-                        "over max size" in logevent.line_str):
-                    # skip lines that are too long
-                    continue
-
-                # everything else is a real non-match
-                non_matches += 1
-                if self.mloginfo.args['verbose']:
-                    print("couldn't match:" + logevent)
-
-        # clear progress bar again
-        if self.mloginfo.progress_bar_enabled:
-            self.mloginfo.update_progress(1.0)
+            if logevent.operation:
+                # skip operations (command, insert, update, delete,
+                # query, getmore)
+                return
+            if not logevent.thread:
+                # skip the lines that don't have a thread name
+                # (usually map/reduce or assertions)
+                return
+            if len(logevent.split_tokens) - logevent.datetime_nextpos <= 1:
+                # skip empty log messages (after thread name)
+                return
+            if ("warning: log line attempted" in logevent.line_str and
+                    "over max size" in logevent.line_str):
+                # skip lines that are too long
+                return
+
+            # everything else is a real non-match
+            state['non_matches'] += 1
+            if self.mloginfo.args['verbose']:
+                state['non_matched'].append(logevent.line_str)
+
+    def merge(self, state, other):
+        """Add the counters of other."""
+        codelines = state['codelines']
+        for pattern, count in other['codelines'].items():
+            codelines[pattern] = codelines.get(pattern, 0) + count
+        state['non_matches'] += other['non_matches']
+        state['non_matched'].extend(other['non_matched'])
+        return state
+
+    def render(self, state):
+        """Print the matched patterns, most frequent first."""
+        if state is None:
+            print("\n    not available for system.profile collections\n")
+            return
+
+        codelines = state['codelines']
+        non_matches = state['non_matches']
 
         if self.mloginfo.args['verbose']:
+            for line in state['non_matched']:
+                print("couldn't match:" + line)
             print('')
 
         for cl in sorted(codelines, key=lambda x: codelines[x], reverse=True):
@@ -1,15 +1,12 @@
+from argparse import ArgumentTypeError
 from collections import namedtuple
 from operator import itemgetter
 
 from .base_section import BaseSection
 from mtools.util import OrderedDict
-from mtools.util.grouping import Grouping
+from mtools.util.pattern import pattern_cache
 from mtools.util.print_table import print_table
-
-try:
-    import numpy as np
-except ImportError:
-    np = None
+from mtools.util.quantile import QuantileSketch
 
 LogTuple = namedtuple('LogTuple', ['namespace', 'operation', 'pattern',
                                    'duration'])
@@ -19,6 +16,37 @@ def op_or_cmd(le):
     return le.operation if le.operation != 'command' else le.command
 
 
+SORT_FIELDS = ['namespace', 'pattern', 'count', 'min', 'max', 'mean', 'sum']
+
+
+def _percentile(value):
+    """Return value if it is a number from 0 to 100."""
+    try:
+        valid = 0 <= float(value) <= 100
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ArgumentTypeError("invalid percentile '%s', choose numbers "
+                                "from 0 to 100" % value)
+    return value
+
+
+def _percentiles(value):
+    """Parse the comma-separated --percentiles into a list of strings."""
+    return [_percentile(p.strip()) for p in value.split(',') if p.strip()]
+
+
+def _sort_field(value):
+    """Check that --sort is a field or a percentile like 95%."""
+    if value not in SORT_FIELDS:
+        if not value.endswith('%'):
+            raise ArgumentTypeError("invalid choice: '%s' (choose from %s or "
+                                    "a percentile like 95%%)"
+                                    % (value, ', '.join(SORT_FIELDS)))
+        _percentile(value[:-1])
+    return value
+
+
 class QuerySection(BaseSection):
     """QuerySection class."""
 
@@ -32,96 +60,113 @@ class QuerySection(BaseSection):
         self.mloginfo.argparser_sectiongroup.add_argument('--queries',
                                                           action='store_true',
                                                           help=helptext)
+        # percentiles like 95% are valid too if they are in --percentiles
+        helptext = ('sort by namespace, pattern, count, min, max, mean, sum '
+                    'or a percentile like 95%% (default: sum)')
         self.mloginfo.argparser_sectiongroup.add_argument('--sort',
                                                           action='store',
                                                           default='sum',
-                                                          choices=['namespace',
-                                                                   'pattern',
-                                                                   'count',
-                                                                   'min',
-                                                                   'max',
-                                                                   'mean',
-                                                                   '95%',
-                                                                   'sum'])
+                                                          type=_sort_field,
+                                                          help=helptext)
+        helptext = ('comma-separated percentiles of the durations to show, '
+                    'estimated within 1%% for large groups (default: 95)')
+        self.mloginfo.argparser_sectiongroup.add_argument('--percentiles',
+                                                          action='store',
+                                                          default='95',
+                                                          type=_percentiles,
+                                                          metavar='P,P,...',
+                                                          help=helptext)
 
     @property
     def active(self):
         """Return boolean if this section is active."""
-        return self.mloginfo.args['queries']
-
-    def run(self):
-        """Run this section and print out information."""
-        grouping = Grouping(group_by=lambda x: (x.namespace, x.operation,
-                                                x.pattern))
-        logfile = self.mloginfo.logfile
-
-        if logfile.start and logfile.end:
-            progress_start = self.mloginfo._datetime_to_epoch(logfile.start)
-            progress_total = (self.mloginfo._datetime_to_epoch(logfile.end) -
-                              progress_start)
-        else:
-            self.mloginfo.progress_bar_enabled = False
-
-        for i, le in enumerate(logfile):
-            # update progress bar every 1000 lines
-            if self.mloginfo.progress_bar_enabled and (i % 1000 == 0):
-                if le.datetime:
-                    progress_curr = self.mloginfo._datetime_to_epoch(le
-                                                                     .datetime)
-                    if progress_total:
-                        (self.mloginfo
-                         .update_progress(float(progress_curr -
-                                                progress_start) /
-                                          progress_total))
-
-            if (le.operation in ['query', 'getmore', 'update', 'remove'] or
-                    le.command in ['count', 'findandmodify',
-                                   'geonear', 'find']):
-                lt = LogTuple(namespace=le.namespace, operation=op_or_cmd(le),
-                              pattern=le.pattern, duration=le.duration)
-                grouping.add(lt)
-
-        grouping.sort_by_size()
-
-        # clear progress bar again
-        if self.mloginfo.progress_bar_enabled:
-            self.mloginfo.update_progress(1.0)
+        if not self.mloginfo.args['queries']:
+            return False
+        # checked before the log file is scanned
+        sort = self.mloginfo.args['sort']
+        if (sort not in SORT_FIELDS and
+                sort[:-1] not in self.mloginfo.args['percentiles']):
+            self.mloginfo.argparser.error("can't sort by '%s', percentiles "
+                                          "have to be in --percentiles"
+                                          % sort)
+        return True
+
+    def init_state(self):
+        """Return running statistics per group and of the pattern cache."""
+        # (namespace, operation, pattern) -> [first LogTuple, number of
+        # events, QuantileSketch of the durations]
+        return {'groups': OrderedDict(), 'cache_hits': 0, 'cache_misses': 0}
+
+    def add(self, state, le):
+        """Add the duration of queries to their group."""
+        if (le.operation in ['query', 'getmore', 'update', 'remove'] or
+                le.command in ['count', 'findandmodify', 'geonear', 'find']):
+            hits, misses = pattern_cache.hits, pattern_cache.misses
+            lt = LogTuple(namespace=le.namespace, operation=op_or_cmd(le),
+                          pattern=le.pattern, duration=le.duration)
+            state['cache_hits'] += pattern_cache.hits - hits
+            state['cache_misses'] += pattern_cache.misses - misses
+
+            key = (lt.namespace, lt.operation, lt.pattern)
+            group = state['groups'].get(key)
+            if group is None:
+                group = state['groups'][key] = [lt, 0, QuantileSketch()]
+            group[1] += 1
+            if lt.duration is not None:
+                group[2].add(lt.duration)
+
+    def merge(self, state, other):
+        """Merge the statistics of other into the groups of state."""
+        groups = state['groups']
+        for key, (lt, events, durations) in other['groups'].items():
+            if key in groups:
+                groups[key][1] += events
+                groups[key][2].merge(durations)
+            else:
+                groups[key] = [lt, events, durations]
+        state['cache_hits'] += other['cache_hits']
+        state['cache_misses'] += other['cache_misses']
+        return state
+
+    def render(self, state):
+        """Print out statistics for each query pattern."""
+        percentiles = self.mloginfo.args['percentiles']
+
+        # largest groups first
+        groups = sorted(state['groups'].items(),
+                        key=lambda x: x[1][1], reverse=True)
 
         # no queries in the log file
-        if len(grouping) < 1:
+        if len(groups) < 1:
             print('no queries found.')
             return
 
-        titles = ['namespace', 'operation', 'pattern', 'count', 'min (ms)',
-                  'max (ms)', 'mean (ms)', '95%-ile (ms)', 'sum (ms)']
+        titles = (['namespace', 'operation', 'pattern', 'count', 'min (ms)',
+                   'max (ms)', 'mean (ms)'] +
+                  ['%s%%-ile (ms)' % p for p in percentiles] + ['sum (ms)'])
         table_rows = []
 
-        for g in grouping:
+        for g, (example, _, durations) in groups:
             # calculate statistics for this group
             namespace, op, pattern = g
 
-            group_events = [le.duration for le in grouping[g]
-                            if le.duration is not None]
-
             stats = OrderedDict()
             stats['namespace'] = namespace
             stats['operation'] = op
             stats['pattern'] = pattern
-            stats['count'] = len(group_events)
-            stats['min'] = min(group_events) if group_events else '-'
-            stats['max'] = max(group_events) if group_events else '-'
+            stats['count'] = durations.count
+            stats['min'] = durations.min if durations.count else '-'
+            stats['max'] = durations.max if durations.count else '-'
             stats['mean'] = 0
-            if np:
-                stats['95%'] = (np.percentile(group_events, 95)
-                                if group_events else '-')
-            else:
-                stats['95%'] = 'n/a'
-            stats['sum'] = sum(group_events) if group_events else '-'
+            for p in percentiles:
+                stats['%s%%' % p] = (durations.quantile(float(p) / 100)
+                                     if durations.count else '-')
+            stats['sum'] = durations.sum if durations.count else '-'
             stats['mean'] = (stats['sum'] / stats['count']
-                             if group_events else '-')
+                             if durations.count else '-')
 
             if self.mloginfo.args['verbose']:
-                stats['example'] = grouping[g][0]
+                stats['example'] = example
                 titles.append('example')
 
             table_rows.append(stats)
@@ -136,3 +181,10 @@ class QuerySection(BaseSection):
                             reverse=reverse)
         print_table(table_rows, titles, uppercase_headers=False)
         print('')
+
+        if self.mloginfo.args['verbose']:
+            hits, misses = state['cache_hits'], state['cache_misses']
+            lookups = hits + misses
+            print('pattern cache: %i hits, %i misses (%.1f%% hit rate)'
+                  % (hits, misses, 100. * hits / lookups if lookups else 0.))
+            print('')
@@ -32,7 +32,7 @@ class RestartSection(BaseSection):
         """Return boolean if this section is active."""
         return self.mloginfo.args['restarts']
 
-    def run(self):
+    def render(self, state):
         """Run this section and print out information."""
         if ProfileCollection and isinstance(self.mloginfo.logfile,
                                             ProfileCollection):
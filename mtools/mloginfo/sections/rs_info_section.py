@@ -25,7 +25,7 @@ class RsInfoSection(BaseSection):
         """Return boolean if this section is active."""
         return self.mloginfo.args['rsinfo']
 
-    def run(self):
+    def render(self, state):
         """Run this section and print out information."""
         if self.mloginfo.logfile.repl_set:
             print("    rs name: %s" % self.mloginfo.logfile.repl_set)
@@ -28,7 +28,7 @@ class RsStateSection(BaseSection):
         """Return boolean if this section is active."""
         return self.mloginfo.args['rsstate']
 
-    def run(self):
+    def render(self, state):
         """Run this section and print out information."""
         titles = ['date', 'host', 'state/message']
         table_rows = []
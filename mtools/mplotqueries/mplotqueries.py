@@ -12,6 +12,9 @@ from dateutil.tz import tzutc
 
 from mtools import __version__
 from mtools.util.cmdlinetool import LogFileTool
+from mtools.util.logfile import LogFile
+from mtools.util.sampling import (BernoulliSampler, add_sample_arguments,
+                                  sampler_from_args)
 
 try:
     import matplotlib
@@ -117,6 +120,7 @@ class MPlotQueriesTool(LogFileTool):
                                     action='store', default=None,
                                     help=("Save the plot to a file instead of "
                                           "displaying it in a window"))
+        add_sample_arguments(self.argparser)
 
         self.legend = None
 
@@ -180,7 +184,16 @@ class MPlotQueriesTool(LogFileTool):
                 args=self.args,
                 unknown_args=self.unknown_args)
 
+        # with --sample, lines are sampled before they are parsed, with
+        # --sample-n the sampled events are plotted once all are read
+        sampler = sampler_from_args(self.args)
+        sample_lines = isinstance(sampler, BernoulliSampler)
+
         for logfile in self.logfiles:
+            # system.profile collections are sampled after parsing
+            raw_sample = sample_lines and isinstance(logfile, LogFile)
+            if raw_sample:
+                logfile.raw_predicate = sampler.keep
 
             # get log file information
             if self.progress_bar_enabled:
@@ -226,10 +239,13 @@ class MPlotQueriesTool(LogFileTool):
                     if logevent.datetime is None:
                         continue
 
-                    if logevent.namespace is None:
-                        logevent._namespace = "None"
-
-                    self.plot_instance.add_line(logevent)
+                    if sampler is None or raw_sample:
+                        self._add_line(logevent)
+                    elif sample_lines:
+                        if sampler.keep():
+                            self._add_line(logevent)
+                    else:
+                        sampler.add(logevent)
 
                 if multiple_files:
                     # amend logevent object with filename for group by filename
@@ -241,12 +257,26 @@ class MPlotQueriesTool(LogFileTool):
             range_max = max(self.plot_instance.date_range[1], logfile.end)
             self.plot_instance.date_range = (range_min, range_max)
 
+        if sampler is not None and not sample_lines:
+            for logevent in sampler.items():
+                self._add_line(logevent)
+
         # clear progress bar
         if self.logfiles and self.progress_bar_enabled:
             self.update_progress(1.0)
 
         self.plot_instances.append(self.plot_instance)
 
+    def _add_line(self, logevent):
+        # plot types and groupings access most fields of the kept events,
+        # extract them all in one pass
+        logevent.parse_all()
+
+        if logevent.namespace is None:
+            logevent._namespace = "None"
+
+        self.plot_instance.add_line(logevent)
+
     def group(self):
         self.plot_instances = [pi for pi in self.plot_instances
                                if not pi.empty]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Benchmark for deferred UTF-8 decoding of log lines.
+
+Usage: python bench_decoding.py [--eager-decode] LOGFILE
+
+Iterates over all events of LOGFILE and scans its header information
+(mloginfo's num_lines, restarts, etc.), reporting lines per second. With
+--eager-decode every line is decoded as soon as it is read, which is what
+LogFile did before decoding was deferred, to measure the saving.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from mtools.util.logfile import LogFile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('logfile')
+    parser.add_argument('--eager-decode', action='store_true',
+                        help='decode every line when it is read')
+    args = parser.parse_args()
+
+    with open(args.logfile, 'rb') as filehandle:
+        logfile = LogFile(filehandle)
+
+        start = time.time()
+        lines = 0
+        if args.eager_decode:
+            for le in logfile:
+                le.line_str
+                lines += 1
+        else:
+            for le in logfile:
+                lines += 1
+        elapsed = time.time() - start
+        print("iteration:   %9.0f lines/sec" % (lines / elapsed))
+
+        start = time.time()
+        if args.eager_decode:
+            for line in filehandle:
+                line.decode('utf-8', 'replace')
+            filehandle.seek(0)
+        logfile.num_lines
+        elapsed = time.time() - start
+        print("header scan: %9.0f lines/sec" % (lines / elapsed))
+
+
+if __name__ == '__main__':
+    main()
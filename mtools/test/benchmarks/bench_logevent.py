@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmark LogEvent parsing throughput and per-event memory.
+
+Usage: python bench_logevent.py [LOGFILE ...]
+
+Without arguments, all log files in mtools/test/logfiles are used. Every
+line is parsed lazily (only datetime and duration, as most tools do) and
+eagerly (parse_all()), and the average retained size of a LogEvent is
+measured by keeping all parsed events in memory.
+"""
+
+from __future__ import print_function
+
+import gc
+import glob
+import os
+import sys
+import time
+
+import mtools
+from mtools.util.logevent import LogEvent
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def load_lines(paths):
+    lines = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            lines.extend(line.decode('utf-8', 'replace').rstrip('\n')
+                         for line in f)
+    return lines
+
+
+def bench_throughput(lines, eager, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for line in lines:
+            le = LogEvent(line)
+            if eager:
+                le.parse_all()
+            else:
+                le.datetime
+                le.duration
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def bench_memory(lines):
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    events = [LogEvent(line) for line in lines]
+    for le in events:
+        le.parse_all()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # only count the memory allocated for the events themselves, not the
+    # line strings they were created from
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+    total = sum(stat.size_diff for stat in stats)
+    del events
+    return total / float(len(lines))
+
+
+def main():
+    paths = sys.argv[1:] or glob.glob(os.path.join(
+        os.path.dirname(mtools.__file__), 'test', 'logfiles', '*.log'))
+    lines = load_lines(paths)
+    print("%i lines from %i file(s)" % (len(lines), len(paths)))
+    print("lazy  (datetime, duration): %10.0f lines/sec"
+          % bench_throughput(lines, eager=False))
+    print("eager (parse_all)         : %10.0f lines/sec"
+          % bench_throughput(lines, eager=True))
+    mem = bench_memory(lines)
+    if mem is not None:
+        print("memory per parsed event   : %10.0f bytes" % mem)
+
+
+if __name__ == '__main__':
+    main()
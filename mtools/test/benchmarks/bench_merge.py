@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Benchmark merging many log files by timestamp in mlogfilter.
+
+Usage: python bench_merge.py [--files N] [--lines N]
+
+Writes N synthetic log files (64 by default, like the logs of a large
+sharded cluster) with interleaved timestamps to a temporary directory and
+merges them with MLogFilterTool._merge_logfiles, reporting merged lines per
+second.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from mtools.mlogfilter.mlogfilter import MLogFilterTool
+from mtools.util.logfile import LogFile
+
+LINE = ('%s I COMMAND  [conn%i] command test.coll command: find { find: '
+        '"coll", filter: { a: %i } } planSummary: COLLSCAN '
+        'docsExamined:%i numYields:0 reslen:%i %ims\n')
+
+
+def write_logfiles(directory, files, lines):
+    paths = []
+    start = datetime(2018, 1, 1)
+    for i in range(files):
+        path = os.path.join(directory, 'mongod_%02i.log' % i)
+        dt = start
+        with open(path, 'w') as f:
+            for j in range(lines):
+                dt += timedelta(milliseconds=random.randint(1, 2000))
+                timestamp = dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + '+0000'
+                f.write(LINE % (timestamp, i, j, j, 100 + j, j % 1000))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--lines', type=int, default=2000,
+                        help='lines per file (default 2000)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = write_logfiles(directory, args.files, args.lines)
+        filehandles = [open(path, 'rb') for path in paths]
+
+        tool = MLogFilterTool()
+        tool.args = {'logfile': [LogFile(fh) for fh in filehandles],
+                     'markers': [None] * args.files,
+                     'timezone': [0] * args.files}
+
+        start = time.time()
+        merged = 0
+        last = None
+        for logevent in tool._merge_logfiles():
+            assert last is None or last <= logevent.datetime
+            last = logevent.datetime
+            merged += 1
+        elapsed = time.time() - start
+
+        assert merged == args.files * args.lines
+        print("merged %i files: %9.0f lines/sec" % (
+            args.files, merged / elapsed))
+
+        for fh in filehandles:
+            fh.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
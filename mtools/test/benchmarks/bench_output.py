@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Benchmark the output of mlogfilter when most lines match.
+
+Usage: python bench_output.py [--lines N] [--mode MODE [MODE ...]]
+
+Writes a synthetic log file with N lines (1M by default, use --lines
+10000000 for a large run) to a temporary directory and runs mlogfilter on
+it without filters, with --human and with --json, writing to /dev/null and
+reporting output lines per second for each mode. Run it from a terminal,
+mlogfilter reads from stdin if it is a pipe.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from mtools.mlogfilter.mlogfilter import MLogFilterTool
+
+LINE = ('%s I COMMAND  [conn%i] command test.coll command: find { find: '
+        '"coll", filter: { a: %i } } planSummary: COLLSCAN '
+        'docsExamined:%i numYields:0 reslen:%i %ims\n')
+
+MODES = {'plain': '', 'human': '--human', 'json': '--json'}
+
+
+def write_logfile(path, lines):
+    dt = datetime(2018, 1, 1)
+    with open(path, 'w') as f:
+        for i in range(lines):
+            dt += timedelta(milliseconds=7)
+            timestamp = dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + '+0000'
+            f.write(LINE % (timestamp, i % 100, i, i * 13, 100 + i,
+                            i % 5000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--mode', nargs='+', default=['plain', 'human',
+                                                      'json'],
+                        choices=sorted(MODES))
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'mongod.log')
+        write_logfile(path, args.lines)
+
+        for mode in args.mode:
+            tool = MLogFilterTool()
+            stdout = sys.stdout
+            start = time.time()
+            with open(os.devnull, 'w') as devnull:
+                sys.stdout = devnull
+                try:
+                    tool.run('%s --slow 0 %s' % (path, MODES[mode]))
+                finally:
+                    sys.stdout = stdout
+            elapsed = time.time() - start
+            print("%-6s %9.0f lines/sec" % (mode, args.lines / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Benchmark for scanning a log file in parallel chunks.
+
+Usage: python bench_parallel.py [--processes N] LOGFILE
+
+Counts the operations per namespace of LOGFILE once serially and once with
+mtools.util.parallel.scan, reporting lines per second of both.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+from collections import Counter
+
+from mtools.util.logfile import LogFile
+from mtools.util.parallel import scan
+
+
+def count_namespaces(logfile):
+    counter = Counter()
+    for le in logfile:
+        counter[le.namespace] += 1
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('logfile')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of worker processes (default: CPUs)')
+    args = parser.parse_args()
+
+    with open(args.logfile, 'rb') as filehandle:
+        logfile = LogFile(filehandle)
+
+        start = time.time()
+        serial = count_namespaces(logfile)
+        elapsed = time.time() - start
+        lines = sum(serial.values())
+        print("serial:   %9.0f lines/sec" % (lines / elapsed))
+
+        start = time.time()
+        parallel = scan(logfile, count_namespaces, lambda a, b: a + b,
+                        processes=args.processes)
+        elapsed = time.time() - start
+        print("parallel: %9.0f lines/sec" % (lines / elapsed))
+
+        assert parallel == serial
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark for query pattern normalisation.
+
+Usage: python bench_pattern.py [LOGFILE ...]
+
+Extracts all query documents from the given log files (default: the test
+log files) and reports how many documents per second are matched by
+find_document_end() and normalised by the shell syntax parser, with and
+without the fingerprint cache of json2pattern().
+"""
+
+from __future__ import print_function
+
+import glob
+import os
+import sys
+import time
+
+import mtools
+from mtools.util.logevent import LogEvent
+from mtools.util.pattern import (_json2pattern, find_document_end,
+                                 json2pattern, pattern_cache)
+
+TRIGGERS = ['query: ', 'filter: ', 'orderby: ', 'command: ', 'q: ', 'u: ']
+
+
+def documents(paths):
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                line_str = LogEvent(line).line_str
+                for trigger in TRIGGERS:
+                    start_idx = line_str.rfind(trigger)
+                    if start_idx != -1:
+                        yield line_str[start_idx + len(trigger):]
+
+
+def bench(name, func, values, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for value in values:
+            func(value)
+    elapsed = time.time() - start
+    print("%-20s %9.0f/sec" % (name, repeat * len(values) / elapsed))
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        logfiles = os.path.join(os.path.dirname(mtools.__file__), 'test',
+                                'logfiles')
+        paths = glob.glob(os.path.join(logfiles, '*.log'))
+
+    search_strs = list(documents(paths))
+    queries = [s[:find_document_end(s) + 1].strip() for s in search_strs]
+    repeat = max(1, 100000 // max(1, len(queries)))
+    print("%i query documents, %i repetitions" % (len(queries), repeat))
+
+    bench('find_document_end', find_document_end, search_strs, repeat)
+    bench('parser (uncached)', _json2pattern, queries, repeat)
+    pattern_cache.clear()
+    bench('json2pattern', json2pattern, queries, repeat)
+    print("cache: %i hits, %i misses" % (
+        pattern_cache.hits, pattern_cache.misses))
+
+
+if __name__ == '__main__':
+    main()
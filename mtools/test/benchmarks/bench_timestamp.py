@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for the timestamp parser, one run per datetime format.
+
+Usage: python bench_timestamp.py [NUMBER]
+
+For each of the four formats, NUMBER timestamps (default 100000) are
+parsed with dateutil and with LogEvent's TimestampParser. The timestamps
+advance by 7ms each, so consecutive values mostly share the same second,
+like lines in a real log file.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import dateutil.parser
+
+from mtools.util.logevent import TimestampParser
+
+
+def timestamps(fmt, number):
+    start = datetime(2018, 5, 1, 21, 57, 45)
+    for i in range(number):
+        dt = start + timedelta(milliseconds=7 * i)
+        ms = '%03i' % (dt.microsecond // 1000)
+        if fmt == 'ctime-pre2.4':
+            yield dt.strftime('%a %b %d %H:%M:%S').split()
+        elif fmt == 'ctime':
+            yield (dt.strftime('%a %b %d %H:%M:%S') + '.' + ms).split()
+        elif fmt == 'iso8601-utc':
+            yield [dt.strftime('%Y-%m-%dT%H:%M:%S') + '.' + ms + 'Z']
+        else:
+            yield [dt.strftime('%Y-%m-%dT%H:%M:%S') + '.' + ms + '+1000']
+
+
+def bench(fmt, number):
+    values = list(timestamps(fmt, number))
+    parser = TimestampParser()
+
+    if fmt.startswith('ctime'):
+        default = datetime(datetime.now().year, 1, 1)
+        start = time.time()
+        for tokens in values:
+            dateutil.parser.parse(' '.join(tokens), default=default)
+        before = time.time() - start
+
+        start = time.time()
+        for tokens in values:
+            parser.parse_ctime(tokens)
+        after = time.time() - start
+    else:
+        start = time.time()
+        for tokens in values:
+            dateutil.parser.parse(tokens[0])
+        before = time.time() - start
+
+        start = time.time()
+        for tokens in values:
+            parser.parse_iso8601(tokens[0])
+        after = time.time() - start
+
+    print("%-14s dateutil: %9.0f/sec   TimestampParser: %9.0f/sec   "
+          "(%.1fx)" % (fmt, number / before, number / after, before / after))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for fmt in ['ctime-pre2.4', 'ctime', 'iso8601-utc', 'iso8601-local']:
+        bench(fmt, number)
+
+
+if __name__ == '__main__':
+    main()
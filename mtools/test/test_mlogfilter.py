@@ -1,18 +1,28 @@
+import io
 import json
 import os
 import re
+import shutil
 import sys
+import tempfile
 from datetime import datetime, timedelta
 from random import randrange
 
 from dateutil import parser
+from dateutil.tz import tzoffset
 from nose.plugins.skip import SkipTest
 from nose.tools import raises
 
 import mtools
-from mtools.mlogfilter.mlogfilter import MLogFilterTool
+from mtools.mlogfilter.filters import DateTimeFilter, MaskFilter
+from mtools.mlogfilter.filters.base_filter import BaseFilter, FilterChain
+from mtools.mlogfilter.filters.where_filter import (Parser, compile_node,
+                                                     raw_predicate)
+from mtools.mlogfilter.mlogfilter import MLogFilterTool, OutputWriter
+from mtools.util import parallel
 from mtools.util.logevent import LogEvent
 from mtools.util.logfile import LogFile
+from mtools.util.resultcache import ResultCache
 
 
 def random_date(start, end):
@@ -128,6 +138,84 @@ class TestMLogFilter(object):
             le = LogEvent(line)
             assert(le.datetime >= start and le.datetime <= end)
 
+    def _run(self, arguments):
+        """Run mlogfilter with a new tool, return the output lines."""
+        start = len(sys.stdout.getvalue())
+        MLogFilterTool().run(arguments)
+        # lines are reformatted (weekday, whitespace) if their datetime was
+        # parsed, compare the tokens after the weekday
+        return [' '.join(line.split()[1:])
+                for line in sys.stdout.getvalue()[start:].splitlines()]
+
+    def test_from_to_windows(self):
+        first = self._run('%s --from Aug 5 20:25 --to +3min'
+                          % self.logfile_path)
+        second = self._run('%s --from Aug 5 20:50 --to +3min'
+                           % self.logfile_path)
+        assert first and second
+
+        output = self._run('%s --from Aug 5 20:25; Aug 5 20:50 --to +3min'
+                           % self.logfile_path)
+        assert output == first + second
+
+        # the same windows from a file, one of them overlapping
+        tmpdir = tempfile.mkdtemp()
+        try:
+            windows = os.path.join(tmpdir, 'windows.txt')
+            with open(windows, 'w') as f:
+                f.write('# incidents\n'
+                        'Aug 5 20:50; +3min\n'
+                        'Aug 5 20:25; Aug 5 20:27\n'
+                        'Aug 5 20:26; Aug 5 20:28\n')
+            assert self._run('%s --windows %s' % (self.logfile_path,
+                                                  windows)) == output
+        finally:
+            shutil.rmtree(tmpdir)
+
+        # merged files are fast-forwarded as well
+        merged = self._run('%s %s --markers none --from Aug 5 20:25; '
+                           'Aug 5 20:50 --to +3min' % (self.logfile_path,
+                                                       self.logfile_path))
+        assert len(merged) == 2 * len(output)
+        assert sorted(merged) == sorted(output + output)
+
+    def test_from_to_comma_date(self):
+        # a comma in a date is part of the date, not a second window
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        expected = self._run('%s --from Apr 9 2014 23:20 --to +1min'
+                             % logfile_path)
+        assert expected
+        assert self._run('%s --from Apr 9, 2014 23:20 --to +1min'
+                         % logfile_path) == expected
+        assert self._run('%s --from Apr 9 2014 23:20 --to Apr 9, 2014 23:21'
+                         % logfile_path) == expected
+
+    def test_from_to_merge_bounds(self):
+        start = datetime(2014, 4, 9, 23, 10, tzinfo=tzoffset(None, -14400))
+        end = start + timedelta(minutes=5)
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        logfile = LogFile(open(logfile_path, 'rb'))
+        expected = [le for le in logfile
+                    if le.datetime and start <= le.datetime <= end]
+
+        self.tool.run('%s %s --markers none --from %s --to %s'
+                      % (logfile_path, logfile_path, start.isoformat(),
+                         end.isoformat()))
+        output = sys.stdout.getvalue().splitlines()
+        assert len(output) == 2 * len(expected)
+
+        # each file stops reading at its first line after --to
+        for merged in self.tool.args['logfile']:
+            assert merged.end_offset is not None
+            assert merged.end_offset < merged.filesize
+
+    @raises(SystemExit)
+    def test_from_to_windows_mismatch(self):
+        self.tool.run('%s --from Aug 5 20:25; Aug 5 20:50 --to +1min; +2min; '
+                      '+3min' % self.logfile_path)
+
     def test_json(self):
         """Output with --json is in JSON format."""
         self.tool.run('%s --json' % self.logfile_path)
@@ -137,6 +225,48 @@ class TestMLogFilter(object):
             assert(line_dict)
             assert(type(line_dict) == dict)
 
+    def test_json_escapes(self):
+        """Output with --json round-trips quotes, backslashes and unicode."""
+        line = (u'2014-04-09T23:16:20.437-0400 [conn1] query test.c query: '
+                u'{ a: "q\\"uo\\\\te caf\u00e9 \u65e5\u672c" } '
+                u'ntoreturn:0 nscanned:1 nreturned:1 reslen:40 150ms')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            logfile_path = os.path.join(tmpdir, 'escapes.log')
+            with io.open(logfile_path, 'w', encoding='utf-8') as f:
+                f.write(line + u'\n')
+            self.tool.run('%s --slow 100 --json' % logfile_path)
+        finally:
+            shutil.rmtree(tmpdir)
+        output = sys.stdout.getvalue().splitlines()
+        assert len(output) == 1
+        line_dict = json.loads(output[0])
+        logevent = LogEvent(line)
+        assert line_dict['line_str'] == logevent.line_str == line
+        assert line_dict['duration'] == logevent.duration == 150
+        assert set(line_dict) == set(logevent.to_dict())
+
+    def test_output_writer(self):
+        # lines are written once they add up to the buffer size
+        stream = io.StringIO()
+        writer = OutputWriter(stream, 10)
+        writer.write(u'first')
+        assert stream.getvalue() == u''
+        writer.write(u'second')
+        assert stream.getvalue() == u'first\nsecond\n'
+        writer.write(u'third')
+        writer.flush()
+        writer.flush()
+        assert stream.getvalue() == u'first\nsecond\nthird\n'
+
+        # text streams with a binary buffer are written to the buffer
+        binary = io.BytesIO()
+        stream = io.TextIOWrapper(binary, encoding='utf-8')
+        stream.write(u'before\n')
+        writer = OutputWriter(stream, 0)
+        writer.write(u'caf\xe9')
+        assert binary.getvalue() == b'before\ncaf\xc3\xa9\n'
+
     def test_shorten_50(self):
         self.tool.run('%s --shorten 50' % self.logfile_path)
         output = sys.stdout.getvalue()
@@ -162,6 +292,21 @@ class TestMLogFilter(object):
                 continue
             assert prev_le.datetime <= next_le.datetime
 
+    def test_merge_timezone_from(self):
+        # --from is in adjusted time, files are forwarded to their local time
+        start = self.logfile.start + timedelta(minutes=20)
+        expected = len([le for le in self.logfile
+                        if le.datetime and le.datetime >= start])
+        self.tool.run('%s %s --timezone 1 --markers none --from %s'
+                      % (self.logfile_path, self.logfile_path,
+                         (start + timedelta(hours=1)).isoformat()))
+        output = sys.stdout.getvalue()
+        events = [LogEvent(line) for line in output.splitlines()]
+        dated = [le.datetime for le in events if le.datetime]
+        assert len(dated) == 2 * expected
+        assert dated == sorted(dated)
+        assert dated[0] >= start + timedelta(hours=1)
+
     def test_merge_markers(self):
         file_length = len(self.logfile)
         self.tool.run('%s %s --markers foo bar' % (self.logfile_path,
@@ -214,6 +359,175 @@ class TestMLogFilter(object):
             le = LogEvent(line)
             assert(le.duration >= 145 and le.duration <= 500)
 
+    def test_top(self):
+        durations = sorted((le.duration for le in self.logfile
+                            if le.duration is not None), reverse=True)
+        self.tool.run('%s --top 5' % self.logfile_path)
+        output = sys.stdout.getvalue()
+        lines = output.splitlines()
+        assert len(lines) == 5
+        assert [LogEvent(line).duration for line in lines] == durations[:5]
+
+    def test_top_by_merged(self):
+        yields = sorted((le.numYields for le in self.logfile
+                         if le.numYields is not None), reverse=True)
+        self.tool.run('%s %s --markers none --top 5 --by numYields'
+                      % (self.logfile_path, self.logfile_path))
+        output = sys.stdout.getvalue()
+        lines = output.splitlines()
+        # every event is in both files
+        assert ([LogEvent(line).numYields for line in lines] ==
+                [n for n in yields for _ in range(2)][:5])
+
+    @raises(SystemExit)
+    def test_top_invalid(self):
+        self.tool.run('%s --top 0' % self.logfile_path)
+
+    def test_sample(self):
+        full = self._run('%s --slow 100' % self.logfile_path)
+        sample = self._run('%s --slow 100 --sample 0.5 --sample-seed 1'
+                           % self.logfile_path)
+        assert 0 < len(sample) < len(full)
+        # a subsequence of the full output
+        remaining = iter(full)
+        assert all(line in remaining for line in sample)
+
+        assert self._run('%s --slow 100 --sample 1'
+                         % self.logfile_path) == full
+
+    def test_sample_n(self):
+        full = self._run('%s' % self.logfile_path)
+        for arguments in ['', '--slow 100', '--exclude --slow 100']:
+            sample = self._run('%s --sample-n 20 %s'
+                               % (self.logfile_path, arguments))
+            assert len(sample) == 20
+            remaining = iter(full)
+            assert all(line in remaining for line in sample)
+
+        # the same seed gives the same sample
+        assert (self._run('%s --sample-n 20 --sample-seed 5'
+                          % self.logfile_path) ==
+                self._run('%s --sample-n 20 --sample-seed 5'
+                          % self.logfile_path))
+
+    def test_sample_stratify(self):
+        groups = set((le.namespace, le.operation) for le in self.logfile)
+        self.tool.run('%s --sample-n 1 --stratify' % self.logfile_path)
+        output = sys.stdout.getvalue()
+        lines = output.splitlines()
+        assert len(lines) == len(groups)
+        assert (set((LogEvent(line).namespace, LogEvent(line).operation)
+                    for line in lines) == groups)
+
+    @raises(SystemExit)
+    def test_sample_invalid(self):
+        self.tool.run('%s --sample 0.5 --sample-n 10' % self.logfile_path)
+
+    def _run_jobs(self, arguments):
+        """Return the output of mlogfilter with and without --jobs 3."""
+        start = len(sys.stdout.getvalue())
+        MLogFilterTool().run(arguments)
+        serial = sys.stdout.getvalue()[start:]
+
+        min_chunk_size = parallel.MIN_CHUNK_SIZE
+        parallel.MIN_CHUNK_SIZE = 1000
+        try:
+            start = len(sys.stdout.getvalue())
+            MLogFilterTool().run(arguments + ' --jobs 3')
+            chunked = sys.stdout.getvalue()[start:]
+        finally:
+            parallel.MIN_CHUNK_SIZE = min_chunk_size
+        return serial, chunked
+
+    def test_jobs(self):
+        logfile_26_path = os.path.join(os.path.dirname(mtools.__file__),
+                                       'test/logfiles/', 'mongod_26.log')
+        mask_path = os.path.join(os.path.dirname(mtools.__file__),
+                                 'test/logfiles/', 'mask_centers.log')
+        for arguments in [
+                self.logfile_path,
+                '%s --slow 100 --human' % self.logfile_path,
+                '%s --exclude --slow 100' % self.logfile_path,
+                '%s --from Aug 5 20:25 --to +3min' % self.logfile_path,
+                '%s --from Aug 5 20:25; Aug 5 20:50 --to +3min --json'
+                % self.logfile_path,
+                '%s --mask %s --mask-size 30' % (self.logfile_path,
+                                                 mask_path),
+                '%s --slow 50 --timezone 2' % logfile_26_path]:
+            serial, chunked = self._run_jobs(arguments)
+            assert serial
+            assert chunked == serial
+
+    def test_jobs_wrong_guess(self):
+        # chunks that guess the state of the filters wrong are filtered
+        # again with the state of the chunk before
+        resume = DateTimeFilter.resume
+
+        def wrong_resume(self, logevent):
+            resume(self, logevent)
+            self.fromReached = not self.fromReached
+
+        DateTimeFilter.resume = wrong_resume
+        try:
+            for arguments in ['--from Aug 5 20:25 --to +3min',
+                              '--from Aug 5 20:25; Aug 5 20:50 --to +3min']:
+                serial, chunked = self._run_jobs('%s %s' % (self.logfile_path,
+                                                            arguments))
+                assert serial
+                assert chunked == serial
+        finally:
+            DateTimeFilter.resume = resume
+
+    def test_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            logfile_path = os.path.join(tmpdir, 'mongod_26.log')
+            shutil.copy(os.path.join(os.path.dirname(mtools.__file__),
+                                     'test/logfiles/', 'mongod_26.log'),
+                        logfile_path)
+
+            def output(arguments):
+                start = len(sys.stdout.getvalue())
+                MLogFilterTool().run('%s %s' % (logfile_path, arguments))
+                return sys.stdout.getvalue()[start:]
+
+            for first, second in [
+                    ('--word conn', '--word conn'),
+                    ('--word conn', '--word conn --slow 10 --human'),
+                    ('--from 23:20 --to +5min',
+                     '--from 23:20 --to +5min --word conn'),
+                    ('--from 23:20 --to +5min --exclude',
+                     '--from 23:20 --to +5min --exclude --json'),
+                    ('--from 23:18; 23:22 --to +1min',
+                     '--from 23:18; 23:22 --to +1min --thread conn15'),
+                    ('--word conn', '--word conn --top 3')]:
+                shutil.rmtree(logfile_path + '.mtcache', ignore_errors=True)
+                expected = output(second)
+                output(first + ' --cache')
+                # narrowed or the same query, then the same query again
+                assert output(second + ' --cache') == expected
+                assert output(second + ' --cache') == expected
+
+            # a stateless filter narrows down the lines of the cached query
+            output('--word conn --slow 10 --cache')
+            cache = ResultCache(logfile_path)
+            keys = {'WordFilter': {'word': 'conn'}, 'SlowFilter':
+                    {'slow': 10}, 'timezone': [0]}
+            offsets, states, exact = cache.find(keys, False, ['SlowFilter'])
+            assert exact and states is None
+            del keys['SlowFilter']
+            assert len(cache.find(keys, False)[0]) > len(offsets)
+            # but not an --exclude query
+            assert cache.find(keys, True) is None
+
+            # a changed log file invalidates the cache
+            with open(logfile_path, 'ab') as f:
+                f.write(b'2014-04-09T23:28:39.000-0400 [conn1] appended\n')
+            assert ResultCache(logfile_path).find(keys, False) is None
+            assert not os.listdir(logfile_path + '.mtcache')
+        finally:
+            shutil.rmtree(tmpdir)
+
     @raises(SystemExit)
     def test_invalid_log(self):
         # load text file
@@ -320,6 +634,87 @@ class TestMLogFilter(object):
         assert any(line.startswith('active filters: SlowFilter')
                    for line in lines)
 
+    def test_verbose_skipped_lines(self):
+        self.tool.run('%s --namespace local.oplog.rs --verbose'
+                      % self.logfile_path)
+        output = sys.stdout.getvalue()
+        lines = output.splitlines()
+        matches = [re.match(r'(\d+) lines skipped without parsing', line)
+                   for line in lines]
+        match = next(m for m in matches if m)
+        assert int(match.group(1)) > 0
+
+    def test_verbose_filter_stats(self):
+        self.tool.run('%s --slow 100 --word query --from Aug 5 20:40 --verbose'
+                      % self.logfile_path)
+        output = sys.stdout.getvalue()
+        lines = output.splitlines()
+        header = lines.index(next(line for line in lines
+                                  if line.startswith('filter')))
+        rows = [line.split() for line in lines[header + 2:header + 5]]
+        # the stateful datetime filter first, then by cost
+        assert [row[0] for row in rows] == ['DateTimeFilter', 'SlowFilter',
+                                            'WordFilter']
+        # later filters only see the lines the earlier ones accepted
+        for prev, row in zip(rows[:-1], rows[1:]):
+            assert int(row[2]) == int(prev[2]) - int(prev[3])
+
+    def test_filter_chain_short_circuit(self):
+        calls = []
+
+        class Filter(BaseFilter):
+            def __init__(self, name, cost, accepted):
+                self.name, self.cost, self.accepted = name, cost, accepted
+
+            def accept(self, logevent):
+                calls.append(self.name)
+                return self.accepted
+
+        chain = FilterChain([Filter('expensive', 10, True),
+                             Filter('rejects', 5, False),
+                             Filter('cheap', 1, True)])
+        assert not chain.accept(None)
+        assert calls == ['cheap', 'rejects']
+
+    def test_filter_chain_adaptive(self):
+        class Filter(BaseFilter):
+            def __init__(self, cost, modulo):
+                self.cost, self.modulo = cost, modulo
+
+            def accept(self, logevent):
+                return logevent % self.modulo != 0
+
+        # the more expensive filter rejects far more lines
+        rare, frequent = Filter(1, 1000), Filter(2, 2)
+        chain = FilterChain([rare, frequent])
+        assert chain.filters[chain._order[0]] is rare
+        accepted = [i for i in range(1, 5001) if chain.accept(i)]
+        assert accepted == [i for i in range(1, 5001) if i % 2]
+        assert chain.filters[chain._order[0]] is frequent
+
+    def test_raw_predicates(self):
+        """Raw predicates must hold for every line a filter accepts."""
+        arguments = ['--slow 100', '--fast 100', '--scan',
+                     '--namespace local.oplog.rs test.docs',
+                     '--operation update query', '--command count',
+                     '--thread conn3 initandlisten', '--level I W',
+                     '--component COMMAND', '--planSummary COLLSCAN']
+        logfiles = os.path.join(os.path.dirname(mtools.__file__),
+                                'test/logfiles/')
+        for argument in arguments:
+            self.tool = MLogFilterTool()
+            self.tool.run('%s %s' % (self.logfile_path, argument))
+            for f in self.tool.filters:
+                predicate = f.rawPredicate()
+                assert predicate is not None
+                for filename in ['mongod_225.log', 'mongod_26.log',
+                                 'mongod_278.log', 'mongod_328.log',
+                                 'mongos.log']:
+                    with open(os.path.join(logfiles, filename), 'rb') as lf:
+                        for line in lf:
+                            if f.accept(LogEvent(line)):
+                                assert predicate(line)
+
     def test_namespace(self):
         self.tool.run('%s --namespace local.oplog.rs' % self.logfile_path)
         output = sys.stdout.getvalue()
@@ -355,6 +750,71 @@ class TestMLogFilter(object):
             le = LogEvent(line)
             assert(le.planSummary == "IXSCAN")
 
+    def test_where(self):
+        self.tool.run('%s --where (op in ["insert", "update"] or '
+                      'duration > 1000) and not ns =~ "^local\\."'
+                      % self.logfile_path)
+        output = sys.stdout.getvalue().splitlines()
+        assert output
+        for line in output:
+            le = LogEvent(line)
+            assert le.operation in ['insert', 'update'] or le.duration > 1000
+            assert not (le.namespace or '').startswith('local.')
+
+        # the same lines as with --slow, --fast and --namespace
+        flags = self._run('%s --slow 145 --fast 500 --namespace test.docs'
+                          % self.logfile_path)
+        where = self._run('%s --where duration >= 145 and duration <= 500 '
+                          'and ns == "test.docs"' % self.logfile_path)
+        assert flags and where == flags
+
+    def test_where_compile(self):
+        lines = ['Mon Aug  5 20:26:32 [conn4] query test.docs query: '
+                 '{ _id: 1 } planSummary: COLLSCAN ntoreturn:0 nscanned:5 '
+                 'nreturned:1 120ms',
+                 'Mon Aug  5 20:26:32 [conn4] insert test.docs 5ms',
+                 'Mon Aug  5 20:26:32 [initandlisten] waiting for '
+                 'connections']
+        events = [LogEvent(line) for line in lines]
+
+        def matches(expression):
+            tree = Parser(expression).parse()
+            accept = compile_node(tree)
+            predicate = raw_predicate(tree)
+            result = [i for i, le in enumerate(events) if accept(le)]
+            if predicate:
+                # raw predicates never reject a matching line
+                for i in result:
+                    assert predicate(lines[i].encode('utf-8'))
+            return result
+
+        assert matches('duration > 100') == [0]
+        assert matches('duration') == [0, 1]
+        assert matches('duration < 100') == [1]
+        assert matches('duration == null') == [2]
+        assert matches('ns != "test.docs"') == [2]
+        assert matches('planSummary == "COLLSCAN" and nscanned >= 5') == [0]
+        assert matches('pattern == "{_id: 1}"') == [0]
+        assert matches('thread =~ "^conn" and not op == "query"') == [1]
+        assert matches('line =~ "waiting"') == [2]
+        assert matches('op in ["insert"] or nreturned > 0') == [0, 1]
+        assert matches('nreturned > nscanned') == []
+
+    def test_where_errors(self):
+        for expression in ['duration >', 'foo == 1', 'ns > 5',
+                           'duration =~ "1"', 'ns in "a"', '(ns == "a"',
+                           'duration > 1 duration']:
+            try:
+                Parser(expression).parse()
+                compile_node(Parser(expression).parse())
+            except ValueError:
+                continue
+            raise AssertionError('%s should not compile' % expression)
+
+    @raises(SystemExit)
+    def test_where_invalid(self):
+        self.tool.run('%s --where duration >' % self.logfile_path)
+
     def test_word(self):
         self.tool.run('%s --word lock' % self.logfile_path)
         output = sys.stdout.getvalue()
@@ -420,6 +880,34 @@ class TestMLogFilter(object):
                    (le.datetime >= event2 - padding and
                     le.datetime <= event2 + padding))
 
+    def test_mask_seek(self):
+        mask_path = os.path.join(os.path.dirname(mtools.__file__),
+                                 'test/logfiles/', 'mask_centers.log')
+        args = '%s --mask %s --mask-size 10 --verbose' % (self.logfile_path,
+                                                          mask_path)
+
+        def run(seek_gap):
+            default, MaskFilter.seek_gap = MaskFilter.seek_gap, seek_gap
+            tool = MLogFilterTool()
+            start = len(sys.stdout.getvalue())
+            try:
+                tool.run(args)
+            finally:
+                MaskFilter.seek_gap = default
+            lines = sys.stdout.getvalue()[start:].splitlines()
+            separator = lines.index('====================', 1)
+            stats = next(line.split() for line in lines
+                         if line.startswith('MaskFilter'))
+            return lines[separator:lines.index('====================',
+                                               separator + 1)], int(stats[2])
+
+        output, parsed = run(timedelta(days=1))
+        seek_output, seek_parsed = run(timedelta(seconds=60))
+        assert len(output) > 1
+        assert seek_output == output
+        # lines between the two masked intervals are skipped
+        assert seek_parsed < parsed
+
     @raises(SystemExit)
     def test_no_logfile(self):
         """Test that not providing at least 1 log file throws clean error."""
@@ -1,14 +1,20 @@
 import os
 import re
+import shutil
 import sys
+import tempfile
 from datetime import timedelta, date
 from random import randrange
 
 import six
+from nose.tools import raises
 
 import mtools
 from mtools.mloginfo.mloginfo import MLogInfoTool
-from mtools.util.logfile import LogFile
+from mtools.mloginfo.sections.query_section import QuerySection
+from mtools.util import parallel
+from mtools.util.logfile import LogFile, LogFileInfo
+from mtools.util.logindex import LogIndex
 
 
 def random_date(start, end):
@@ -298,6 +304,52 @@ class TestMLogInfo(object):
         restring = r'\w+\.\w+\s+(query|update|getmore)\s+{'
         assert len(list(filter(lambda line: re.match(restring, line), lines))) >= 1
 
+    def test_queries_percentiles(self):
+        self.tool.run('%s --queries --percentiles 50,95,99 --sort 99%%'
+                      % self.logfile_path)
+        output = sys.stdout.getvalue()
+        header = next(line for line in output.splitlines()
+                      if line.startswith('namespace'))
+        titles = header.split()
+        assert titles.index('50%-ile') < titles.index('95%-ile')
+        assert titles.index('95%-ile') < titles.index('99%-ile')
+
+    @raises(SystemExit)
+    def test_queries_sort_missing_percentile(self):
+        self.tool.run('%s --queries --sort 99%%' % self.logfile_path)
+
+    def test_queries_invalid_arguments(self):
+        """ --sort and --percentiles are checked before scanning
+        """
+        add = QuerySection.add
+        calls = []
+
+        def counting_add(section, state, le):
+            calls.append(le)
+            add(section, state, le)
+
+        QuerySection.add = counting_add
+        try:
+            for arguments in ['--sort 99%', '--sort foo', '--sort 101%',
+                              '--percentiles 50,x', '--percentiles -1']:
+                try:
+                    MLogInfoTool().run('%s --queries %s'
+                                       % (self.logfile_path, arguments))
+                except SystemExit:
+                    pass
+                else:
+                    raise AssertionError('%s was accepted' % arguments)
+        finally:
+            QuerySection.add = add
+        assert calls == []
+
+    def test_queries_verbose_pattern_cache(self):
+        self.tool.run('%s --queries --verbose' % self.logfile_path)
+        output = sys.stdout.getvalue()
+        lines = output.splitlines()
+        assert any(map(lambda line: re.match(r'pattern cache: \d+ hits, '
+                                             r'\d+ misses', line), lines))
+
     def test_restarts_output(self):
         # different log file
         self.tool.run('%s --restarts' % self.logfile_path)
@@ -387,3 +439,128 @@ class TestMLogInfo(object):
         logfile_path = os.path.join(os.path.dirname(mtools.__file__),
                                     'test/logfiles/', 'issue-636.log')
         self.tool.run('%s --queries' % logfile_path)
+
+    def test_parallel_sections(self):
+        """ sections scanned in parallel chunks print the same output
+        """
+        sections = '--queries --connections --distinct --verbose'
+        min_chunk_size = parallel.MIN_CHUNK_SIZE
+        for filename, sections in [
+                ('mongod_26.log', sections),
+                ('mongod_225.log', sections),
+                ('year_rollover.log', sections + ' --restarts --rsstate'),
+                ('mongod_3_4-9_connection_stats.log', '--connstats')]:
+            logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                        'test/logfiles/', filename)
+            start = len(sys.stdout.getvalue())
+            MLogInfoTool().run('%s %s --jobs 1' % (logfile_path, sections))
+            serial = sys.stdout.getvalue()[start:]
+
+            parallel.MIN_CHUNK_SIZE = 1000
+            try:
+                start = len(sys.stdout.getvalue())
+                MLogInfoTool().run('%s %s --jobs 3' % (logfile_path,
+                                                       sections))
+                chunked = sys.stdout.getvalue()[start:]
+            finally:
+                parallel.MIN_CHUNK_SIZE = min_chunk_size
+            # pattern cache statistics depend on the cache of each process
+            cache_line = re.compile('^pattern cache: .*$', re.M)
+            assert cache_line.sub('', chunked) == cache_line.sub('', serial)
+
+    def test_shared_pass(self):
+        """ header and sections are collected in one pass over the file
+        """
+        iterate_lines = LogFile._iterate_lines
+        calls = []
+
+        def counting_iterate_lines(logfile):
+            calls.append(logfile.name)
+            iterate_lines(logfile)
+
+        metadata = '--restarts --rsinfo --rsstate'
+        for filename in ['mongod_26.log', 'mongod_225.log', 'mongod_278.log',
+                         'rsinfo_36.log', 'mongos.log', 'year_rollover.log']:
+            logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                        'test/logfiles/', filename)
+            start = len(sys.stdout.getvalue())
+            MLogInfoTool().run('%s %s' % (logfile_path, metadata))
+            expected = sys.stdout.getvalue()[start:]
+
+            LogFile._iterate_lines = counting_iterate_lines
+            try:
+                start = len(sys.stdout.getvalue())
+                MLogInfoTool().run('%s %s --connections' % (logfile_path,
+                                                            metadata))
+                output = sys.stdout.getvalue()[start:]
+            finally:
+                LogFile._iterate_lines = iterate_lines
+            assert calls == []
+
+            # same output without the connections section
+            header, rest = output.split('\nCONNECTIONS\n')
+            assert header + rest[rest.index('\nRESTARTS\n'):] == expected
+
+    def test_info_merge(self):
+        """ LogFileInfo of consecutive chunks merges to the whole file's
+        """
+        for filename in ['mongod_26.log', 'mongod_225.log', 'mongos.log',
+                         'rsinfo_36.log']:
+            logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                        'test/logfiles/', filename)
+            with open(logfile_path, 'rb') as f:
+                lines = f.readlines()
+            whole = LogFileInfo(logfile_path)
+            for line in lines:
+                whole.add_line(line)
+            for size in [1, 7, 50]:
+                merged = LogFileInfo(logfile_path)
+                for pos in range(0, len(lines), size):
+                    # chunks start at their byte offset in the file
+                    chunk = LogFileInfo(logfile_path, merged.offset)
+                    for line in lines[pos:pos + size]:
+                        chunk.add_line(line)
+                    merged.merge(chunk)
+                assert merged.to_index() == whole.to_index()
+
+    def test_index_with_sections(self):
+        """ the section scan writes the index, and a second run reuses it
+        """
+        add_line = LogFileInfo.add_line
+        calls = []
+
+        def counting_add_line(info, line):
+            calls.append(line)
+            add_line(info, line)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            logfile_path = os.path.join(tmpdir, 'mongod_26.log')
+            shutil.copy(os.path.join(os.path.dirname(mtools.__file__),
+                                     'test/logfiles/', 'mongod_26.log'),
+                        logfile_path)
+            start = len(sys.stdout.getvalue())
+            MLogInfoTool().run('%s --queries' % logfile_path)
+            expected = sys.stdout.getvalue()[start:]
+
+            start = len(sys.stdout.getvalue())
+            MLogInfoTool().run('%s --index --queries' % logfile_path)
+            assert sys.stdout.getvalue()[start:] == expected
+            assert os.path.exists(logfile_path + '.mtidx')
+            data, complete = LogIndex(logfile_path).load()
+            assert complete
+            assert data['offset'] == os.path.getsize(logfile_path)
+            assert data['checkpoints']
+
+            LogFileInfo.add_line = counting_add_line
+            try:
+                start = len(sys.stdout.getvalue())
+                MLogInfoTool().run('%s --index --queries' % logfile_path)
+                output = sys.stdout.getvalue()[start:]
+            finally:
+                LogFileInfo.add_line = add_line
+            # the header comes from the index instead of the section scan
+            assert calls == []
+            assert output == expected
+        finally:
+            shutil.rmtree(tmpdir)
@@ -1,8 +1,9 @@
 import datetime
 
 from dateutil import parser
+from dateutil.tz import tzutc
 
-from mtools.util.logevent import LogEvent
+from mtools.util.logevent import LogEvent, TimestampParser
 
 line_ctime_pre24 = ("Sun Aug  3 21:52:05 [initandlisten] db version v2.2.4, "
                     "pdfile version 4.5")
@@ -306,3 +307,108 @@ def test_logevent_lazy_evaluation():
     le.parse_all()
     for attr in fields:
         assert(getattr(le, attr) is not None)
+
+
+def test_logevent_parse_all_single_pass():
+    """ Check that parse_all() extracts the same values as the properties. """
+
+    lines = [line_getmore, line_253_numYields, line_246_numYields,
+             line_26_planSummary, line_command_26_b, line_truncated_24,
+             line_fassert, line_empty]
+    fields = ['datetime', 'level', 'component', 'thread', 'conn',
+              'operation', 'namespace', 'command', 'pattern', 'nscanned',
+              'ntoreturn', 'nreturned', 'numYields', 'planSummary', 'r',
+              'duration', 'line_str']
+
+    for line in lines:
+        eager = LogEvent(line)
+        eager.parse_all()
+        lazy = LogEvent(line)
+        for field in fields:
+            assert(getattr(eager, field) == getattr(lazy, field))
+
+    # LogEvent uses __slots__, no per-instance dictionary
+    assert(not hasattr(LogEvent(line_getmore), '__dict__'))
+
+
+def test_timestamp_parser_matches_dateutil():
+    """ Check that TimestampParser returns the same datetimes as dateutil. """
+
+    tp = TimestampParser()
+    year = datetime.datetime.now().year
+    default = datetime.datetime(year, 1, 1)
+
+    iso_tokens = ['2013-08-03T21:52:05.095+1000',
+                  '2013-08-03T21:52:05.195+1000',
+                  '2013-08-03T11:52:05.095Z',
+                  '2014-04-09T23:25:32.502-0530',
+                  '2014-04-09T23:25:32.502+05:30',
+                  '2014-04-09T23:25:32.5021234Z',
+                  '2014-04-09T23:25:32.502']
+    for token in iso_tokens:
+        dt = tp.parse_iso8601(token)
+        expected = parser.parse(token)
+        assert(dt == expected)
+        assert(dt.utcoffset() == expected.utcoffset())
+
+    ctime_tokens = ['Sun Aug  3 21:52:05.095', 'Sun Aug  3 21:52:05.195',
+                    'Sun Aug  3 21:52:05', 'Wed Dec 31 19:00:00.000',
+                    'Mon Oct 21 12:14:21.888']
+    for tokens in ctime_tokens:
+        dt = tp.parse_ctime(tokens.split())
+        expected = parser.parse(tokens, default=default)
+        assert(dt == expected.replace(tzinfo=tzutc()))
+
+
+line_36_counters = ("2017-08-16T11:06:49.563+0100 I COMMAND  [conn4] "
+                    "command test.foo command: find { find: \"foo\", "
+                    "filter: { a: 1 } } planSummary: COLLSCAN "
+                    "keysExamined:0 docsExamined:2302 cursorExhausted:1 "
+                    "numYields:18 nreturned:3 reslen:200 locks:{ Global: { "
+                    "acquireCount: { r: 38 }, timeAcquiringMicros: { r: 2345 "
+                    "} }, Database: { acquireCount: { r: 19 }, "
+                    "timeAcquiringMicros: { r: 10, w: 5 } } } storage:{ "
+                    "data: { bytesRead: 5000, timeReadingMicros: 10 } } "
+                    "protocol:op_msg 1ms")
+
+
+def test_logevent_extract_new_counters():
+    """ Check extraction of keysExamined, docsExamined, bytesRead and
+    timeAcquiringMicros. """
+
+    le = LogEvent(line_36_counters)
+    assert(le.keysExamined == 0)
+    assert(le.docsExamined == 2302)
+    assert(le.nscanned == 0)
+    assert(le.nscannedObjects == 2302)
+    assert(le.numYields == 18)
+    assert(le.nreturned == 3)
+    assert(le.bytesRead == 5000)
+    assert(le.timeAcquiringMicros == 2360)
+    assert(le.planSummary == 'COLLSCAN')
+    # lock acquire counts must not be mistaken for the legacy r/w counters
+    assert(le.r is None)
+    assert(le.w is None)
+
+    le = LogEvent(line_26_planSummary)
+    assert(le.bytesRead is None)
+    assert(le.timeAcquiringMicros is None)
+
+
+def test_logevent_deferred_decoding():
+    """ Check that lines passed as bytes are decoded on first access. """
+
+    raw = line_26_planSummary.encode('utf-8') + b'\n'
+    le = LogEvent(raw)
+    assert(isinstance(le._line, bytes))
+
+    # the datetime hint check works on the raw bytes
+    assert(le.set_datetime_hint('iso8601-local', 1, False))
+    assert(isinstance(le._line, bytes) or bytes is str)
+
+    assert(le.line_str == LogEvent(line_26_planSummary).line_str)
+    assert(le.duration == LogEvent(line_26_planSummary).duration)
+
+    # invalid UTF-8 is replaced instead of raising
+    le = LogEvent(b'2017-08-16T11:06:49.563+0100 I COMMAND  [conn4] \xff')
+    assert(le.thread == 'conn4')
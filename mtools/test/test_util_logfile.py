@@ -1,11 +1,17 @@
+import io
 import os
-from datetime import datetime
+import shutil
+import tempfile
+from datetime import datetime, timedelta
 
 from dateutil.tz import tzoffset, tzutc
 
 import mtools
+from mtools.util.columns import MISSING, EventBlock
 from mtools.util.logevent import LogEvent
 from mtools.util.logfile import LogFile
+from mtools.util.logindex import LogIndex
+from mtools.util.mapped_file import MappedFile
 
 
 class TestUtilLogFile(object):
@@ -114,3 +120,205 @@ class TestUtilLogFile(object):
         print(logfile2.hostname)
         assert logfile2.hostname == 'jimoleary.local'
         assert logfile2.port == '27017'
+
+    def test_blocks(self):
+        """LogFile: test columnar iteration with blocks()."""
+
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        logfile = LogFile(open(logfile_path, 'rb'))
+        logevents = list(logfile)
+
+        blocks = list(logfile.blocks(size=100))
+        assert all(len(block) == 100 for block in blocks[:-1])
+        block = EventBlock.concatenate(blocks)
+        assert len(block) == len(logevents)
+        assert block.datetime.dtype == 'int64'
+        assert block.duration.dtype == 'int32'
+
+        namespaces = block.values('namespace')
+        patterns = block.values('pattern')
+        with open(logfile_path, 'rb') as f:
+            for i, le in enumerate(logevents):
+                # offsets point back to the lines in the file
+                f.seek(block.offset[i])
+                assert LogEvent(f.readline()).line_str == le.line_str
+
+                if le.datetime:
+                    assert block.datetime[i] == int(
+                        (le.datetime - datetime(1970, 1, 1, tzinfo=tzutc()))
+                        .total_seconds() * 1000)
+                else:
+                    assert block.datetime[i] == MISSING
+                duration = block.duration[i]
+                assert duration == (MISSING if le.duration is None
+                                    else le.duration)
+                assert namespaces[i] == le.namespace
+                assert patterns[i] == le.pattern
+                assert block.operations[block.operation[i]] == le.operation
+
+    def test_mapped_file(self):
+        """LogFile: test memory-mapped files behave like streams."""
+
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        mapped = LogFile(open(logfile_path, 'rb'))
+        assert isinstance(mapped.filehandle, MappedFile)
+
+        with open(logfile_path, 'rb') as f:
+            stream = io.BytesIO(f.read())
+        stream.name = logfile_path
+        streamed = LogFile(stream)
+        assert not isinstance(streamed.filehandle, MappedFile)
+
+        assert ([le.line_str for le in mapped] ==
+                [le.line_str for le in streamed])
+        assert mapped.num_lines == streamed.num_lines
+        assert mapped.end == streamed.end
+
+        # fast_forward and _find_curr_line end up at the same offsets
+        for le in list(mapped)[::50]:
+            if le.datetime:
+                mapped.fast_forward(le.datetime)
+                streamed.fast_forward(le.datetime)
+                assert (mapped.filehandle.tell() ==
+                        streamed.filehandle.tell())
+
+    def test_offset_after(self):
+        """LogFile: test offset_after() finds the first line after dt."""
+
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        logfile = LogFile(open(logfile_path, 'rb'))
+
+        # offsets and datetimes of all lines
+        lines = []
+        offset = 0
+        with open(logfile_path, 'rb') as f:
+            for line in f:
+                lines.append((offset, LogEvent(line).datetime))
+                offset += len(line)
+
+        for _, dt in lines[::25]:
+            if not dt:
+                continue
+            expected = next((o for o, d in lines if d and d > dt), None)
+            if expected is None:
+                assert logfile.offset_after(dt) is None
+            else:
+                logfile.filehandle.seek(100)
+                assert logfile.offset_after(dt) == expected
+                assert logfile.filehandle.tell() == 100
+
+        assert logfile.offset_after(logfile.end) is None
+
+        # fast_forward() to just before the last line doesn't skip it
+        offset, dt = lines[-1]
+        logfile.fast_forward(dt - timedelta(microseconds=500))
+        assert logfile.filehandle.tell() <= offset
+
+    def test_event_before(self):
+        """LogFile: test event_before() finds the last dated line."""
+
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        logfile = LogFile(open(logfile_path, 'rb'))
+
+        offset = 0
+        previous = None
+        with open(logfile_path, 'rb') as f:
+            for line in f:
+                le = logfile.event_before(offset)
+                assert ((le and le.datetime) ==
+                        (previous and previous.datetime))
+                assert logfile.filehandle.tell() == 0
+                if LogEvent(line).datetime:
+                    previous = LogEvent(line)
+                offset += len(line)
+
+    def test_events_at(self):
+        """LogFile: test events_at() reads the lines at given offsets."""
+
+        logfile_path = os.path.join(os.path.dirname(mtools.__file__),
+                                    'test/logfiles/', 'mongod_26.log')
+        with open(logfile_path, 'rb') as f:
+            lines = f.readlines()
+        offsets = [sum(len(line) for line in lines[:i])
+                   for i in range(0, len(lines), 7)]
+
+        logfile = LogFile(open(logfile_path, 'rb'))
+        events = list(logfile.events_at(offsets))
+        assert [le.line_str for le in events] == [LogEvent(line).line_str
+                                                  for line in lines[::7]]
+        assert logfile.line_offset == offsets[-1]
+        assert logfile.filehandle.tell() == 0
+
+        # lines are skipped by the raw predicate and end at end_offset
+        logfile.raw_predicate = lambda line: b'conn' in line
+        logfile.end_offset = offsets[len(offsets) // 2]
+        events = list(logfile.events_at(offsets))
+        assert [le.line_str for le in events] == [
+            LogEvent(line).line_str for line in lines[::7][:len(offsets) // 2]
+            if b'conn' in line]
+
+    def test_index(self):
+        """LogFile: test the sidecar index is written, used and extended."""
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            logfile_path = os.path.join(tmpdir, 'mongod_26.log')
+            shutil.copy(os.path.join(os.path.dirname(mtools.__file__),
+                                     'test/logfiles/', 'mongod_26.log'),
+                        logfile_path)
+
+            def indexed():
+                logfile = LogFile(open(logfile_path, 'rb'))
+                logfile.use_index = True
+                logfile.checkpoint_interval = 10000
+                return logfile
+
+            def summary(logfile):
+                return (logfile.num_lines, logfile.hostname, logfile.port,
+                        logfile.repl_set, logfile.repl_set_members,
+                        logfile.storage_engine, logfile.versions,
+                        [(host, state, le.datetime)
+                         for host, state, le in logfile.rs_state])
+
+            plain = LogFile(open(logfile_path, 'rb'))
+            expected = summary(plain)
+
+            first = indexed()
+            assert summary(first) == expected
+            assert os.path.exists(logfile_path + '.mtidx')
+            assert len(first._checkpoints) > 1
+
+            # a second run takes everything from the index
+            second = indexed()
+            assert summary(second) == expected
+            assert second._index_complete
+
+            # checkpoints only narrow down the search for the same offsets
+            for le in list(plain)[::20]:
+                if le.datetime:
+                    plain.fast_forward(le.datetime)
+                    second.fast_forward(le.datetime)
+                    assert (plain.filehandle.tell() ==
+                            second.filehandle.tell())
+
+            # appended lines are scanned from where the index stops
+            with open(logfile_path, 'rb') as f:
+                lines = f.readlines()
+            with open(logfile_path, 'ab') as f:
+                f.writelines(lines[-10:])
+            grown = indexed()
+            data, complete = grown._load_index()
+            assert data and not complete
+            assert grown.num_lines == expected[0] + 10
+            assert grown.rs_state[-1][2].datetime == expected[-1][-1][2]
+
+            # a rewritten file invalidates the index
+            with open(logfile_path, 'wb') as f:
+                f.writelines(lines[5:])
+            assert LogIndex(logfile_path).load() == (None, False)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,127 @@
+import os
+
+import mtools
+from mtools.util import parallel
+from mtools.util.logfile import LogFile
+from mtools.util.parallel import chunk_ranges, scan, scan_ordered
+
+
+def _logfile(name):
+    path = os.path.join(os.path.dirname(mtools.__file__),
+                        'test/logfiles/', name)
+    return LogFile(open(path, 'rb'))
+
+
+def _events(logfile):
+    return [(le.line_str, le.datetime) for le in logfile]
+
+
+def _concat(a, b):
+    return a + b
+
+
+def test_chunk_ranges():
+    logfile = _logfile('mongod_26.log')
+    with open(logfile.name, 'rb') as f:
+        data = f.read()
+
+    ranges = chunk_ranges(logfile, 9)
+    assert len(ranges) == 9
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+        assert end == start
+        assert data[start - 1:start] == b'\n'
+
+    # a range of the file
+    start, end = ranges[2][0], ranges[6][1]
+    sub_ranges = chunk_ranges(logfile, 3, start, end)
+    assert sub_ranges[0][0] == start and sub_ranges[-1][1] == end
+    for (_, end), (start, _) in zip(sub_ranges[:-1], sub_ranges[1:]):
+        assert end == start
+        assert data[start - 1:start] == b'\n'
+
+    # more chunks than lines, one line per chunk
+    logfile = _logfile('mongod_306_ctime.log')
+    with open(logfile.name, 'rb') as f:
+        num_lines = len(f.readlines())
+    assert len(chunk_ranges(logfile, 10000)) == num_lines
+
+
+def test_scan_same_as_serial():
+    logfile = _logfile('mongod_26.log')
+    expected = _events(logfile)
+    assert scan(logfile, _events, _concat, processes=3, chunks=7) == expected
+
+    # the logfile can still be iterated as before
+    assert _events(logfile) == expected
+
+
+def test_scan_year_rollover():
+    logfile = _logfile('year_rollover.log')
+    expected = _events(logfile)
+    years = set(dt.year for _, dt in expected if dt)
+    assert len(years) == 2
+    assert scan(logfile, _events, _concat, processes=4, chunks=16) == expected
+
+
+def test_scan_closure():
+    logfile = _logfile('mongod_26.log')
+    threshold = 100
+
+    def slow_queries(chunk):
+        return sum(1 for le in chunk
+                   if le.duration is not None and le.duration > threshold)
+
+    expected = slow_queries(logfile)
+    assert expected > 0
+    assert scan(logfile, slow_queries, lambda a, b: a + b,
+                processes=2, chunks=5) == expected
+    assert scan(logfile, slow_queries, lambda a, b: a + b,
+                processes=1) == expected
+
+
+def test_scan_ordered():
+    logfile = _logfile('mongod_26.log')
+    expected = _events(logfile)
+
+    results = list(scan_ordered(logfile, _events, processes=3, chunks=20))
+    assert len(results) == 20
+    for (_, end, _), (start, _, _) in zip(results[:-1], results[1:]):
+        assert end == start
+    assert sum((partial for _, _, partial in results), []) == expected
+
+    # stop early
+    for i, result in enumerate(scan_ordered(logfile, _events, processes=2,
+                                            chunks=20)):
+        if i == 3:
+            break
+    assert _events(logfile) == expected
+
+
+def test_scan_ordered_range():
+    logfile = _logfile('mongod_26.log')
+    ranges = chunk_ranges(logfile, 4)
+    start, end = ranges[1][0], ranges[2][1]
+    expected = _events(logfile.range(start, end))
+
+    results = list(scan_ordered(logfile, _events, processes=2, chunks=5,
+                                start=start, end=end))
+    assert results[0][0] == start and results[-1][1] == end
+    assert sum((partial for _, _, partial in results), []) == expected
+
+
+def test_scan_ordered_max_chunk_size():
+    logfile = _logfile('mongod_26.log')
+    expected = _events(logfile)
+
+    max_chunk_size = parallel.MAX_CHUNK_SIZE
+    parallel.MAX_CHUNK_SIZE = 1000
+    try:
+        results = list(scan_ordered(logfile, _events, processes=2))
+    finally:
+        parallel.MAX_CHUNK_SIZE = max_chunk_size
+    # more chunks than are scheduled ahead, none larger than needed
+    assert len(results) > 2 * parallel.CHUNKS_PER_PROCESS
+    assert len(results) >= logfile.filesize // 1000
+    assert sum((partial for _, _, partial in results), []) == expected
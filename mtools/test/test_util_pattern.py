@@ -0,0 +1,246 @@
+import glob
+import json
+import os
+import re
+
+import six
+
+import mtools
+from mtools.util.logevent import LogEvent
+from mtools.util.pattern import (PatternCache, _json2pattern,
+                                 find_document_end, fingerprint,
+                                 json2pattern, pattern_cache)
+
+
+def _legacy_decode_list(data):
+    rv = []
+    contains_dict = False
+    for item in data:
+        if isinstance(item, six.text_type):
+            item = item.encode('utf-8')
+        elif isinstance(item, list):
+            item = _legacy_decode_list(item)
+        elif isinstance(item, dict):
+            item = _legacy_decode_dict(item)
+            contains_dict = True
+        rv.append(item)
+
+    # avoid sorting if any element in the list is a dict
+    if not contains_dict:
+        rv = sorted(rv)
+
+    return rv
+
+
+def _legacy_decode_dict(data):
+    rv = {}
+    for key, value in six.iteritems(data):
+        if isinstance(key, bytes):
+            key = key.encode('utf-8')
+        if isinstance(key, six.text_type):
+            if key in ['$in', '$gt', '$gte', '$lt', '$lte', '$exists']:
+                return 1
+            if key == '$nin':
+                value = 1
+            if key in ['query', '$query']:
+                return _legacy_decode_dict(value)
+
+        if isinstance(value, list):
+            value = _legacy_decode_list(value)
+        elif isinstance(value, dict):
+            value = _legacy_decode_dict(value)
+        else:
+            value = 1
+        rv[key] = value
+    return rv
+
+
+def _legacy_shell2json(s):
+    """Convert shell syntax to json."""
+    replace = {
+        r'BinData\(.+?\)': '1',
+        r'(new )?Date\(.+?\)': '1',
+        r'Timestamp\(.+?\)': '1',
+        r'ObjectId\(.+?\)': '1',
+        r'DBRef\(.+?\)': '1',
+        r'undefined': '1',
+        r'MinKey': '1',
+        r'MaxKey': '1',
+        r'NumberLong\(.+?\)': '1',
+        r'/.+?/\w*': '1'
+    }
+
+    for key, value in replace.items():
+        s = re.sub(key, value, s)
+
+    return s
+
+
+def legacy_json2pattern(s):
+    """Regex based json2pattern of mtools <= 1.5, used as reference."""
+    # make valid JSON by wrapping field names in quotes
+    s, _ = re.subn(r'([{,])\s*([^,{\s\'"]+)\s*:', ' \\1 "\\2" : ', s)
+    # handle shell values that are not valid JSON
+    s = _legacy_shell2json(s)
+    # convert to 1 where possible, to get rid of things like new Date(...)
+    s, n = re.subn(r'([:,\[])\s*([^{}\[\]"]+?)\s*([,}\]])', '\\1 1 \\3', s)
+    # now convert to dictionary, converting unicode to ascii
+    try:
+        doc = json.loads(s, object_hook=_legacy_decode_dict)
+        return json.dumps(doc, sort_keys=True, separators=(', ', ': '))
+    except ValueError:
+        return None
+
+
+
+def legacy_document_end(s):
+    stop_idx = 0
+    brace_counter = 0
+    for match in re.finditer(r'{|}', s):
+        stop_idx = match.start()
+        if s[stop_idx] == '{':
+            brace_counter += 1
+        else:
+            brace_counter -= 1
+        if brace_counter == 0:
+            break
+    return stop_idx
+
+
+queries = [
+    '{ a: 1, b: { c: 2, d: "text" }, e: "more test" }',
+    '{ a: 7, b: { c: -2.5, d: "other" }, e: "" }',
+    '{ a: "x: 1, y", b: { c: 2, d: "text" }, e: "more test" }',
+    '{ a: { $gt: 2, $lt: 4 }, "b": { $nin: [ 1, 2, 3 ] } }',
+    '{ a: { $gt: 5, $lt: 9 }, "b": { $nin: [ 1, 2 ] } }',
+    '{ tags: { $in: [ "a", "b" ] } }',
+    '{ tags: [ "a", "b" ] }',
+    '{ tags: [ "b", "a" ] }',
+    '{ tags: [ "a", "c" ] }',
+    '{ tags: { $in: [ "a, c" ] } }',
+    '{ tags: [ 1, 2 ] }',
+    '{ tags: [ 1, 2, 3 ] }',
+    "{ _id: ObjectId('528556616dde23324f233168'), ts: new Date(1234) }",
+    "{ _id: ObjectId('528556616dde23324f233169'), ts: new Date(5678) }",
+    '{ ts: Timestamp(1412180887, 1), n: NumberLong(12), r: /^foo/i }',
+    '{ ts: Timestamp(1412180888, 3), n: NumberLong(7), r: /bar/ }',
+    '{ a: true, b: null, c: MinKey, d: undefined }',
+    '{ a: false, b: null, c: MaxKey, d: undefined }',
+    '{ "$or": [ { a: 1 }, { b: "x" } ] }',
+    '{ "$or": [ { a: 2 }, { b: "y" } ] }',
+]
+
+
+def test_fingerprint_strips_literals():
+    assert(fingerprint('{ a: 1, b: "foo" }') ==
+           fingerprint('{ a: 25, b: "bar, baz" }'))
+    # list items are part of the pattern, only numbers are stripped there
+    assert(fingerprint('{ a: [ "x" ] }') != fingerprint('{ a: [ "y" ] }'))
+    assert(fingerprint('{ a: [ 1 ] }') == fingerprint('{ a: [ 2 ] }'))
+    # field names are kept
+    assert(fingerprint('{ a: 1 }') != fingerprint('{ b: 1 }'))
+
+
+def test_fingerprint_consistent_with_json2pattern():
+    """ Queries sharing a fingerprint must share their pattern. """
+    patterns = {}
+    for query in queries:
+        pattern = _json2pattern(query)
+        patterns.setdefault(fingerprint(query), set()).add(pattern)
+    for fp in patterns:
+        assert(len(patterns[fp]) == 1)
+    assert(len(patterns) < len(queries))
+
+
+def test_json2pattern_cached():
+    pattern_cache.clear()
+    for query in queries:
+        assert(json2pattern(query) == _json2pattern(query))
+    misses = pattern_cache.misses
+    assert(misses == len(pattern_cache))
+    assert(pattern_cache.hits + misses == len(queries))
+
+    for query in queries:
+        assert(json2pattern(query) == _json2pattern(query))
+    assert(pattern_cache.misses == misses)
+    assert(pattern_cache.hits + misses == 2 * len(queries))
+
+
+def test_pattern_cache_lru():
+    cache = PatternCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert(cache.get('a') == 1)
+    cache.put('c', 3)
+    # 'b' was least recently used and got evicted
+    assert(len(cache) == 2)
+    assert(cache.get('a') == 1)
+    assert(cache.get('c') == 3)
+    try:
+        cache.get('b')
+        assert(False)
+    except KeyError:
+        pass
+
+
+def test_json2pattern_shell_syntax():
+    assert(_json2pattern('{ a: 1, b: { c: 2, d: "text" }, e: "more test" }')
+           == '{"a": 1, "b": {"c": 1, "d": 1}, "e": 1}')
+    assert(_json2pattern('{ "$or": [ { b: 1 }, { a: 1 } ], c: [ 3, 1 ] }')
+           == '{"$or": [{"b": 1}, {"a": 1}], "c": [1, 1]}')
+    assert(_json2pattern('{ tags: [ "b", "a" ] }') == '{"tags": ["a", "b"]}')
+    assert(_json2pattern('{ a: { $in: [ { b: "}" } ] }, c: { $nin: [ 1 ] } }')
+           == '{"a": 1, "c": {"$nin": 1}}')
+    assert(_json2pattern("{ a: ObjectId('abc'), b: NumberLong(3), "
+                         "c: new Date(1234), d: /^a{2}}/i, "
+                         "e: Timestamp 1412180887000|1, f: BinData(0, ABC=) }")
+           == '{"a": 1, "b": 1, "c": 1, "d": 1, "e": 1, "f": 1}')
+    assert(_json2pattern('{ query: { a: 1 }, orderby: { b: 1 } }')
+           == '{"a": 1}')
+    assert(_json2pattern('{ a: 1, b: { c: 2 }') is None)
+    assert(_json2pattern('{ a: 1 } }') is None)
+    assert(_json2pattern('') is None)
+
+
+def test_find_document_end():
+    assert(find_document_end('{ a: { b: 1 } } foo }') == 14)
+    assert(find_document_end('{ a: "}" } foo }') == 9)
+    assert(find_document_end('{ a: /}/ } foo }') == 9)
+    # unbalanced and missing documents behave like the regex implementation
+    assert(find_document_end('{ a: { b: 1 }') == 12)
+    assert(find_document_end('COLLSCAN') == 0)
+
+
+def test_json2pattern_differential():
+    """ Compare against the regex implementation for all test log files. """
+    logfiles = os.path.join(os.path.dirname(mtools.__file__),
+                            'test', 'logfiles')
+    paths = glob.glob(os.path.join(logfiles, '*.log'))
+    paths += glob.glob(os.path.join(logfiles, '*', '*.log'))
+
+    compared = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                le = LogEvent(line)
+                for trigger in ['query: ', 'filter: ', 'orderby: ',
+                                'command: ', 'q: ', 'u: ']:
+                    start_idx = le.line_str.rfind(trigger)
+                    if start_idx == -1:
+                        continue
+                    search_str = le.line_str[start_idx + len(trigger):]
+                    end = find_document_end(search_str)
+                    if '"' not in search_str[:end + 1]:
+                        # braces in strings are matched by the regex version
+                        assert(end == legacy_document_end(search_str))
+                    query = search_str[:end + 1].strip()
+
+                    try:
+                        expected = legacy_json2pattern(query)
+                    except (TypeError, AttributeError):
+                        # strings in lists fail to serialize in python 3
+                        continue
+                    assert(_json2pattern(query) == expected)
+                    compared += 1
+
+    assert(compared > 500)
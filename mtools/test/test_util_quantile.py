@@ -0,0 +1,85 @@
+import random
+
+from mtools.util.quantile import QuantileSketch
+
+
+def _percentile(values, q):
+    """Linearly interpolated quantile like numpy.percentile."""
+    values = sorted(values)
+    pos = q * (len(values) - 1)
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    weight = pos - low
+    return values[low] * (1.0 - weight) + values[high] * weight
+
+
+def test_empty():
+    sketch = QuantileSketch()
+    assert len(sketch) == 0
+    assert sketch.quantile(0.5) is None
+    assert sketch.min is None and sketch.max is None
+
+
+def test_exact():
+    values = [random.randint(0, 1000) for _ in range(200)]
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.add(value)
+
+    assert sketch.exact
+    assert sketch.count == 200
+    assert sketch.sum == sum(values)
+    assert sketch.min == min(values) and sketch.max == max(values)
+    for q in [0, 0.25, 0.5, 0.95, 0.99, 1]:
+        assert sketch.quantile(q) == _percentile(values, q)
+
+
+def test_float():
+    # the same digits as numpy.percentile, and floats for integer values
+    sketch = QuantileSketch()
+    for value in [867, 582, 821]:
+        sketch.add(value)
+    assert repr(sketch.quantile(0.95)) == '862.4000000000001'
+    assert repr(sketch.quantile(0.5)) == '821.0'
+
+    for value in [0] * 300 + [5]:
+        sketch.add(value)
+    assert not sketch.exact
+    assert repr(sketch.quantile(0.5)) == '0.0'
+    assert isinstance(sketch.quantile(1), float)
+
+
+def test_relative_error():
+    values = [int(random.lognormvariate(3, 2)) for _ in range(10000)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    assert not sketch.exact
+    assert sketch.sum == sum(values)
+    assert sketch.min == min(values) and sketch.max == max(values)
+    values.sort()
+    for q in [0, 0.1, 0.5, 0.9, 0.95, 0.99, 1]:
+        expected = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected
+
+
+def test_merge():
+    values = [int(random.expovariate(0.01)) for _ in range(3000)]
+    single = QuantileSketch()
+    for value in values:
+        single.add(value)
+
+    # chunks of different sizes, some exact and some not
+    merged = QuantileSketch()
+    for start, end in [(0, 100), (100, 150), (150, 1000), (1000, 3000)]:
+        chunk = QuantileSketch()
+        for value in values[start:end]:
+            chunk.add(value)
+        merged.merge(chunk)
+
+    assert merged.count == single.count
+    assert merged.sum == single.sum
+    assert (merged.min, merged.max) == (single.min, single.max)
+    for q in [0, 0.5, 0.95, 0.99, 1]:
+        assert merged.quantile(q) == single.quantile(q)
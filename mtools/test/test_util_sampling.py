@@ -0,0 +1,77 @@
+from collections import Counter
+
+from mtools.util.sampling import (BernoulliSampler, ReservoirSampler,
+                                  StratifiedSampler)
+
+
+def test_bernoulli():
+    sampler = BernoulliSampler(0.2, seed=1)
+    kept = [i for i in range(10000) if sampler.keep()]
+    assert 1700 < len(kept) < 2300
+
+    sampler = BernoulliSampler(1.0)
+    assert all(sampler.keep() for _ in range(1000))
+
+
+def test_bernoulli_seed():
+    first = BernoulliSampler(0.5, seed=42)
+    second = BernoulliSampler(0.5, seed=42)
+    assert ([first.keep() for _ in range(100)] ==
+            [second.keep() for _ in range(100)])
+
+
+def test_reservoir_small():
+    sampler = ReservoirSampler(10)
+    for i in range(5):
+        sampler.add(i)
+    assert sampler.items() == list(range(5))
+
+
+def test_reservoir_order():
+    sampler = ReservoirSampler(100, seed=1)
+    for i in range(100000):
+        sampler.add(i)
+    items = sampler.items()
+    assert len(items) == 100
+    assert items == sorted(set(items))
+    assert sampler.seen == 100000
+
+
+def test_reservoir_uniform():
+    counts = Counter()
+    for seed in range(2000):
+        sampler = ReservoirSampler(5, seed=seed)
+        for i in range(20):
+            sampler.add(i)
+        counts.update(sampler.items())
+
+    # each of the 20 items is expected 500 times
+    assert len(counts) == 20
+    assert all(400 < count < 600 for count in counts.values())
+
+
+def test_reservoir_wants():
+    # only the items that wants() is True for have to be looked at
+    sampler = ReservoirSampler(10, seed=3)
+    wanted = 0
+    for i in range(100000):
+        if sampler.wants():
+            sampler.put(i)
+            wanted += 1
+    assert len(sampler) == 10
+    # about n * (1 + ln(N / n)) items go into the reservoir
+    assert wanted < 300
+
+
+def test_stratified():
+    sampler = StratifiedSampler(3, key=lambda item: item[0], seed=1)
+    for i in range(10000):
+        sampler.add(('frequent', i))
+    sampler.add(('rare', 10000))
+    for i in range(10001, 10100):
+        sampler.add(('frequent', i))
+
+    items = sampler.items()
+    assert len(items) == 4
+    assert ('rare', 10000) in items
+    assert [i for _, i in items] == sorted(i for _, i in items)
@@ -194,13 +194,32 @@ class LogFileTool(BaseCmdLineTool):
             if not self.stdin_allowed:
                 raise SystemExit("this tool can't parse input from stdin.")
 
-            arg_opts['const'] = LogFile(sys.stdin)
+            # read raw bytes like from log files (python 3 stdin is text)
+            arg_opts['const'] = LogFile(getattr(sys.stdin, 'buffer',
+                                                sys.stdin))
             arg_opts['action'] = 'store_const'
             if 'type' in arg_opts:
                 del arg_opts['type']
             if 'nargs' in arg_opts:
                 del arg_opts['nargs']
         self.argparser.add_argument('logfile', **arg_opts)
+        self.argparser.add_argument('--index', action='store_true',
+                                    default=False,
+                                    help=('read and write a sidecar index '
+                                          '(<logfile>.mtidx) to speed up '
+                                          'repeated runs on the same file'))
+
+    def run(self, arguments=None, get_unknowns=False):
+        """Parse the arguments and enable the index on the log files."""
+        BaseCmdLineTool.run(self, arguments, get_unknowns)
+
+        if self.args.get('index'):
+            logfiles = self.args['logfile']
+            if not isinstance(logfiles, list):
+                logfiles = [logfiles]
+            for logfile in logfiles:
+                if isinstance(logfile, LogFile):
+                    logfile.use_index = True
 
 
 if __name__ == '__main__':
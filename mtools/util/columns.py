@@ -0,0 +1,142 @@
+#!/bin/python
+"""Columnar representation of log events as NumPy arrays."""
+
+from calendar import timegm
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# value of numeric columns where the log line doesn't have the field
+MISSING = -1
+
+
+class Categories(object):
+    """
+    Dictionary encoding for a categorical column.
+
+    Each distinct value gets an integer code in order of appearance, None is
+    encoded as MISSING.
+    """
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return None if code == MISSING else self.values[code]
+
+    def code(self, value):
+        """Return the code of value, adding it if it wasn't seen before."""
+        if value is None:
+            return MISSING
+        try:
+            return self._codes[value]
+        except KeyError:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+
+class EventBlock(object):
+    """
+    Block of log events as NumPy arrays, one array per field.
+
+    Numeric columns (datetime in milliseconds since the epoch, duration,
+    nscanned, nreturned, numYields) hold MISSING where a line doesn't have
+    the field. The namespace, operation and pattern columns hold codes into
+    the Categories in namespaces, operations and patterns, which are shared
+    by all blocks of a LogFile.blocks() call. The offset column holds the
+    byte offset of each line in the file.
+    """
+
+    numeric_columns = [('datetime', 'int64'), ('duration', 'int32'),
+                       ('nscanned', 'int64'), ('nreturned', 'int64'),
+                       ('numYields', 'int32'), ('offset', 'int64')]
+    category_columns = [('namespace', 'namespaces'),
+                        ('operation', 'operations'),
+                        ('pattern', 'patterns')]
+
+    def __init__(self, columns, namespaces, operations, patterns):
+        if np is None:
+            raise ImportError("NumPy is required for columnar log access.")
+
+        for name, dtype in self.numeric_columns:
+            setattr(self, name, np.array(columns[name], dtype=dtype))
+        for name, _ in self.category_columns:
+            setattr(self, name, np.array(columns[name], dtype='int32'))
+
+        self.namespaces = namespaces
+        self.operations = operations
+        self.patterns = patterns
+
+    def __len__(self):
+        return len(self.offset)
+
+    @classmethod
+    def concatenate(cls, blocks):
+        """Join the blocks of one LogFile.blocks() call into one block."""
+        blocks = list(blocks)
+        if not blocks:
+            return None
+
+        columns = {}
+        for name, _ in cls.numeric_columns + cls.category_columns:
+            columns[name] = np.concatenate([getattr(block, name)
+                                            for block in blocks])
+        first = blocks[0]
+        return cls(columns, first.namespaces, first.operations,
+                   first.patterns)
+
+    def values(self, name):
+        """Return the decoded values of a categorical column as a list."""
+        categories = getattr(self, dict(self.category_columns)[name])
+        return [categories[code] for code in getattr(self, name)]
+
+
+class EventBlockBuilder(object):
+    """Collect log events row by row and turn them into an EventBlock."""
+
+    def __init__(self):
+        self.namespaces = Categories()
+        self.operations = Categories()
+        self.patterns = Categories()
+        self.clear()
+
+    def __len__(self):
+        return len(self.columns['offset'])
+
+    def clear(self):
+        self.columns = dict((name, []) for name, _ in
+                            (EventBlock.numeric_columns +
+                             EventBlock.category_columns))
+
+    def add(self, logevent, offset):
+        """Append logevent, found at byte offset in the file, as a row."""
+        columns = self.columns
+        dt = logevent.datetime
+        if dt is None:
+            columns['datetime'].append(MISSING)
+        else:
+            columns['datetime'].append(timegm(dt.utctimetuple()) * 1000 +
+                                       dt.microsecond // 1000)
+
+        for name in ('duration', 'nscanned', 'nreturned', 'numYields'):
+            value = getattr(logevent, name)
+            columns[name].append(MISSING if value is None else value)
+        columns['offset'].append(offset)
+
+        columns['namespace'].append(self.namespaces.code(logevent.namespace))
+        columns['operation'].append(self.operations.code(logevent.operation))
+        columns['pattern'].append(self.patterns.code(logevent.pattern))
+
+    def build(self):
+        """Return the collected rows as an EventBlock and start over."""
+        block = EventBlock(self.columns, self.namespaces, self.operations,
+                           self.patterns)
+        self.clear()
+        return block
@@ -3,14 +3,15 @@
 import json
 import re
 import sys
+import time
 from datetime import datetime
 
 import dateutil.parser
-from dateutil.tz import tzutc
+from dateutil.tz import tzoffset, tzutc
 
 from six.moves import range
 
-from mtools.util.pattern import json2pattern
+from mtools.util.pattern import find_document_end, json2pattern
 
 
 class DateTimeEncoder(json.JSONEncoder):
@@ -22,6 +23,124 @@ class DateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+class TimestampParser(object):
+    """
+    Parse the timestamp formats of MongoDB log files.
+
+    Instead of going through the generic dateutil parser, the fields are
+    sliced from their fixed positions. Consecutive log lines usually share
+    the same second, so the datetime of the last seen second is cached and
+    only the fractional part is parsed for the following lines. tzinfo
+    objects are cached per offset string. Anything unexpected is handed to
+    dateutil.
+    """
+
+    months = dict((m, i + 1) for i, m in enumerate(['Jan', 'Feb', 'Mar',
+                                                    'Apr', 'May', 'Jun',
+                                                    'Jul', 'Aug', 'Sep',
+                                                    'Oct', 'Nov', 'Dec']))
+
+    def __init__(self):
+        self._tzinfos = {}
+        self._iso_second = None
+        self._iso_datetime = None
+        self._ctime_second = None
+        self._ctime_datetime = None
+        self._year = None
+        self._year_expires = 0
+
+    def current_year(self):
+        """Return the current year, only asking the clock once a minute."""
+        now = time.time()
+        if now >= self._year_expires:
+            self._year = datetime.now().year
+            self._year_expires = now + 60
+        return self._year
+
+    def tzinfo(self, offset):
+        """Return the (cached) tzinfo object for an offset like +0500 or Z."""
+        tz = self._tzinfos.get(offset, False)
+        if tz is False:
+            if offset == '':
+                tz = None
+            elif offset == 'Z':
+                tz = tzutc()
+            elif (offset[0] in '+-' and offset[1:3].isdigit() and
+                    offset[-2:].isdigit() and
+                    (len(offset) == 5 or
+                     (len(offset) == 6 and offset[3] == ':'))):
+                seconds = int(offset[1:3]) * 3600 + int(offset[-2:]) * 60
+                if offset[0] == '-':
+                    seconds = -seconds
+                tz = tzoffset(None, seconds) if seconds else tzutc()
+            else:
+                raise ValueError("unknown timezone offset %s" % offset)
+            self._tzinfos[offset] = tz
+        return tz
+
+    @staticmethod
+    def _split_fraction(s):
+        """Split '.123+0500' into the microseconds and the remainder."""
+        if not s or s[0] != '.':
+            return 0, s
+        end = 1
+        while end < len(s) and s[end].isdigit():
+            end += 1
+        fraction = s[1:end]
+        if not fraction:
+            return 0, s[end:]
+        return int(fraction[:6].ljust(6, '0')), s[end:]
+
+    def parse_iso8601(self, token):
+        """Parse iso8601-utc and iso8601-local timestamps."""
+        try:
+            second = token[:19]
+            if second == self._iso_second:
+                dt = self._iso_datetime
+            else:
+                if token[4] != '-' or token[10] != 'T':
+                    raise ValueError
+                dt = datetime(int(token[0:4]), int(token[5:7]),
+                              int(token[8:10]), int(token[11:13]),
+                              int(token[14:16]), int(token[17:19]))
+                self._iso_second = second
+                self._iso_datetime = dt
+
+            microsecond, offset = self._split_fraction(token[19:])
+            return dt.replace(microsecond=microsecond,
+                              tzinfo=self.tzinfo(offset))
+        except (ValueError, IndexError):
+            return dateutil.parser.parse(token)
+
+    def parse_ctime(self, tokens):
+        """Parse ctime and ctime-pre2.4 timestamps, given as 4 tokens."""
+        _, month, day, time_str = tokens[:4]
+        year = self.current_year()
+        try:
+            second = (year, month, day, time_str[:8])
+            if second == self._ctime_second:
+                dt = self._ctime_datetime
+            else:
+                if time_str[2] != ':' or time_str[5] != ':':
+                    raise ValueError
+                dt = datetime(year, self.months[month], int(day),
+                              int(time_str[0:2]), int(time_str[3:5]),
+                              int(time_str[6:8]), tzinfo=self.tzinfo('Z'))
+                self._ctime_second = second
+                self._ctime_datetime = dt
+
+            microsecond, rest = self._split_fraction(time_str[8:])
+            if rest:
+                raise ValueError
+            return dt.replace(microsecond=microsecond) if microsecond else dt
+        except (ValueError, IndexError, KeyError):
+            dt = dateutil.parser.parse(' '.join(tokens[:4]),
+                                       default=datetime(year, 1, 1))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=tzutc())
+            return dt
+
+
 class LogEvent(object):
     """
     Extract information from log line and store properties/variables.
@@ -44,14 +163,42 @@ class LogEvent(object):
     default is None: nscanned, ntoreturn, nreturned, ninserted, nupdated
 
     For performance reason, all fields are evaluated lazily upon first
-    request.
+    request. parse_all() extracts all fields at once in a single pass over
+    the tokens, which is cheaper if most of the fields are needed anyway.
+
+    LogEvent uses __slots__ to keep the memory footprint of large lists of
+    events low, so only the attributes listed below can be set.
+
+    Lines passed as bytes are kept undecoded until the text is first needed,
+    so events that are skipped early don't pay for UTF-8 decoding.
     """
 
+    __slots__ = ['from_string', '_year_rollover', '_profile_doc',
+                 '_line', 'merge_marker_str',
+                 '_split_tokens_calculated', '_split_tokens',
+                 '_duration_calculated', '_duration',
+                 '_datetime_calculated', '_datetime', '_datetime_nextpos',
+                 '_datetime_format', '_datetime_str',
+                 '_thread_calculated', '_thread', '_conn',
+                 '_operation_calculated', '_operation', '_namespace',
+                 '_pattern', '_sort_pattern', '_actual_query', '_actual_sort',
+                 '_command_calculated', '_command',
+                 '_counters_calculated', '_nscanned', '_nscannedObjects',
+                 '_ntoreturn', '_nupdated', '_nreturned', '_ninserted',
+                 '_ndeleted', '_numYields', '_planSummary',
+                 '_actualPlanSummary', '_writeConflicts', '_keyUpdates',
+                 '_bytesRead', '_timeAcquiringMicros',
+                 '_r', '_w', '_r_acquiring', '_w_acquiring',
+                 '_level_calculated', '_level', '_component',
+                 # set from outside by mplotqueries and mlogvis
+                 'end_datetime', 'filename', '_id']
+
     # datetime handler for json encoding
     dthandler = lambda obj: obj.isoformat() if isinstance(obj,
                                                           datetime) else None
 
     weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    _weekdays_bytes = [day.encode('ascii') for day in weekdays]
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
               'Oct', 'Nov', 'Dec']
 
@@ -62,16 +209,29 @@ class LogEvent(object):
                       'NETWORK', 'QUERY', 'REPL', 'SHARDING', 'STORAGE',
                       'JOURNAL', 'WRITE', 'TOTAL']
 
+    _thread_regex = re.compile(r'^\[([^\]]*)\]$')
+    _iso8601_regex = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}'
+                                r'.\d{3}')
+    # fraction and offset of datetime.isoformat()
+    _isoformat_offset_regex = re.compile(r'(\.\d+)?([+-])(\d\d):(\d\d)')
+
+    # shared by to_json(), which converts datetimes itself so that the C
+    # encoder doesn't call back into Python for them
+    _json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+    # shared by all LogEvent objects, caches state across consecutive lines
+    timestamp_parser = TimestampParser()
+
     def __init__(self, doc_or_str):
         self._year_rollover = False
-        if isinstance(doc_or_str, bytes):
-            doc_or_str = doc_or_str.decode("utf-8")
 
-        if isinstance(doc_or_str, str) or (sys.version_info.major == 2 and
-                                           isinstance(doc_or_str, unicode)):
-            # create from string, remove line breaks at end of _line_str
+        if isinstance(doc_or_str, (bytes, str)) or (
+                sys.version_info.major == 2 and
+                isinstance(doc_or_str, unicode)):
+            # create from string, remove line breaks at end of _line_str.
+            # bytes are only decoded when _line_str is accessed.
             self.from_string = True
-            self._line_str = doc_or_str.rstrip()
+            self._line = doc_or_str.rstrip()
             self._profile_doc = None
             self._reset()
         else:
@@ -127,8 +287,13 @@ class LogEvent(object):
         self._planSummary = None
         self._actualPlanSummary = None
         self._writeConflicts = None
+        self._keyUpdates = None
+        self._bytesRead = None
+        self._timeAcquiringMicros = None
         self._r = None
         self._w = None
+        self._r_acquiring = None
+        self._w_acquiring = None
         self._conn = None
 
         self._level_calculated = False
@@ -138,6 +303,18 @@ class LogEvent(object):
         self.merge_marker_str = ''
 
 
+    def _get_raw_line_str(self):
+        line = self._line
+        if isinstance(line, bytes):
+            line = self._line = line.decode('utf-8', 'replace')
+        return line
+
+    def _set_raw_line_str(self, line):
+        self._line = line
+
+    # line without datetime and merge marker, decoded on first access
+    _line_str = property(_get_raw_line_str, _set_raw_line_str)
+
     def set_line_str(self, line_str):
         """
         Set line_str.
@@ -180,30 +357,34 @@ class LogEvent(object):
         """Calculate duration if available (lazy)."""
         if not self._duration_calculated:
             self._duration_calculated = True
+            self._extract_duration()
 
-            # split_tokens = self.split_tokens
-            line_str = self.line_str
+        return self._duration
+
+    def _extract_duration(self):
+        """Extract the duration from the end of the line."""
+        # the datetime and merge marker are only prepended to line_str,
+        # so looking at the remainder of the line is sufficient here
+        line_str = self._line_str
 
-            if (line_str
+        if (line_str
                 and line_str.endswith('ms')
                 and 'Scheduled new oplog query' not in line_str):
 
-                try:
-                    # find duration from end
-                    space_pos = line_str.rfind(" ")
-                    if space_pos == -1:
-                        return
-                    self._duration = int(line_str[line_str.rfind(" ") +
-                                                  1:-2].replace(',', ''))
-                except ValueError:
-                    self._duration = None
-            elif "flushing" in self.line_str:
-                matchobj = re.search(r'flushing mmaps took (\d+)ms',
-                                     self.line_str)
-                if matchobj:
-                    self._duration = int(matchobj.group(1))
-
-        return self._duration
+            try:
+                # find duration from end
+                space_pos = line_str.rfind(" ")
+                if space_pos == -1 and not (self.merge_marker_str or
+                                            self._datetime_str):
+                    return
+                self._duration = int(line_str[space_pos + 1:-2]
+                                     .replace(',', ''))
+            except ValueError:
+                self._duration = None
+        elif "flushing" in line_str:
+            matchobj = re.search(r'flushing mmaps took (\d+)ms', line_str)
+            if matchobj:
+                self._duration = int(matchobj.group(1))
 
     @property
     def datetime(self):
@@ -257,20 +438,28 @@ class LogEvent(object):
 
         # Fast check if timestamp format changed.
         # If it has, trigger datetime evaluation.
+        if isinstance(self._line, bytes) and bytes is not str:
+            # check the leading tokens without decoding the line
+            split_tokens = self._line.split(None, nextpos)
+            weekdays = self._weekdays_bytes
+        else:
+            split_tokens = self.split_tokens
+            weekdays = self.weekdays
+
         if format.startswith('ctime'):
-            if (len(self.split_tokens) < 4 or
-                    self.split_tokens[self._datetime_nextpos - 4] not in
-                    self.weekdays):
+            if (len(split_tokens) < 4 or
+                    split_tokens[self._datetime_nextpos - 4] not in
+                    weekdays):
                 _ = self.datetime
                 return False
             return True
         else:
-            if len(self.split_tokens) == 0:
+            if len(split_tokens) == 0:
                 # empty line, no need to parse datetime
                 self._datetime_calculated = True
                 return False
             try:
-                if not (self.split_tokens[self._datetime_nextpos - 1][0]
+                if not (split_tokens[self._datetime_nextpos - 1][:1]
                         .isdigit()):
                     # not the timestamp format that was hinted
                     _ = self.datetime
@@ -304,28 +493,22 @@ class LogEvent(object):
         if assume_iso8601_format:
             # sanity check, because the dateutil parser could interpret
             # any numbers as a valid date
-            if not re.match(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}',
-                            tokens[0]):
+            if not self._iso8601_regex.match(tokens[0]):
                 return None
 
-            # convinced that this is a ISO-8601 format, the dateutil parser
+            # convinced that this is a ISO-8601 format, the timestamp parser
             # will do the rest
-            dt = dateutil.parser.parse(tokens[0])
+            dt = self.timestamp_parser.parse_iso8601(tokens[0])
             self._datetime_format = "iso8601-utc" \
                 if tokens[0].endswith('Z') else "iso8601-local"
 
         else:
             # assume current year unless self.year_rollover
             # is set (from LogFile)
-            year = datetime.now().year
-            dt = dateutil.parser.parse(' '.join(tokens[: 4]),
-                                       default=datetime(year, 1, 1))
-
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=tzutc())
+            dt = self.timestamp_parser.parse_ctime(tokens)
 
             if self._year_rollover and dt > self._year_rollover:
-                dt = dt.replace(year=year - 1)
+                dt = dt.replace(year=dt.year - 1)
 
             self._datetime_format = "ctime" \
                 if '.' in tokens[3] else "ctime-pre2.4"
@@ -337,26 +520,30 @@ class LogEvent(object):
         """Extract thread name if available (lazy)."""
         if not self._thread_calculated:
             self._thread_calculated = True
+            self._extract_thread()
 
-            split_tokens = self.split_tokens
+        return self._thread
 
-            if not self.datetime_nextpos:
-                return None
-            if len(split_tokens) <= self.datetime_nextpos:
-                return None
+    def _extract_thread(self):
+        """Extract thread name and connection id from the tokens."""
+        split_tokens = self.split_tokens
 
-            connection_token = split_tokens[self.datetime_nextpos]
-            match = re.match(r'^\[([^\]]*)\]$', connection_token)
-            if match:
-                self._thread = match.group(1)
-
-            if self._thread is not None:
-                if self._thread in ['initandlisten', 'mongosMain']:
-                    if len(split_tokens) >= 5 and split_tokens[-5][0] == '#':
-                        self._conn = 'conn' + split_tokens[-5][1:]
-                elif self._thread.startswith('conn'):
-                    self._conn = self._thread
-        return self._thread
+        if not self.datetime_nextpos:
+            return
+        if len(split_tokens) <= self.datetime_nextpos:
+            return
+
+        connection_token = split_tokens[self.datetime_nextpos]
+        match = self._thread_regex.match(connection_token)
+        if match:
+            self._thread = match.group(1)
+
+        if self._thread is not None:
+            if self._thread in ['initandlisten', 'mongosMain']:
+                if len(split_tokens) >= 5 and split_tokens[-5][0] == '#':
+                    self._conn = 'conn' + split_tokens[-5][1:]
+            elif self._thread.startswith('conn'):
+                self._conn = self._thread
 
     @property
     def conn(self):
@@ -623,66 +810,131 @@ class LogEvent(object):
 
         return self._w
 
+    @property
+    def keysExamined(self):
+        """Extract keysExamined (nscanned) counter if available (lazy)."""
+        return self.nscanned
+
+    @property
+    def docsExamined(self):
+        """Extract docsExamined (nscannedObjects) counter if available."""
+        return self.nscannedObjects
+
+    @property
+    def bytesRead(self):
+        """Extract storage bytesRead counter if available (lazy)."""
+        if not self._counters_calculated:
+            self._counters_calculated = True
+            self._extract_counters()
+
+        return self._bytesRead
+
+    @property
+    def timeAcquiringMicros(self):
+        """
+        Extract time spent acquiring locks if available (lazy).
+
+        This is the sum over all lock types and modes listed under
+        timeAcquiringMicros in the locks section of the line.
+        """
+        if not self._counters_calculated:
+            self._counters_calculated = True
+            self._extract_counters()
+
+        return self._timeAcquiringMicros
+
+    # counter name as it appears in the log line -> attribute to store the
+    # value in. Current counter names are mapped into their legacy
+    # equivalents for broader log file support.
+    _counter_attributes = {
+        'nscanned': '_nscanned',
+        'keysExamined': '_nscanned',
+        'nscannedObjects': '_nscannedObjects',
+        'docsExamined': '_nscannedObjects',
+        'ntoreturn': '_ntoreturn',
+        'nreturned': '_nreturned',
+        'nMatched': '_nreturned',
+        'ninserted': '_ninserted',
+        'nInserted': '_ninserted',
+        'nupdated': '_nupdated',
+        'nModified': '_nupdated',
+        'ndeleted': '_ndeleted',
+        'nDeleted': '_ndeleted',
+        'r': '_r',
+        'w': '_w',
+        'numYields': '_numYields',
+        'planSummary': '_planSummary',
+        'writeConflicts': '_writeConflicts',
+        'keyUpdates': '_keyUpdates',
+        'bytesRead': '_bytesRead',
+        'timeAcquiringMicros': '_timeAcquiringMicros',
+    }
+
     def _extract_counters(self):
         """Extract counters like nscanned and nreturned from the logevent."""
-        # extract counters (if present)
-        counters = ['nscanned', 'nscannedObjects', 'ntoreturn', 'nreturned',
-                    'ninserted', 'nupdated', 'ndeleted', 'r', 'w', 'numYields',
-                    'planSummary', 'writeConflicts', 'keyUpdates']
-
-        # TODO: refactor mtools to use current counter names throughout
-        # Transitionary hack: mapping of current names into prior equivalents
-        counter_equiv = {
-            'docsExamined': 'nscannedObjects',
-            'keysExamined': 'nscanned',
-            'nDeleted': 'ndeleted',
-            'nInserted': 'ninserted',
-            'nMatched': 'nreturned',
-            'nModified': 'nupdated'
-        }
-        counters.extend(counter_equiv.keys())
+        # trigger operation evaluation to get access to offset
+        if not self.operation:
+            return
 
         split_tokens = self.split_tokens
+        counter_attributes = self._counter_attributes
 
-        # trigger operation evaluation to get access to offset
-        if self.operation:
-            for t, token in enumerate(split_tokens[self.datetime_nextpos +
-                                                   2:]):
-                for counter in counters:
-                    if token.startswith('%s:' % counter):
-                        try:
-                            # Remap counter to standard name, if applicable
-                            counter = counter_equiv.get(counter, counter)
-                            vars(self)['_' + counter] = int((token.split(':')
-                                                             [-1]).replace(',',
-                                                                           ''))
-                        except ValueError:
-                            # see if this is a pre-2.5.2 numYields with space
-                            # in between (e.g. "numYields: 2")
-                            # https://jira.mongodb.org/browse/SERVER-10101
-                            if (counter == 'numYields' and
-                                    token.startswith('numYields')):
-                                try:
-                                    self._numYields = int((split_tokens[t + 1 + self.datetime_nextpos + 2]).replace(',', ''))
-                                except ValueError:
-                                    pass
-                            if (counter == 'planSummary' and
-                                    token.startswith('planSummary')):
-                                try:
-                                    self._planSummary = split_tokens[t + 1 + self.datetime_nextpos + 2]
-                                    if self._planSummary:
-                                        if split_tokens[t + 1 + self.datetime_nextpos + 3] != '{':
-                                            self._actualPlanSummary = self._planSummary
-                                        else:
-                                            self._actualPlanSummary = '%s %s' % (
-                                                self._planSummary,
-                                                self._find_pattern('planSummary: %s' % self._planSummary, actual=True)
-                                            )
-                                except ValueError:
-                                    pass
-
-                        # token not parsable, skip
+        for t in range(self.datetime_nextpos + 2, len(split_tokens)):
+            token = split_tokens[t]
+            name, sep, value = token.partition(':')
+            if not sep:
+                continue
+            attribute = counter_attributes.get(name)
+            if attribute is None:
+                continue
+
+            try:
+                setattr(self, attribute,
+                        int(token[token.rfind(':') + 1:].replace(',', '')))
+                continue
+            except ValueError:
+                pass
+
+            # the value isn't part of the token, e.g. "numYields: 2" in
+            # pre-2.5.2 log files (SERVER-10101) or the storage and locks
+            # sections of newer versions
+            next_token = split_tokens[t + 1] if t + 1 < len(split_tokens) \
+                else None
+            if next_token is None:
+                continue
+
+            if name == 'planSummary':
+                self._planSummary = next_token
+                if (t + 2 < len(split_tokens) and
+                        split_tokens[t + 2] == '{'):
+                    self._actualPlanSummary = '%s %s' % (
+                        self._planSummary,
+                        self._find_pattern('planSummary: %s'
+                                           % self._planSummary, actual=True))
+                else:
+                    self._actualPlanSummary = self._planSummary
+
+            elif name == 'timeAcquiringMicros':
+                # e.g. "timeAcquiringMicros: { r: 12, w: 3041 }", add up all
+                # modes and all occurrences (Global, Database, Collection)
+                if next_token != '{':
+                    continue
+                total = 0
+                for value in split_tokens[t + 3:]:
+                    if value.startswith('}'):
                         break
+                    try:
+                        total += int(value.replace(',', ''))
+                    except ValueError:
+                        pass
+                self._timeAcquiringMicros = ((self._timeAcquiringMicros or
+                                              0) + total)
+
+            elif name in ('numYields', 'bytesRead'):
+                try:
+                    setattr(self, attribute, int(next_token.replace(',', '')))
+                except ValueError:
+                    pass
 
     @property
     def level(self):
@@ -703,7 +955,7 @@ class LogEvent(object):
         if self._level is None:
             split_tokens = self.split_tokens
 
-            if not split_tokens:
+            if len(split_tokens) < 3:
                 self._level = False
                 self._component = False
                 return
@@ -722,25 +974,46 @@ class LogEvent(object):
         """
         Trigger extraction of all information.
 
-        These values are usually evaluated lazily.
+        These values are usually evaluated lazily, and each property checks
+        and re-scans the tokens on its own. This method instead extracts all
+        fields eagerly in one pass from left to right: datetime, level and
+        component, thread, operation and namespace, command, counters and
+        duration. Tools that need most fields of a line anyway should call
+        this rather than accessing the properties one by one.
         """
-        tokens = self.split_tokens
-        duration = self.duration
-        datetime = self.datetime
-        thread = self.thread
-        operation = self.operation
-        namespace = self.namespace
-        pattern = self.pattern
-        nscanned = self.nscanned
-        nscannedObjects = self.nscannedObjects
-        ntoreturn = self.ntoreturn
-        nreturned = self.nreturned
-        ninserted = self.ninserted
-        ndeleted = self.ndeleted
-        nupdated = self.nupdated
-        numYields = self.numYields
-        w = self.w
-        r = self.r
+        if not self.from_string:
+            # system.profile documents are fully parsed on creation
+            return
+
+        # datetime also determines the position of all following fields
+        if not self._datetime_calculated:
+            self.datetime
+
+        if not self._level_calculated:
+            self._level_calculated = True
+            self._extract_level()
+
+        if not self._thread_calculated:
+            self._thread_calculated = True
+            self._extract_thread()
+
+        if not self._operation_calculated:
+            self._operation_calculated = True
+            self._extract_operation_and_namespace()
+
+        if not self._command_calculated:
+            self.command
+
+        if not self._counters_calculated:
+            self._counters_calculated = True
+            self._extract_counters()
+
+        if not self._duration_calculated:
+            self._duration_calculated = True
+            self._extract_duration()
+
+        if self._operation:
+            self.pattern
 
     def _find_pattern(self, trigger, actual=False):
         # get start of json query pattern
@@ -749,18 +1022,8 @@ class LogEvent(object):
             # no query pattern found
             return None
 
-        stop_idx = 0
-        brace_counter = 0
         search_str = self.line_str[start_idx + len(trigger):]
-
-        for match in re.finditer(r'{|}', search_str):
-            stop_idx = match.start()
-            if search_str[stop_idx] == '{':
-                brace_counter += 1
-            else:
-                brace_counter -= 1
-            if brace_counter == 0:
-                break
+        stop_idx = find_document_end(search_str)
         search_str = search_str[:stop_idx + 1].strip()
         if search_str:
             if actual:
@@ -800,8 +1063,11 @@ class LogEvent(object):
             ms_str = str(int(self.datetime.microsecond / 1000)).zfill(3)[:3]
             # change isoformat string to have 3 digit milliseconds and no :
             # in offset
-            dt_string = re.sub(r'(\.\d+)?([+-])(\d\d):(\d\d)',
-                               '.%s\\2\\3\\4' % ms_str, dt_string, count=1)
+            match = self._isoformat_offset_regex.search(dt_string)
+            if match:
+                dt_string = (dt_string[:match.start()] + '.' + ms_str +
+                             match.group(2) + match.group(3) +
+                             match.group(4) + dt_string[match.end():])
         elif format == 'iso8601-utc':
             if self.datetime.utcoffset():
                 dt_string = self.datetime.astimezone(tzutc()).strftime("%Y-%m-"
@@ -839,7 +1105,14 @@ class LogEvent(object):
     def to_json(self, labels=None):
         """Convert LogEvent object to valid JSON."""
         output = self.to_dict(labels)
-        return json.dumps(output, cls=DateTimeEncoder, ensure_ascii=False)
+        if isinstance(output.get('datetime'), datetime):
+            output['datetime'] = output['datetime'].isoformat()
+        try:
+            return self._json_encoder.encode(output)
+        except TypeError:
+            # other datetimes in custom labels
+            return json.dumps(output, cls=DateTimeEncoder,
+                              ensure_ascii=False)
 
     def _parse_document(self):
         """Parse system.profile doc, copy all values to member variables."""
@@ -2,13 +2,25 @@
 
 from __future__ import print_function
 
+import copy
 import os
 import re
 import sys
+from bisect import bisect_left
+from calendar import timegm
+from datetime import timedelta
 from math import ceil
 
+from mtools.util.columns import EventBlockBuilder
 from mtools.util.input_source import InputSource
 from mtools.util.logevent import LogEvent
+from mtools.util.logindex import LogIndex, events_from_index, events_to_index
+from mtools.util.mapped_file import MappedFile, open_mapped
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class LogFile(InputSource):
@@ -16,7 +28,8 @@ class LogFile(InputSource):
 
     def __init__(self, filehandle):
         """Provide logfile as open file stream or stdin."""
-        self.filehandle = filehandle
+        # regular files are memory-mapped, streams are read as they are
+        self.filehandle = open_mapped(filehandle)
         self.name = filehandle.name
 
         self.from_stdin = filehandle.name == "<stdin>"
@@ -47,6 +60,27 @@ class LogFile(InputSource):
 
         self._has_level = None
 
+        # optional function called with each raw line before parsing, lines
+        # for which it returns False are skipped (see mlogfilter's filters)
+        self.raw_predicate = None
+        self.skipped_lines = 0
+        # start offset of the last line returned by next() or events_at(),
+        # lines may have been skipped since the last one
+        self.line_offset = None
+
+        # byte range of the file that iteration covers, end_offset None means
+        # up to the end of the file (see range())
+        self.start_offset = 0
+        self.end_offset = None
+
+        # read and write a sidecar index with the results of _iterate_lines()
+        # and datetime checkpoints for fast_forward() (see LogIndex)
+        self.use_index = False
+        self._index_loaded = False
+        self._index_data = None
+        self._index_complete = False
+        self._checkpoints = None
+
         # make sure bounds are calculated before starting to iterate,
         # including potential year rollovers
         self._calculate_bounds()
@@ -103,7 +137,7 @@ class LogFile(InputSource):
     @property
     def has_level(self):
         """Lazy evaluation of the whether the logfile has any level lines."""
-        if self._has_level is None:
+        if not self._num_lines:
             self._iterate_lines()
         return self._has_level
 
@@ -209,13 +243,40 @@ class LogFile(InputSource):
 
     def next(self):
         """Get next line, adjust for year rollover and hint datetime format."""
+        line = self._readline()
+
+        if self.raw_predicate is not None:
+            # skip lines that can't pass the filters without parsing them
+            while line and not self.raw_predicate(line):
+                self.skipped_lines += 1
+                line = self._readline()
+        if not self.from_stdin:
+            self.line_offset = self.filehandle.tell() - len(line)
+
+        if not line:
+            raise StopIteration
+        return self._logevent(line)
+
+    def _next_unfiltered(self):
+        """Get next line regardless of raw_predicate, used for seeking."""
+        line = self._readline()
+        if not line:
+            raise StopIteration
+        return self._logevent(line)
+
+    def _readline(self):
+        """Read the next raw line, or b'' if it ends after end_offset."""
         # use readline here because next() iterator uses internal readahead
         # buffer so seek position is wrong
         line = self.filehandle.readline()
-        line = line.decode('utf-8', 'replace')
-        if line == '':
-            raise StopIteration
-        line = line.rstrip('\n')
+        if (self.end_offset is not None and
+                self.filehandle.tell() > self.end_offset):
+            return b''
+        return line
+
+    def _logevent(self, line):
+        """Create a LogEvent from a raw line, passing on datetime hints."""
+        # the line is passed on as bytes, LogEvent decodes it when needed
         le = LogEvent(line)
 
         # hint format and nextpos from previous line
@@ -254,7 +315,7 @@ class LogFile(InputSource):
 
                 # future iterations start from the beginning
                 if not self.from_stdin:
-                    self.filehandle.seek(0)
+                    self.filehandle.seek(self.start_offset)
 
                 # now raise StopIteration exception
                 raise e
@@ -265,144 +326,191 @@ class LogFile(InputSource):
                     self._start = le.datetime
             yield le
 
-    states = (['PRIMARY', 'SECONDARY', 'DOWN', 'STARTUP', 'STARTUP2',
-               'RECOVERING', 'ROLLBACK', 'ARBITER', 'UNKNOWN'])
+    def blocks(self, size=10000):
+        """
+        Iterate over LogFile object in blocks of columns.
+
+        Return an EventBlock of NumPy arrays for each (at most) size lines
+        (generator). Requires NumPy.
+        """
+        if np is None:
+            raise ImportError("NumPy is required for columnar log access.")
+
+        builder = EventBlockBuilder()
+        offset = 0 if self.from_stdin else self.filehandle.tell()
+
+        while True:
+            line = self._readline()
+            if not line:
+                break
+            builder.add(self._logevent(line), offset)
+            offset += len(line)
+
+            if len(builder) >= size:
+                yield builder.build()
+
+        if len(builder):
+            yield builder.build()
+
+        # future iterations start from the beginning
+        if not self.from_stdin:
+            self.filehandle.seek(self.start_offset)
+
+    def lines_and_events(self):
+        """
+        Iterate over the raw lines of the LogFile and their LogEvents.
+
+        Return a (line, LogEvent) tuple for each line (generator), for
+        callers that need the line as it is in the file, e.g. LogFileInfo.
+        The raw_predicate is not applied.
+        """
+        while True:
+            line = self._readline()
+            if not line:
+                break
+            yield line, self._logevent(line)
+
+        # future iterations start from the beginning
+        if not self.from_stdin:
+            self.filehandle.seek(self.start_offset)
+
+    def events_at(self, offsets):
+        """
+        Iterate over the lines that start at the given offsets.
+
+        Return a LogEvent for each line (generator), offsets have to be
+        sorted. Lines that fail the raw_predicate are skipped and iteration
+        stops at end_offset, like iteration over the whole file.
+        """
+        if self.from_stdin:
+            raise ValueError("Can't seek to lines of stdin.")
+
+        try:
+            for offset in offsets:
+                if self.end_offset is not None and offset >= self.end_offset:
+                    break
+                self.filehandle.seek(offset)
+                line = self._readline()
+                if not line:
+                    break
+                if (self.raw_predicate is not None and
+                        not self.raw_predicate(line)):
+                    self.skipped_lines += 1
+                    continue
+                self.line_offset = offset
+                yield self._logevent(line)
+        finally:
+            # future iterations start from the beginning
+            self.filehandle.seek(self.start_offset)
+
+    def range(self, start, end):
+        """
+        Return a LogFile over the byte range [start, end) of the same file.
+
+        start and end should be at the beginning of lines (see
+        mtools.util.parallel.chunk_ranges). The new LogFile has its own file
+        handle and shares the bounds, year rollover and datetime format hints
+        of this one, so that its log events are parsed as if the whole file
+        was iterated. Only iteration is limited to the range.
+        """
+        logfile = copy.copy(self)
+        logfile.filehandle = open_mapped(open(self.name, 'rb'))
+        logfile.filehandle.seek(start)
+        logfile.start_offset = start
+        logfile.end_offset = end
+        logfile.prev_pos = None
+        logfile.skipped_lines = 0
+        return logfile
 
     def __len__(self):
         """Return the number of lines in a log file."""
         return self.num_lines
 
-    def _iterate_lines(self):
-        """Count number of lines (can be expensive)."""
-        self._num_lines = 0
-        self._restarts = []
-        self._rs_state = []
-
-        ln = 0
-        for ln, line in enumerate(self.filehandle):
-            line = line.decode("utf-8", "replace")
-            if (self._has_level is None and
-                    line[28:31].strip() in LogEvent.log_levels and
-                    line[31:39].strip() in LogEvent.log_components):
-                self._has_level = True
-
-            # find version string (fast check to eliminate most lines)
-            if "version" in line[:100]:
-                logevent = LogEvent(line)
-                restart = self._check_for_restart(logevent)
-                if restart:
-                    self._restarts.append((restart, logevent))
-
-            if "starting :" in line or "starting:" in line:
-                # look for hostname, port
-                match = re.search('port=(?P<port>\d+).*host=(?P<host>\S+)',
-                                  line)
-                if match:
-                    self._hostname = match.group('host')
-                    self._port = match.group('port')
-
-            """ For 3.0 the "[initandlisten] options:" long entry contained the
-                "engine" field if WiredTiger was the storage engine. There were
-                only two engines, MMAPv1 and WiredTiger
-            """
-            if "[initandlisten] options:" in line:
-                match = re.search('replSet: "(?P<replSet>\S+)"', line)
-                if match:
-                    self._repl_set = match.group('replSet')
-
-                match = re.search('engine: "(?P<engine>\S+)"', line)
-                if match:
-                    self._storage_engine = match.group('engine')
-                else:
-                    self._storage_engine = 'mmapv1'
-
-            """ For 3.2 the "[initandlisten] options:" no longer contains the
-                "engine" field So now we have to look for the "[initandlisten]
-                wiredtiger_open config:" which was present in 3.0, but would
-                now tell us definitively that wiredTiger is being used
-            """
-            if "[initandlisten] wiredtiger_open config:" in line:
-                self._storage_engine = 'wiredTiger'
-
-            if "command admin.$cmd command: { replSetInitiate:" in line:
-                match = re.search('{ _id: "(?P<replSet>\S+)", '
-                                  'members: (?P<replSetMembers>[^]]+ ])', line)
-                if match:
-                    self._repl_set = match.group('replSet')
-                    self._repl_set_members = match.group('replSetMembers')
-
-            # Replica set config logging in MongoDB 3.0+
-            new_config = ("New replica set config in use: ")
-            if new_config in line:
-                match = re.search('{ _id: "(?P<replSet>\S+)", '
-                                  'version: (?P<replSetVersion>\d+), '
-                                  '(protocolVersion: (?P<replSetProtocol>\d+), )?'
-                                  'members: (?P<replSetMembers>[^]]+ ])', line)
-                if match:
-                    self._repl_set = match.group('replSet')
-                    self._repl_set_members = match.group('replSetMembers')
-                    self._repl_set_protocol = match.group('replSetProtocol')
-                    self._repl_set_version = match.group('replSetVersion')
-
-            # if ("is now in state" in line and
-            #        next(state for state in states if line.endswith(state))):
-            if "is now in state" in line:
-                tokens = line.split()
-                # 2.6
-                if tokens[1].endswith(']'):
-                    pos = 4
-                else:
-                    pos = 5
-                host = tokens[pos]
-                rs_state = tokens[-1]
-                state = (host, rs_state, LogEvent(line))
-                self._rs_state.append(state)
-                continue
-
-            if "[rsMgr] replSet" in line:
-                tokens = line.split()
-                if self._hostname:
-                    host = self._hostname + ':' + self._port
-                else:
-                    host = os.path.basename(self.name)
-                host += ' (self)'
-                if tokens[-1] in self.states:
-                    rs_state = tokens[-1]
-                else:
-                    # 2.6
-                    if tokens[1].endswith(']'):
-                        pos = 2
-                    else:
-                        pos = 6
-                    rs_state = ' '.join(tokens[pos:])
-
-                state = (host, rs_state, LogEvent(line))
-                self._rs_state.append(state)
-                continue
-
-        self._num_lines = ln + 1
+    # bytes between datetime checkpoints stored in the index
+    checkpoint_interval = 1 << 20
+
+    def _load_index(self):
+        """Load the sidecar index once, return (data, complete)."""
+        if not self._index_loaded:
+            self._index_loaded = True
+            if self.use_index and not self.from_stdin:
+                data, complete = LogIndex(self.name).load()
+                if data and data['datetime_format'] == self.datetime_format:
+                    self._index_data = data
+                    self._index_complete = complete
+                    self._checkpoints = data['checkpoints']
+        return self._index_data, self._index_complete
+
+    def _save_index(self, info):
+        """Write the information of a pass over all lines to the index."""
+        offset = info.offset
+        if not self.use_index or self.from_stdin or not offset:
+            return
+        # only index complete lines, an unterminated last line may grow
+        position = self.filehandle.tell()
+        try:
+            self.filehandle.seek(offset - 1)
+            complete = self.filehandle.read(1) == b'\n'
+        finally:
+            self.filehandle.seek(position)
+        if complete:
+            data = info.to_index()
+            data.update(datetime_format=self.datetime_format)
+            LogIndex(self.name).save(data)
+
+    def _checkpoint_interval(self):
+        """Return the bytes between checkpoints, None without checkpoints."""
+        # ctime timestamps have no year, their checkpoints can't be compared
+        if (self.from_stdin or
+                not (self.datetime_format or '').startswith('iso8601')):
+            return None
+        return self.checkpoint_interval
 
-        # reset logfile
-        self.filehandle.seek(0)
+    def info_collector(self):
+        """
+        Return a LogFileInfo to collect the information of _iterate_lines().
 
-    def _check_for_restart(self, logevent):
-        if logevent.thread == 'mongosMain' and 'MongoS' in logevent.line_str:
-            self._binary = 'mongos'
+        Lets callers that go through all lines anyway collect the line
+        count, restarts, etc. in the same pass (see lines_and_events() and
+        LogFileInfo), and pass the result to add_info(). Returns None if the
+        information is already known or can be taken from the index.
+        """
+        if self._num_lines or self.from_stdin:
+            return None
+        if self._load_index()[0]:
+            self._iterate_lines()
+            return None
+        info = LogFileInfo(self.name, self.start_offset)
+        info.collect_checkpoints(self._checkpoint_interval())
+        return info
 
-        elif (logevent.thread == 'initandlisten' and
-                "db version v" in logevent.line_str):
-            self._binary = 'mongod'
+    def add_info(self, info):
+        """Use the information of all lines and write it to the index."""
+        info.apply(self)
+        self._save_index(info)
 
+    def _iterate_lines(self):
+        """Count number of lines (can be expensive)."""
+        data, complete = self._load_index()
+        if data:
+            info = LogFileInfo.from_index(self.name, data)
+            if complete:
+                info.apply(self)
+                return
+            # the file has grown, continue where the index stops
+            self.filehandle.seek(data['offset'])
         else:
-            return False
+            info = LogFileInfo(self.name)
 
-        version = re.search(r'(\d\.\d\.\d+)', logevent.line_str)
+        info.collect_checkpoints(self._checkpoint_interval())
+        add_line = info.add_line
+        for line in self.filehandle:
+            add_line(line)
 
-        if version:
-            version = version.group(1)
-            return version
-        else:
-            return False
+        self.add_info(info)
+
+        # reset logfile
+        self.filehandle.seek(0)
 
     def _calculate_bounds(self):
         """Calculate beginning and end of logfile."""
@@ -470,10 +578,13 @@ class LogFile(InputSource):
         curr_pos = self.filehandle.tell()
 
         # jump back 15k characters (at most) and find last newline char
-        jump_back = min(self.filehandle.tell(), 15000)
-        self.filehandle.seek(-jump_back, 1)
-        buff = self.filehandle.read(jump_back)
-        self.filehandle.seek(curr_pos, 0)
+        jump_back = min(curr_pos, 15000)
+        start_pos = curr_pos - jump_back
+        mapped = isinstance(self.filehandle, MappedFile)
+        if not mapped:
+            self.filehandle.seek(start_pos, 0)
+            buff = self.filehandle.read(jump_back)
+            self.filehandle.seek(curr_pos, 0)
 
         if prev and self.prev_pos is not None and self.prev_pos == curr_pos:
             # Number of characters to show before/after the log offset
@@ -491,23 +602,34 @@ class LogFile(InputSource):
                              % self.filehandle.name)
         else:
             self.prev_pos = curr_pos
-        buff = buff.decode("utf-8", "replace")
-        newline_pos = buff.rfind('\n')
-        if prev:
-            newline_pos = buff[:newline_pos].rfind('\n')
+        # search the raw bytes, offsets in decoded text would differ for
+        # multi-byte characters
+        if mapped:
+            # no need to copy, search the mapping directly
+            newline_pos = self.filehandle.rfind(b'\n', start_pos, curr_pos)
+            if prev:
+                end_pos = newline_pos if newline_pos != -1 else curr_pos - 1
+                newline_pos = self.filehandle.rfind(b'\n', start_pos,
+                                                    max(end_pos, start_pos))
+        else:
+            newline_pos = buff.rfind(b'\n')
+            if prev:
+                newline_pos = buff[:newline_pos].rfind(b'\n')
+            if newline_pos != -1:
+                newline_pos += start_pos
 
         # move back to last newline char
         if newline_pos == -1:
             self.filehandle.seek(0)
-            return self.next()
+            return self._next_unfiltered()
 
-        self.filehandle.seek(newline_pos - jump_back + 1, 1)
+        self.filehandle.seek(newline_pos + 1, 0)
 
         # roll forward until we found a line with a datetime
         try:
-            logevent = self.next()
+            logevent = self._next_unfiltered()
             while not logevent.datetime:
-                logevent = self.next()
+                logevent = self._next_unfiltered()
 
             return logevent
         except StopIteration:
@@ -526,41 +648,367 @@ class LogFile(InputSource):
             # skip lines until start_dt is reached
             return
 
-        else:
-            # fast bisection path
-            max_mark = self.filesize
-            step_size = max_mark
+        # bisect the whole file, lines after end_offset included
+        end_offset, self.end_offset = self.end_offset, None
+        try:
+            self._fast_forward(start_dt)
+        finally:
+            self.end_offset = end_offset
 
-            # check if start_dt is already smaller than first datetime
-            self.filehandle.seek(0)
-            le = self.next()
-            if le.datetime and le.datetime >= start_dt:
-                self.filehandle.seek(0)
-                return
+    def _fast_forward(self, start_dt):
+        # fast bisection path
+        max_mark = self.filesize
+        step_size = max_mark
 
-            le = None
+        # check if start_dt is already smaller than first datetime
+        self.filehandle.seek(0)
+        le = self._next_unfiltered()
+        if le.datetime and le.datetime >= start_dt:
             self.filehandle.seek(0)
+            return
 
-            # search for lower bound
-            while abs(step_size) > 100:
-                step_size = ceil(step_size / 2.)
+        le = None
+        self.filehandle.seek(0)
 
-                self.filehandle.seek(step_size, 1)
-                le = self._find_curr_line()
-                if not le:
+        # narrow down the search to two checkpoints of the index
+        self._load_index()
+        if self._checkpoints:
+            start_ms = (timegm(start_dt.utctimetuple()) * 1000 +
+                        start_dt.microsecond // 1000)
+            pos = bisect_left([epoch for _, epoch in self._checkpoints],
+                              start_ms)
+            low = self._checkpoints[pos - 1][0] if pos > 0 else 0
+            if pos < len(self._checkpoints):
+                max_mark = self._checkpoints[pos][0]
+            step_size = max_mark - low
+            self.filehandle.seek(low)
+
+        # search for lower bound
+        while abs(step_size) > 100:
+            step_size = ceil(step_size / 2.)
+
+            self.filehandle.seek(step_size, 1)
+            probe = self.filehandle.tell()
+            le = self._find_curr_line()
+            if not le:
+                # no datetime after this point, continue from here backwards
+                self.filehandle.seek(probe)
+                step_size = -abs(step_size)
+            elif le.datetime >= start_dt:
+                step_size = -abs(step_size)
+            else:
+                step_size = abs(step_size)
+
+        # now walk backwards until we found a truly smaller line
+        while self.filehandle.tell() >= 2 and (le is None or
+                                               le.datetime is None or
+                                               le.datetime >= start_dt):
+            self.filehandle.seek(-2, 1)
+
+            le = self._find_curr_line(prev=True)
+
+    def event_before(self, offset, limit=1 << 20):
+        """
+        Return the last LogEvent with a datetime before offset, or None.
+
+        offset should be at the beginning of a line. At most limit bytes
+        before it are searched. The file position is not changed.
+        """
+        if self.from_stdin:
+            return None
+
+        position = self.filehandle.tell()
+        start = max(0, offset - limit)
+        try:
+            self.filehandle.seek(start)
+            data = self.filehandle.read(offset - start)
+        finally:
+            self.filehandle.seek(position)
+
+        lines = data.split(b'\n')
+        if start > 0:
+            # the first line is cut off
+            lines = lines[1:]
+        for line in reversed(lines):
+            if line:
+                le = self._logevent(line + b'\n')
+                if le.datetime:
+                    return le
+        return None
+
+    def offset_after(self, end_dt):
+        """
+        Return the offset of the first line after end_dt, using bisection.
+
+        Lines without datetime that follow the last line up to end_dt are
+        counted to it. Returns None for stdin or if the log file ends before
+        end_dt. The file position is not changed.
+        """
+        if self.from_stdin or not self.end or self.end <= end_dt:
+            return None
+
+        position = self.filehandle.tell()
+        end_offset, self.end_offset = self.end_offset, None
+        try:
+            self._fast_forward(end_dt + timedelta(microseconds=1))
+            # bisection stops within a few lines, roll forward to the exact
+            # line
+            offset = self.filehandle.tell()
+            while True:
+                le = self._next_unfiltered()
+                if le.datetime and le.datetime > end_dt:
                     break
+                offset = self.filehandle.tell()
+        except StopIteration:
+            offset = self.filehandle.tell()
+        finally:
+            self.end_offset = end_offset
+            self.filehandle.seek(position)
+        return offset
+
+class LogFileInfo(object):
+    """
+    Information about a log file that takes a pass over all lines.
+
+    Collects the line count, restarts, replica set states and configuration,
+    hostname, port, binary and storage engine for LogFile._iterate_lines().
+    Chunks of a file can be scanned separately (see mtools.util.parallel),
+    merge() combines them in file order. apply() sets the results on the
+    LogFile.
+    """
+
+    # values that are set while scanning, the last line that sets one wins
+    attributes = ['binary', 'hostname', 'port', 'repl_set',
+                  'repl_set_members', 'repl_set_version', 'repl_set_protocol',
+                  'storage_engine']
 
-                if le.datetime >= start_dt:
-                    step_size = -abs(step_size)
+    states = (['PRIMARY', 'SECONDARY', 'DOWN', 'STARTUP', 'STARTUP2',
+               'RECOVERING', 'ROLLBACK', 'ARBITER', 'UNKNOWN'])
+
+    # raw strings looked for by add_line()
+    _log_levels = set(level.encode('ascii') for level in LogEvent.log_levels)
+    _log_components = set(component.encode('ascii')
+                          for component in LogEvent.log_components)
+    _markers = [b'version', b'starting', b'[initandlisten] options:',
+                b'[initandlisten] wiredtiger_open config:',
+                b'command admin.$cmd command: { replSetInitiate:',
+                b'New replica set config in use: ', b'is now in state',
+                b'[rsMgr] replSet']
+    _markers_regex = re.compile(b'|'.join(re.escape(marker)
+                                          for marker in _markers))
+
+    def __init__(self, name, offset=0):
+        self.name = name
+        self.num_lines = 0
+        # end of the lines added so far, and (offset, epoch milliseconds)
+        # of a dated line every checkpoint_interval bytes for the index
+        self.offset = offset
+        self.checkpoints = []
+        self.checkpoint_interval = None
+        self._next_checkpoint = None
+        self.restarts = []
+        # the host of [rsMgr] lines before the hostname was found is None,
+        # it may be found in an earlier chunk
+        self.rs_state = []
+        self.has_level = None
+        self.values = {}
+
+    def _self_host(self):
+        if self.values.get('hostname'):
+            return '%s:%s (self)' % (self.values['hostname'],
+                                     self.values['port'])
+        return None
+
+    def collect_checkpoints(self, interval):
+        """Add a checkpoint every interval bytes, None for no checkpoints."""
+        self.checkpoint_interval = interval
+        if self.checkpoints:
+            self._next_checkpoint = self.checkpoints[-1][0] + (interval or 0)
+        else:
+            self._next_checkpoint = self.offset
+
+    def add_line(self, line):
+        """Add a raw line of the log file."""
+        self.num_lines += 1
+        line_offset = self.offset
+        self.offset += len(line)
+
+        if self.checkpoint_interval and line_offset >= self._next_checkpoint:
+            dt = LogEvent(line).datetime
+            if dt:
+                self.checkpoints.append(
+                    [line_offset, timegm(dt.utctimetuple()) * 1000 +
+                     dt.microsecond // 1000])
+                self._next_checkpoint = line_offset + self.checkpoint_interval
+
+        if (self.has_level is None and
+                line[28:31].strip() in self._log_levels and
+                line[31:39].strip() in self._log_components):
+            self.has_level = True
+
+        # only decode lines that contain any of the strings below
+        if not self._markers_regex.search(line):
+            return
+        line = line.decode("utf-8", "replace")
+        values = self.values
+
+        # find version string (fast check to eliminate most lines)
+        if "version" in line[:100]:
+            logevent = LogEvent(line)
+            restart = self._check_for_restart(logevent)
+            if restart:
+                self.restarts.append((restart, logevent))
+
+        if "starting :" in line or "starting:" in line:
+            # look for hostname, port
+            match = re.search('port=(?P<port>\d+).*host=(?P<host>\S+)',
+                              line)
+            if match:
+                values['hostname'] = match.group('host')
+                values['port'] = match.group('port')
+
+        """ For 3.0 the "[initandlisten] options:" long entry contained the
+            "engine" field if WiredTiger was the storage engine. There were
+            only two engines, MMAPv1 and WiredTiger
+        """
+        if "[initandlisten] options:" in line:
+            match = re.search('replSet: "(?P<replSet>\S+)"', line)
+            if match:
+                values['repl_set'] = match.group('replSet')
+
+            match = re.search('engine: "(?P<engine>\S+)"', line)
+            if match:
+                values['storage_engine'] = match.group('engine')
+            else:
+                values['storage_engine'] = 'mmapv1'
+
+        """ For 3.2 the "[initandlisten] options:" no longer contains the
+            "engine" field So now we have to look for the "[initandlisten]
+            wiredtiger_open config:" which was present in 3.0, but would
+            now tell us definitively that wiredTiger is being used
+        """
+        if "[initandlisten] wiredtiger_open config:" in line:
+            values['storage_engine'] = 'wiredTiger'
+
+        if "command admin.$cmd command: { replSetInitiate:" in line:
+            match = re.search('{ _id: "(?P<replSet>\S+)", '
+                              'members: (?P<replSetMembers>[^]]+ ])', line)
+            if match:
+                values['repl_set'] = match.group('replSet')
+                values['repl_set_members'] = match.group('replSetMembers')
+
+        # Replica set config logging in MongoDB 3.0+
+        new_config = ("New replica set config in use: ")
+        if new_config in line:
+            match = re.search('{ _id: "(?P<replSet>\S+)", '
+                              'version: (?P<replSetVersion>\d+), '
+                              '(protocolVersion: (?P<replSetProtocol>\d+), )?'
+                              'members: (?P<replSetMembers>[^]]+ ])', line)
+            if match:
+                values['repl_set'] = match.group('replSet')
+                values['repl_set_members'] = match.group('replSetMembers')
+                values['repl_set_protocol'] = match.group('replSetProtocol')
+                values['repl_set_version'] = match.group('replSetVersion')
+
+        # if ("is now in state" in line and
+        #        next(state for state in states if line.endswith(state))):
+        if "is now in state" in line:
+            tokens = line.split()
+            # 2.6
+            if tokens[1].endswith(']'):
+                pos = 4
+            else:
+                pos = 5
+            host = tokens[pos]
+            rs_state = tokens[-1]
+            state = (host, rs_state, LogEvent(line))
+            self.rs_state.append(state)
+            return
+
+        if "[rsMgr] replSet" in line:
+            tokens = line.split()
+            if tokens[-1] in self.states:
+                rs_state = tokens[-1]
+            else:
+                # 2.6
+                if tokens[1].endswith(']'):
+                    pos = 2
                 else:
-                    step_size = abs(step_size)
+                    pos = 6
+                rs_state = ' '.join(tokens[pos:])
 
-            if not le:
-                return
+            state = (self._self_host(), rs_state, LogEvent(line))
+            self.rs_state.append(state)
+            return
 
-            # now walk backwards until we found a truly smaller line
-            while self.filehandle.tell() >= 2 and (le.datetime is None or
-                                                   le.datetime >= start_dt):
-                self.filehandle.seek(-2, 1)
+    def _check_for_restart(self, logevent):
+        if logevent.thread == 'mongosMain' and 'MongoS' in logevent.line_str:
+            self.values['binary'] = 'mongos'
+
+        elif (logevent.thread == 'initandlisten' and
+                "db version v" in logevent.line_str):
+            self.values['binary'] = 'mongod'
+
+        else:
+            return False
+
+        version = re.search(r'(\d\.\d\.\d+)', logevent.line_str)
+
+        if version:
+            version = version.group(1)
+            return version
+        else:
+            return False
 
-                le = self._find_curr_line(prev=True)
+    def merge(self, other):
+        """Add the information of the chunk that follows this one."""
+        self.num_lines += other.num_lines
+        self.restarts.extend(other.restarts)
+        self.offset = other.offset
+        self.checkpoints.extend(other.checkpoints)
+
+        host = self._self_host()
+        self.rs_state.extend((host if entry[0] is None else entry[0],) +
+                             entry[1:] for entry in other.rs_state)
+
+        if other.has_level:
+            self.has_level = True
+        self.values.update(other.values)
+        return self
+
+    def apply(self, logfile):
+        """Set the collected information on logfile."""
+        logfile._num_lines = max(self.num_lines, 1)
+        logfile._restarts = self.restarts
+
+        # the hostname wasn't known yet, fall back to the file name
+        host = os.path.basename(self.name) + ' (self)'
+        logfile._rs_state = [(host if entry[0] is None else entry[0],) +
+                             entry[1:] for entry in self.rs_state]
+
+        logfile._has_level = self.has_level
+        logfile._checkpoints = self.checkpoints
+        for name, value in self.values.items():
+            setattr(logfile, '_' + name, value)
+
+    def to_index(self):
+        """Return the information as a JSON serializable dict for LogIndex."""
+        data = dict((name, self.values.get(name)) for name in self.attributes)
+        data.update(num_lines=self.num_lines, has_level=self.has_level,
+                    restarts=events_to_index(self.restarts),
+                    rs_state=events_to_index(self.rs_state),
+                    offset=self.offset, checkpoints=self.checkpoints)
+        return data
+
+    @classmethod
+    def from_index(cls, name, data):
+        """Return the LogFileInfo stored with to_index()."""
+        info = cls(name, data['offset'])
+        info.checkpoints = data['checkpoints']
+        info.num_lines = data['num_lines']
+        info.has_level = data['has_level']
+        info.restarts = events_from_index(data['restarts'])
+        info.rs_state = events_from_index(data['rs_state'])
+        info.values = dict((name, data[name]) for name in cls.attributes
+                           if data[name] is not None)
+        return info
@@ -0,0 +1,125 @@
+#!/bin/python
+"""Persistent index of log file metadata (.mtidx sidecar files)."""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from mtools.util.logevent import LogEvent
+
+
+def file_identity(path, head_size):
+    """Return size, modification time, inode and a hash of the first bytes."""
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        head = hashlib.sha1(f.read(head_size))
+    return {'size': st.st_size, 'mtime': st.st_mtime,
+            'inode': st.st_ino, 'head': head.hexdigest()}
+
+
+class LogIndex(object):
+    """
+    On-disk index for a log file.
+
+    Stores what LogFile._iterate_lines() collects (line count, restarts,
+    replica set states and configuration, hostname, port, binary, storage
+    engine) and sparse (offset, epoch milliseconds) checkpoints that narrow
+    down the bisection in LogFile.fast_forward().
+
+    The index is kept next to the log file as <logfile>.mtidx, or in
+    ~/.mtools/index/ if the log file's directory is not writable. It is
+    valid for the file with the same inode, size and modification time. If
+    the file has only grown (same inode and first block), the index covers
+    the beginning of the file and scanning continues from where it stopped.
+    """
+
+    version = 1
+
+    # number of bytes from the beginning of the file to detect truncation
+    # and rewrites of a file that has grown since
+    head_size = 4096
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def candidates(self):
+        """Return the possible locations of the index file."""
+        digest = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        home = os.path.join(os.path.expanduser('~'), '.mtools', 'index',
+                            digest + '.mtidx')
+        return [self.path + '.mtidx', home]
+
+    def _stat(self, head_size=None):
+        return file_identity(self.path, head_size or self.head_size)
+
+    def load(self):
+        """
+        Return (data, complete) for a valid index, or (None, False).
+
+        complete is False if the file has grown since the index was written,
+        in which case the data only covers the first data['offset'] bytes.
+        """
+        for candidate in self.candidates():
+            try:
+                with open(candidate, 'r') as f:
+                    data = json.load(f)
+                if (data.get('version') != self.version or
+                        data.get('path') != self.path):
+                    continue
+                # compare the same number of leading bytes as were hashed
+                stat = self._stat(min(data['size'], self.head_size))
+            except (EnvironmentError, ValueError, KeyError):
+                continue
+
+            if data['inode'] != stat['inode'] or data['head'] != stat['head']:
+                continue
+            if data['size'] == stat['size'] and data['mtime'] == stat['mtime']:
+                return data, True
+            if data['size'] < stat['size']:
+                return data, False
+
+        return None, False
+
+    def save(self, data):
+        """
+        Write the index atomically, return the path or None on failure.
+
+        data['offset'] is the number of bytes the index covers, the stat
+        values of the log file are added to data.
+        """
+        try:
+            stat = self._stat(min(data['offset'], self.head_size))
+        except EnvironmentError:
+            return None
+        # if the file grew while it was scanned, the index only covers offset
+        # bytes and the next load() continues from there
+        stat['size'] = data['offset']
+        data = dict(data, version=self.version, path=self.path, **stat)
+
+        for candidate in self.candidates():
+            directory = os.path.dirname(candidate)
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                                suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                if os.name == 'nt' and os.path.exists(candidate):
+                    os.remove(candidate)
+                os.rename(tmp_path, candidate)
+                return candidate
+            except EnvironmentError:
+                continue
+        return None
+
+
+def events_to_index(entries):
+    """Replace LogEvents at the end of each tuple with their line_str."""
+    return [list(entry[:-1]) + [entry[-1].line_str] for entry in entries]
+
+
+def events_from_index(entries):
+    """Replace line strings at the end of each list with LogEvents."""
+    return [tuple(entry[:-1]) + (LogEvent(entry[-1]),) for entry in entries]
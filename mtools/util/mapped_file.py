@@ -0,0 +1,77 @@
+#!/bin/python
+"""Memory-mapped read-only file with the interface of a binary file object."""
+
+import mmap
+import os
+import stat
+
+
+class MappedFile(object):
+    """
+    Read-only file object backed by mmap.
+
+    Supports the subset of the file interface that LogFile uses: readline,
+    read, readlines, seek, tell and iteration over lines. Unlike iterating
+    over a regular file object, tell() is exact during iteration, and seek()
+    and rfind() are pointer arithmetic on the mapping instead of buffered
+    reads.
+    """
+
+    def __init__(self, filehandle):
+        """Map the file of an open file object, see open_mapped()."""
+        self.name = filehandle.name
+        self._filehandle = filehandle
+        self._size = os.fstat(filehandle.fileno()).st_size
+        self._mmap = mmap.mmap(filehandle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # delegate the C implementations directly
+        self.readline = self._mmap.readline
+        self.read = self._mmap.read
+        self.tell = self._mmap.tell
+        self.find = self._mmap.find
+        self.rfind = self._mmap.rfind
+
+    def __iter__(self):
+        readline = self._mmap.readline
+        line = readline()
+        while line:
+            yield line
+            line = readline()
+
+    def __len__(self):
+        return self._size
+
+    def readlines(self):
+        return list(self)
+
+    def seek(self, offset, whence=0):
+        """Seek like a file object, positions are kept within the file."""
+        if whence == 1:
+            offset += self._mmap.tell()
+        elif whence == 2:
+            offset += self._size
+        self._mmap.seek(min(max(offset, 0), self._size))
+
+    def fileno(self):
+        return self._filehandle.fileno()
+
+    def close(self):
+        self._mmap.close()
+        self._filehandle.close()
+
+
+def open_mapped(filehandle):
+    """
+    Return a MappedFile for filehandle if possible, else filehandle.
+
+    Only non-empty regular files can be mapped, stdin, pipes and other
+    streams are returned unchanged.
+    """
+    try:
+        if (filehandle.name == '<stdin>' or
+                not stat.S_ISREG(os.fstat(filehandle.fileno()).st_mode)):
+            return filehandle
+        return MappedFile(filehandle)
+    except (AttributeError, ValueError, EnvironmentError):
+        # no fileno (e.g. StringIO), empty file, or mmap not possible
+        return filehandle
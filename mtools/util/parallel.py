@@ -0,0 +1,206 @@
+#!/bin/python
+"""Parallel scanning of a log file in newline-aligned chunks."""
+
+import multiprocessing
+import os
+from collections import deque
+from functools import reduce
+
+# smallest chunk worth handing to a worker process
+MIN_CHUNK_SIZE = 1 << 20
+
+# largest chunk scan_ordered() schedules, so that the chunks it runs ahead
+# bound the memory of their results even for very large files
+MAX_CHUNK_SIZE = 32 << 20
+
+# chunks per process, more than one so that fast workers pick up the slack
+CHUNKS_PER_PROCESS = 4
+
+# (logfile, map_func) of the running scan(), inherited by forked workers so
+# that map_func doesn't need to be picklable
+_job = None
+
+
+def chunk_ranges(logfile, num_chunks, start=0, end=None):
+    """
+    Split a log file into at most num_chunks (start, end) byte ranges.
+
+    All ranges start at the beginning of a line and together cover the whole
+    file, or the range from start to end if given (start at the beginning
+    of a line). Ranges are roughly equal in size, but never split a line.
+    """
+    filehandle = logfile.filehandle
+    position = filehandle.tell()
+    if end is None:
+        end = logfile.filesize
+    size = end - start
+    bounds = [start]
+
+    for i in range(1, num_chunks):
+        pos = start + size * i // num_chunks
+        if pos <= bounds[-1]:
+            continue
+        # finish the line that contains the byte before pos, the next one
+        # starts at or after pos
+        filehandle.seek(pos - 1)
+        filehandle.readline()
+        pos = filehandle.tell()
+        if pos >= end:
+            break
+        if pos > bounds[-1]:
+            bounds.append(pos)
+
+    filehandle.seek(position)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _fork_pool(processes):
+    """Return a process pool of forked workers, or None if not available."""
+    if os.name == 'nt':
+        return None
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks on POSIX
+        context = multiprocessing
+    except ValueError:
+        return None
+    return context.Pool(processes)
+
+
+def _map_chunk(chunk):
+    logfile, map_func = _job
+    start, end = chunk
+    chunk_logfile = logfile.range(start, end)
+    try:
+        return map_func(chunk_logfile)
+    finally:
+        chunk_logfile.filehandle.close()
+
+
+def scan(logfile, map_func, reduce_func, processes=None, chunks=None,
+         progress=None):
+    """
+    Scan a log file in parallel and return the combined result.
+
+    The file is split into chunks of whole lines. For each chunk,
+    map_func(chunk_logfile) is called in a worker process with a LogFile
+    restricted to the chunk (see LogFile.range) and returns a partial result.
+    The partial results, which have to be picklable, are combined in file
+    order with reduce_func(result, partial).
+
+    map_func can be any callable, including closures, as workers are forked
+    from the current process. Where forking isn't possible, for streams and
+    when there is only a single chunk, map_func(logfile) is called directly.
+    processes defaults to the number of CPUs, chunks to a few per process
+    with at least MIN_CHUNK_SIZE bytes each.
+
+    If given, progress(fraction) is called in this process whenever a chunk
+    is done. map_func can tell that it is called directly and not in a
+    worker when the LogFile it is given is logfile itself.
+    """
+    global _job
+
+    processes = processes or _cpu_count()
+    if logfile.from_stdin or processes < 2:
+        return map_func(logfile)
+
+    if chunks is None:
+        chunks = min(processes * CHUNKS_PER_PROCESS,
+                     logfile.filesize // MIN_CHUNK_SIZE)
+    ranges = chunk_ranges(logfile, max(chunks, 1))
+    if len(ranges) < 2:
+        return map_func(logfile)
+
+    # set before the workers are forked
+    _job = (logfile, map_func)
+    try:
+        pool = _fork_pool(min(processes, len(ranges)))
+        if pool is None:
+            return map_func(logfile)
+        try:
+            partials = []
+            for partial in pool.imap(_map_chunk, ranges, chunksize=1):
+                partials.append(partial)
+                if progress:
+                    progress(float(len(partials)) / len(ranges))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _job = None
+
+    return reduce(reduce_func, partials)
+
+
+def scan_ordered(logfile, map_func, processes=None, chunks=None, start=0,
+                 end=None):
+    """
+    Scan a log file in parallel, yield the partial results in file order.
+
+    Like scan(), but for results that are streamed rather than combined:
+    yields a (start, end, partial) tuple for each chunk of the byte range
+    from start to end (the whole file by default) as soon as the chunk and
+    all chunks before it are done. At most CHUNKS_PER_PROCESS chunks per
+    process are scheduled ahead of the next one to yield, and chunks default
+    to at most MAX_CHUNK_SIZE bytes, which bounds the memory of results that
+    wait for an earlier chunk.
+
+    Where forking isn't possible, or if there is only one chunk, the chunks
+    are scanned one after the other in this process. Stopping the iteration
+    early terminates the workers.
+    """
+    global _job
+
+    processes = processes or _cpu_count()
+    if end is None:
+        end = logfile.filesize
+    if chunks is None:
+        size = end - start
+        chunks = max(min(processes * CHUNKS_PER_PROCESS,
+                         size // MIN_CHUNK_SIZE),
+                     -(-size // MAX_CHUNK_SIZE))
+    ranges = chunk_ranges(logfile, max(chunks, 1), start, end)
+
+    # set before the workers are forked
+    _job = (logfile, map_func)
+    try:
+        pool = None
+        if processes > 1 and len(ranges) > 1:
+            pool = _fork_pool(min(processes, len(ranges)))
+        if pool is None:
+            for chunk in ranges:
+                yield chunk + (_map_chunk(chunk),)
+            return
+
+        try:
+            remaining = iter(ranges)
+            pending = deque()
+            for chunk in remaining:
+                pending.append((chunk, pool.apply_async(_map_chunk,
+                                                        (chunk,))))
+                if len(pending) >= processes * CHUNKS_PER_PROCESS:
+                    break
+
+            while pending:
+                chunk, result = pending.popleft()
+                partial = result.get()
+                for next_chunk in remaining:
+                    pending.append((next_chunk,
+                                    pool.apply_async(_map_chunk,
+                                                     (next_chunk,))))
+                    break
+                yield chunk + (partial,)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        _job = None
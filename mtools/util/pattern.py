@@ -3,91 +3,273 @@
 import json
 import re
 
-import six
+from mtools.util import OrderedDict
 
 
-def _decode_pattern_list(data):
-    rv = []
+# The mongo shell document syntax is tokenized with one expression per
+# position in the grammar, leading whitespace is skipped. A word is anything
+# up to the next delimiter with an optional argument list, e.g. 12.5, true,
+# MinKey, ObjectId('...') or NumberLong(3). Values can consist of several
+# words, like "new Date(1412180887000)" or "Timestamp 1412180887000|1".
+_word = r"""[^\s{}\[\]:,"'()/]+
+    (?:\s*\((?:[^()"']|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')*\))?"""
+
+_value_regex = re.compile(r"""\s*(?:
+    (?P<open>[{\[])
+  | "(?P<string>(?:[^"\\]|\\.)*)"
+  | (?P<word>%s(?:\s+%s)*)
+  | (?P<quoted>'(?:[^'\\]|\\.)*')
+  | (?P<regex>/(?:[^/\\\n]|\\.)+/\w*)
+)""" % (_word, _word), re.VERBOSE)
+
+_key_regex = re.compile(r"""\s*(?:
+    "(?P<string>(?:[^"\\]|\\.)*)"
+  | (?P<word>[^\s{}\[\]:,"'()/]+)
+)\s*:""", re.VERBOSE)
+
+_separator_regex = re.compile(r'\s*([,}\]])')
+
+_end_regex = re.compile(r'\s*$')
+
+# operators that collapse the whole sub-document to 1
+_collapse_operators = frozenset(['$in', '$gt', '$gte', '$lt', '$lte',
+                                 '$exists'])
+
+# braces outside of strings and regex literals
+_brace_regex = re.compile(r"""[{}]
+    |"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'
+    |[:,\[]\s*/(?:[^/\\\n]|\\.)+/""", re.VERBOSE)
+
+
+def _unescape(s):
+    """Return the content of a double-quoted string."""
+    if '\\' in s:
+        return json.loads('"%s"' % s)
+    return s
+
+
+def _parse_value(s, pos, in_list=False):
+    """
+    Parse the value at position pos.
+
+    Returns the pattern of the value and the position after it. Scalars
+    collapse to 1, except for strings in lists which are kept.
+    """
+    match = _value_regex.match(s, pos)
+    if match is None:
+        raise ValueError("expected value at position %i" % pos)
+
+    kind = match.lastgroup
+    if kind == 'open':
+        if match.group('open') == '{':
+            return _parse_document(s, match.end())
+        return _parse_list(s, match.end())
+    if kind == 'string' and in_list:
+        return _unescape(match.group('string')), match.end()
+    return 1, match.end()
+
+
+def _parse_list(s, pos):
+    """Parse list items after the opening bracket."""
+    items = []
     contains_dict = False
-    for item in data:
-        if isinstance(item, six.text_type):
-            item = item.encode('utf-8')
-        elif isinstance(item, list):
-            item = _decode_pattern_list(item)
-        elif isinstance(item, dict):
-            item = _decode_pattern_dict(item)
+
+    match = _separator_regex.match(s, pos)
+    if match is not None and match.group(1) == ']':
+        return items, match.end()
+
+    while True:
+        item, pos = _parse_value(s, pos, in_list=True)
+        if isinstance(item, dict):
             contains_dict = True
-        rv.append(item)
+        items.append(item)
+
+        match = _separator_regex.match(s, pos)
+        if match is None or match.group(1) == '}':
+            raise ValueError("expected ',' or ']' at position %i" % pos)
+        pos = match.end()
+        if match.group(1) == ']':
+            break
 
     # avoid sorting if any element in the list is a dict
     if not contains_dict:
-        rv = sorted(rv)
-
-    return rv
-
-
-def _decode_pattern_dict(data):
-    rv = {}
-    for key, value in six.iteritems(data):
-        if isinstance(key, bytes):
-            key = key.encode('utf-8')
-        if isinstance(key, six.text_type):
-            if key in ['$in', '$gt', '$gte', '$lt', '$lte', '$exists']:
-                return 1
-            if key == '$nin':
-                value = 1
-            if key in ['query', '$query']:
-                return _decode_pattern_dict(value)
-
-        if isinstance(value, list):
-            value = _decode_pattern_list(value)
-        elif isinstance(value, dict):
-            value = _decode_pattern_dict(value)
+        try:
+            items.sort()
+        except TypeError:
+            # mixed types can't be compared in python 3
+            items.sort(key=lambda item: (type(item).__name__, repr(item)))
+
+    return items, pos
+
+
+def _parse_document(s, pos):
+    """
+    Parse a document after the opening brace.
+
+    Values collapse to 1 and the whole document collapses to 1 if it
+    contains a range or $in operator. A query wrapped in query or $query
+    (legacy OP_QUERY format) is unwrapped.
+    """
+    doc = {}
+
+    match = _separator_regex.match(s, pos)
+    if match is not None and match.group(1) == '}':
+        return doc, match.end()
+
+    while True:
+        match = _key_regex.match(s, pos)
+        if match is None:
+            raise ValueError("expected field name at position %i" % pos)
+        key = match.group('word')
+        if key is None:
+            key = _unescape(match.group('string'))
+
+        doc[key], pos = _parse_value(s, match.end())
+
+        match = _separator_regex.match(s, pos)
+        if match is None or match.group(1) == ']':
+            raise ValueError("expected ',' or '}' at position %i" % pos)
+        pos = match.end()
+        if match.group(1) == '}':
+            break
+
+    for key in doc:
+        if key in _collapse_operators:
+            return 1, pos
+        if key in ('query', '$query'):
+            return doc[key], pos
+        if key == '$nin':
+            doc[key] = 1
+
+    return doc, pos
+
+
+def find_document_end(s):
+    """
+    Return the index of the brace closing the first document in s.
+
+    Braces in strings and regex literals are ignored. If the document is
+    not closed, the index of the last brace is returned, or 0 if s does not
+    contain any braces.
+    """
+    depth = 0
+    end = 0
+    for match in _brace_regex.finditer(s):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
         else:
-            value = 1
-        rv[key] = value
-    return rv
-
-
-def shell2json(s):
-    """Convert shell syntax to json."""
-    replace = {
-        r'BinData\(.+?\)': '1',
-        r'(new )?Date\(.+?\)': '1',
-        r'Timestamp\(.+?\)': '1',
-        r'ObjectId\(.+?\)': '1',
-        r'DBRef\(.+?\)': '1',
-        r'undefined': '1',
-        r'MinKey': '1',
-        r'MaxKey': '1',
-        r'NumberLong\(.+?\)': '1',
-        r'/.+?/\w*': '1'
-    }
-
-    for key, value in replace.items():
-        s = re.sub(key, value, s)
+            continue
+        end = match.start()
+        if depth == 0:
+            break
+    return end
 
-    return s
+
+class PatternCache(object):
+    """
+    Bounded LRU cache of query patterns.
+
+    Keys are query fingerprints (see `fingerprint()`), so that queries
+    which only differ in their literal values share one entry. The number
+    of hits and misses is counted to report the cache effectiveness.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached pattern for key or raise KeyError."""
+        # pop and re-insert to mark as most recently used
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entry."""
+        if len(self._entries) >= self.maxsize:
+            self._entries.popitem(last=False)
+        self._entries[key] = value
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+pattern_cache = PatternCache()
+
+# literal values that json2pattern replaces with 1, in a single expression:
+# quoted strings are skipped (group 'skip') so their content stays intact,
+# strings are only stripped as dict values since list items are kept, and
+# numbers, booleans, shell constructors and regexes are stripped everywhere.
+_literal_regex = re.compile(r'''
+    (?P<skip>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<key>:\s*)"(?:[^"\\]|\\.)*"(?=\s*[,}])
+  | (?P<sep>[:,\[]\s*)
+    (?:new\ Date\([^()]*\)
+      |[\w$.+-]+(?:\([^()]*\))?
+      |/(?:[^/\\]|\\.)+/\w*
+    )(?=\s*[,}\]])
+''', re.VERBOSE)
+
+
+def _strip_literal(match):
+    skip = match.group('skip')
+    if skip is not None:
+        return skip
+    return (match.group('key') or match.group('sep')) + '1'
+
+
+def fingerprint(s):
+    """
+    Return a literal-stripped fingerprint of query string s.
+
+    Values that json2pattern() would normalise to 1 anyway are replaced,
+    which makes this a cheap key for queries that share the same shape.
+    """
+    return _literal_regex.sub(_strip_literal, s)
 
 
 def json2pattern(s):
     """
     Convert JSON format to a query pattern.
 
-    Includes even mongo shell notation without quoted key names.
+    Includes even mongo shell notation without quoted key names. Results are
+    cached by query fingerprint in `pattern_cache`.
     """
-    # make valid JSON by wrapping field names in quotes
-    s, _ = re.subn(r'([{,])\s*([^,{\s\'"]+)\s*:', ' \\1 "\\2" : ', s)
-    # handle shell values that are not valid JSON
-    s = shell2json(s)
-    # convert to 1 where possible, to get rid of things like new Date(...)
-    s, n = re.subn(r'([:,\[])\s*([^{}\[\]"]+?)\s*([,}\]])', '\\1 1 \\3', s)
-    # now convert to dictionary, converting unicode to ascii
+    key = fingerprint(s)
+    try:
+        pattern = pattern_cache.get(key)
+        pattern_cache.hits += 1
+        return pattern
+    except KeyError:
+        pass
+
+    pattern_cache.misses += 1
+    pattern = _json2pattern(s)
+    pattern_cache.put(key, pattern)
+    return pattern
+
+
+def _json2pattern(s):
+    """Convert JSON format to a query pattern, without caching."""
     try:
-        doc = json.loads(s, object_hook=_decode_pattern_dict)
-        return json.dumps(doc, sort_keys=True, separators=(', ', ': '))
-    except ValueError as ex:
+        doc, pos = _parse_value(s, 0)
+        if not _end_regex.match(s, pos):
+            raise ValueError("extra data after position %i" % pos)
+    except ValueError:
         return None
+    return json.dumps(doc, sort_keys=True, separators=(', ', ': '))
 
 
 if __name__ == '__main__':
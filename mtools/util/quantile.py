@@ -0,0 +1,143 @@
+#!/bin/python
+"""Mergeable streaming statistics and quantile estimates."""
+
+from math import ceil, floor, log
+
+
+class QuantileSketch(object):
+    """
+    Running count, min, max, sum and quantiles of non-negative numbers.
+
+    Memory doesn't grow with the number of values: the first exact_limit
+    values are kept as they are and quantiles are exact (linearly
+    interpolated like numpy.percentile). After that, values are counted in
+    logarithmic buckets (like an HDR histogram or DDSketch), where bucket i
+    holds the values in (gamma^(i-1), gamma^i] with
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy).
+
+    Error bound: in bucket mode, quantile(q) returns a value within
+    relative_accuracy (1% by default) of the value at rank floor(q * (n-1))
+    of the sorted values. Zeros are counted exactly. count, min, max and sum
+    are always exact. The number of buckets is at most
+    log(max / min) / log(gamma), about 800 for values from 1 to 10^7 with
+    the default accuracy.
+
+    Sketches with the same parameters can be merged, the result is the same
+    as adding all values to one sketch.
+    """
+
+    def __init__(self, relative_accuracy=0.01, exact_limit=256):
+        self.relative_accuracy = relative_accuracy
+        self.exact_limit = exact_limit
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = log(self._gamma)
+
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+        # list of values while there are at most exact_limit, then None
+        self._values = []
+        # bucket index -> count, and the number of zeros
+        self._buckets = {}
+        self._zeros = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def exact(self):
+        """Return True while quantiles are exact."""
+        return self._values is not None
+
+    def add(self, value):
+        """Add a value."""
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if self._values is not None:
+            self._values.append(value)
+            if len(self._values) > self.exact_limit:
+                self._to_buckets()
+        else:
+            self._add_bucket(value, 1)
+
+    def _bucket(self, value):
+        return int(ceil(log(value) / self._log_gamma))
+
+    def _add_bucket(self, value, count):
+        if value <= 0:
+            self._zeros += count
+        else:
+            index = self._bucket(value)
+            self._buckets[index] = self._buckets.get(index, 0) + count
+
+    def _to_buckets(self):
+        values, self._values = self._values, None
+        for value in values:
+            self._add_bucket(value, 1)
+
+    def merge(self, other):
+        """Add all values of other, return self."""
+        if other.count == 0:
+            return self
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.sum += other.sum
+
+        if self._values is not None and other._values is not None:
+            self._values.extend(other._values)
+            if len(self._values) > self.exact_limit:
+                self._to_buckets()
+            return self
+
+        if self._values is not None:
+            self._to_buckets()
+        if other._values is not None:
+            for value in other._values:
+                self._add_bucket(value, 1)
+        else:
+            self._zeros += other._zeros
+            for index, count in other._buckets.items():
+                self._buckets[index] = self._buckets.get(index, 0) + count
+        return self
+
+    def quantile(self, q):
+        """
+        Return the q-quantile (0 <= q <= 1) as a float, None if there are no
+        values.
+
+        percentile p is quantile(p / 100.).
+        """
+        if self.count == 0:
+            return None
+
+        if self._values is not None:
+            # weighted the same way as numpy.percentile, so that the results
+            # are the same to the last digit
+            values = sorted(self._values)
+            pos = q * (len(values) - 1)
+            low = int(floor(pos))
+            high = min(low + 1, len(values) - 1)
+            weight = pos - low
+            return float(values[low] * (1.0 - weight) + values[high] * weight)
+
+        rank = int(floor(q * (self.count - 1)))
+        seen = self._zeros
+        if rank < seen:
+            return float(max(0, self.min))
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank < seen:
+                # midpoint of the bucket in terms of relative error
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return float(min(max(value, self.min), self.max))
+        return float(self.max)
@@ -0,0 +1,150 @@
+#!/bin/python
+"""Persistent results of mlogfilter queries (.mtcache sidecar files)."""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from mtools.util.logindex import LogIndex, file_identity
+
+
+class ResultCache(object):
+    """
+    On-disk cache of the lines that mlogfilter queries matched in a log file.
+
+    Each entry stores the byte offsets of the matching lines of one query
+    and the states of the stateful filters before each of them (see
+    BaseFilter.state), keyed by --exclude and the cache keys of the active
+    filters (see BaseFilter.cache_key). The entries are kept next to the log
+    file in <logfile>.mtcache/, or in ~/.mtools/cache/ if the log file's
+    directory is not writable, and are valid for the file with the same
+    inode, size, modification time and first bytes (see LogIndex). Unlike
+    the index, they are not extended when the file grows.
+
+    An entry holds a header line with the query and lines with the offsets
+    and states, so that the queries can be compared without loading them.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.identity = file_identity(self.path, LogIndex.head_size)
+
+    def directories(self):
+        """Return the possible locations of the cache entries."""
+        digest = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        home = os.path.join(os.path.expanduser('~'), '.mtools', 'cache',
+                            digest)
+        return [self.path + '.mtcache', home]
+
+    @staticmethod
+    def _normalize(filters):
+        """Return filters as they are after a round trip through JSON."""
+        return json.loads(json.dumps(filters, sort_keys=True))
+
+    @staticmethod
+    def _name(filters, exclude):
+        """Return the file name of the entry of a query."""
+        key = json.dumps([exclude, filters], sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.mtres'
+
+    def _entries(self):
+        """Yield (path, header) for the entries of this log file."""
+        for directory in self.directories():
+            try:
+                names = os.listdir(directory)
+            except EnvironmentError:
+                continue
+            for name in names:
+                if not name.endswith('.mtres'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, 'r') as f:
+                        header = json.loads(f.readline())
+                    if (header.get('version') != self.version or
+                            header.get('path') != self.path):
+                        continue
+                except (EnvironmentError, ValueError):
+                    continue
+                if header.get('identity') != self.identity:
+                    # the log file has changed, the entry can't be used again
+                    try:
+                        os.remove(path)
+                    except EnvironmentError:
+                        pass
+                    continue
+                yield path, header
+
+    def find(self, filters, exclude, stateless=()):
+        """
+        Return (offsets, states, exact) of the best entry for a query.
+
+        filters maps the names of the active filters to their cache keys.
+        The entry of the same query is used if there is one. Without
+        exclude, the entry of a query with only some of the filters (and the
+        same keys for them) is used if the other filters are all stateless,
+        as their lines are among the lines of that query. states is None if
+        the query has no stateful filters, exact is True for the entry of the
+        same query. Returns None if there is no entry that can be used.
+        """
+        filters = self._normalize(filters)
+        best = None
+        exact = False
+        for path, header in self._entries():
+            cached = header['filters']
+            if header['exclude'] == exclude and cached == filters:
+                best = path, header
+                exact = True
+                break
+            if (exclude or header['exclude'] or not cached or
+                    any(filters.get(name) != key
+                        for name, key in cached.items()) or
+                    not set(filters).difference(cached) <= set(stateless)):
+                continue
+            if best is None or header['count'] < best[1]['count']:
+                best = path, header
+
+        if best is None:
+            return None
+        path, header = best
+        try:
+            with open(path, 'r') as f:
+                f.readline()
+                offsets = json.loads(f.readline())
+                states = json.loads(f.readline())
+        except (EnvironmentError, ValueError):
+            return None
+        if (len(offsets) != header['count'] or
+                states is not None and len(states) != len(offsets)):
+            return None
+        return offsets, states, exact
+
+    def save(self, filters, exclude, offsets, states=None):
+        """Write the entry of a query atomically, return the path or None."""
+        filters = self._normalize(filters)
+        header = {'version': self.version, 'path': self.path,
+                  'identity': self.identity, 'exclude': exclude,
+                  'filters': filters, 'count': len(offsets)}
+        name = self._name(filters, exclude)
+
+        for directory in self.directories():
+            path = os.path.join(directory, name)
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                                suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    f.write(json.dumps(header, sort_keys=True) + '\n')
+                    f.write(json.dumps(offsets) + '\n')
+                    f.write(json.dumps(states) + '\n')
+                if os.name == 'nt' and os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp_path, path)
+                return path
+            except EnvironmentError:
+                continue
+        return None
@@ -0,0 +1,186 @@
+#!/bin/python
+"""Random samples of log events, for mlogfilter and mplotqueries."""
+
+import random
+from math import exp, floor, log
+
+
+class BernoulliSampler(object):
+    """
+    Keep each item independently with probability rate.
+
+    keep() only takes a random draw, so it can be used as a raw predicate
+    (see LogFile.raw_predicate) and lines that are sampled out are never
+    parsed.
+    """
+
+    def __init__(self, rate, seed=None):
+        self.rate = rate
+        self.random = random.Random(seed).random
+
+    def keep(self, item=None):
+        """Return True if the item is in the sample."""
+        return self.random() < self.rate
+
+
+class ReservoirSampler(object):
+    """
+    Keep a uniform random sample of at most n items of a stream.
+
+    Uses Algorithm L (Li, 1994): once the reservoir is full, the number of
+    items until the next one that goes into the reservoir is drawn from a
+    geometric distribution, so items that are skipped don't cost a random
+    draw. wants() counts an item and returns True if it goes into the
+    reservoir, in which case it has to be passed to put(). Items that are
+    skipped don't have to be looked at, wants() can be a raw predicate.
+    items() returns the sample in stream order.
+    """
+
+    def __init__(self, n, seed=None, rng=None):
+        self.n = n
+        self.random = rng or random.Random(seed)
+        self.seen = 0
+        # list of (position in the stream, item)
+        self.reservoir = []
+        # the position of the next item for the full reservoir, starting
+        # from the last position that fills it
+        self._next = n - 1
+        self._w = 1.0
+        self._draw_next()
+
+    def _uniform(self):
+        """Return a random number in (0, 1)."""
+        while True:
+            u = self.random.random()
+            if u > 0:
+                return u
+
+    def _draw_next(self):
+        self._w *= exp(log(self._uniform()) / self.n)
+        self._next += (int(floor(log(self._uniform()) / log(1 - self._w))) +
+                       1)
+
+    def wants(self, item=None):
+        """Count an item, return True if it goes into the reservoir."""
+        position = self.seen
+        self.seen += 1
+        return position < self.n or position == self._next
+
+    def put(self, item, position=None):
+        """Add the item that wants() was True for last."""
+        if position is None:
+            position = self.seen - 1
+        if len(self.reservoir) < self.n:
+            self.reservoir.append((position, item))
+        else:
+            self.reservoir[self.random.randrange(self.n)] = (position, item)
+            self._draw_next()
+
+    def add(self, item):
+        """Count an item and keep it if it goes into the reservoir."""
+        if self.wants():
+            self.put(item)
+
+    def __len__(self):
+        return len(self.reservoir)
+
+    def items(self):
+        """Return the sampled items in stream order."""
+        return [item for _, item in sorted(self.reservoir,
+                                           key=lambda entry: entry[0])]
+
+
+class StratifiedSampler(object):
+    """
+    Keep a reservoir of at most n items for each group of a stream.
+
+    key(item) returns the group of an item, e.g. namespace and operation of
+    a log event, so that rare groups are represented as well as frequent
+    ones. items() returns the samples of all groups in stream order.
+    """
+
+    def __init__(self, n, key, seed=None):
+        self.n = n
+        self.key = key
+        self.random = random.Random(seed)
+        self.seen = 0
+        self.groups = {}
+
+    def add(self, item):
+        """Count an item and keep it if it goes into its group's reservoir."""
+        position = self.seen
+        self.seen += 1
+
+        group = self.key(item)
+        reservoir = self.groups.get(group)
+        if reservoir is None:
+            reservoir = self.groups[group] = ReservoirSampler(self.n,
+                                                              rng=self.random)
+        if reservoir.wants():
+            reservoir.put(item, position)
+
+    def __len__(self):
+        return sum(len(reservoir) for reservoir in self.groups.values())
+
+    def items(self):
+        """Return the sampled items of all groups in stream order."""
+        entries = [entry for reservoir in self.groups.values()
+                   for entry in reservoir.reservoir]
+        return [item for _, item in sorted(entries,
+                                           key=lambda entry: entry[0])]
+
+
+def operation_key(logevent):
+    """Return the stratum of a log event: namespace and operation."""
+    return (logevent.namespace, logevent.operation)
+
+
+def add_sample_arguments(argparser):
+    """Add the arguments for sampler_from_args() to argparser."""
+    argparser.add_argument('--sample', action='store', type=float,
+                           metavar='RATE',
+                           help=("only use a random sample of the matching "
+                                 "lines, each with probability RATE "
+                                 "(0 < RATE <= 1)."))
+    argparser.add_argument('--sample-n', action='store', type=int,
+                           metavar='N',
+                           help=("only use a uniform random sample of N "
+                                 "matching lines, in log order."))
+    argparser.add_argument('--stratify', action='store_true',
+                           help=("with --sample-n, sample N lines of each "
+                                 "namespace and operation so that rare "
+                                 "operations are kept."))
+    argparser.add_argument('--sample-seed', action='store', type=int,
+                           metavar='SEED',
+                           help=("seed for the random sample, to get the "
+                                 "same sample again."))
+
+
+def sampler_from_args(args):
+    """
+    Return the sampler for the arguments of add_sample_arguments().
+
+    Returns None if there is no sampling.
+    """
+    rate, n = args['sample'], args['sample_n']
+    seed = args['sample_seed']
+
+    if rate is not None and n is not None:
+        raise SystemExit('Error: use either --sample or --sample-n.')
+    if args['stratify'] and n is None:
+        raise SystemExit('Error: --stratify needs --sample-n.')
+
+    if rate is not None:
+        if not 0 < rate <= 1:
+            raise SystemExit('Error: --sample needs a rate between 0 and 1.')
+        return BernoulliSampler(rate, seed)
+
+    if n is not None:
+        if n < 1:
+            raise SystemExit('Error: --sample-n needs a positive number of '
+                             'lines.')
+        if args['stratify']:
+            return StratifiedSampler(n, operation_key, seed)
+        return ReservoirSampler(n, seed)
+
+    return None